@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+HTTP压测客户端
+模拟大量并发客户端轮询 /api/files、/api/batch_status，上传文件并下载结果，统计各接口的延迟分位数和吞吐量
+
+用法:
+    # 先用桩引擎启动服务，避免真实推理占满CPU影响测量
+    python3 temp/voicere_web.py --stub-engine 0.5,0.05
+    python3 load_test.py [--url http://localhost:5002] [--clients 200] [--duration 30]
+依赖: pip install requests numpy
+注意: 每次上传都使用新文件名，压测产生的文件会留在服务端 uploads/ 中，请使用单独的测试部署
+"""
+
+import argparse
+import io
+import json
+import random
+import threading
+import time
+import wave
+
+import numpy as np
+import requests
+
+DEFAULT_MIX = 'files=4,batch_status=4,upload=1,download_result=1'
+SAMPLE_RATE = 16000
+
+def make_wav(seconds, seed=0):
+    """生成一段16位PCM测试音频（正弦波加噪声）"""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    samples = 0.3 * np.sin(2 * np.pi * 220 * t) + 0.05 * rng.standard_normal(len(t))
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(SAMPLE_RATE)
+        wav.writeframes((samples * 32767).astype('<i2').tobytes())
+    return buffer.getvalue()
+
+def parse_mix(mix):
+    """解析接口权重，如 "files=4,upload=1" """
+    weights = {}
+    for item in mix.split(','):
+        name, weight = item.split('=')
+        weights[name.strip()] = float(weight)
+    unknown = set(weights) - set(ENDPOINTS)
+    if unknown:
+        raise ValueError(f"未知的接口: {', '.join(unknown)}。支持: {', '.join(ENDPOINTS)}")
+    return weights
+
+def call_files(session, url, state):
+    response = session.get(f'{url}/api/files')
+    return response.ok and 'upload_files' in response.json()
+
+def call_batch_status(session, url, state):
+    response = session.get(f'{url}/api/batch_status')
+    return response.ok and 'running' in response.json()
+
+def call_upload(session, url, state):
+    name = f"loadtest_{state['client']}_{state['uploads']}.wav"
+    state['uploads'] += 1
+    response = session.post(f'{url}/api/upload', files={'files': (name, state['wav'], 'audio/wav')})
+    return response.ok and name in response.json().get('files', [])
+
+def call_download_result(session, url, state):
+    response = session.get(f'{url}/api/download_result')
+    # 没有结果时服务端返回 {'error': ...}，也算成功响应
+    return response.ok and ('results' in response.json() or 'error' in response.json())
+
+ENDPOINTS = {
+    'files': call_files,
+    'batch_status': call_batch_status,
+    'upload': call_upload,
+    'download_result': call_download_result,
+}
+
+def percentile(values, q):
+    """简单分位数"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q / 100))]
+
+def start_batch(url, wav, files, model):
+    """上传几个文件并启动一个批处理，让 batch_status 和 download_result 有真实内容"""
+    names = [f'loadtest_batch_{i}.wav' for i in range(files)]
+    response = requests.post(f'{url}/api/upload',
+                             files=[('files', (name, wav, 'audio/wav')) for name in names])
+    response.raise_for_status()
+    paths = [f'uploads/{name}' for name in names]
+    response = requests.post(f'{url}/api/process_batch', json={'files': paths, 'model': model})
+    print(f"批处理: {response.json().get('message') or response.json().get('error')}")
+
+def run(url, clients, duration, mix, upload_seconds, seed):
+    """启动并发客户端，持续duration秒，返回各接口的统计"""
+    weights = parse_mix(mix)
+    names = list(weights)
+    wav = make_wav(upload_seconds, seed)
+    samples = {name: [] for name in names}
+    errors = {name: 0 for name in names}
+    lock = threading.Lock()
+    deadline = time.time() + duration
+
+    def client(index):
+        rng = random.Random(seed + index)
+        session = requests.Session()
+        state = {'client': index, 'uploads': 0, 'wav': wav}
+        while time.time() < deadline:
+            name = rng.choices(names, weights=[weights[n] for n in names])[0]
+            start = time.time()
+            try:
+                ok = ENDPOINTS[name](session, url, state)
+            except (requests.RequestException, ValueError):
+                ok = False
+            latency = time.time() - start
+            with lock:
+                samples[name].append(latency)
+                if not ok:
+                    errors[name] += 1
+
+    threads = [threading.Thread(target=client, args=(i,), daemon=True) for i in range(clients)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+
+    report = {'url': url, 'clients': clients, 'duration': round(elapsed, 2), 'endpoints': {}}
+    for name in names:
+        latencies = samples[name]
+        report['endpoints'][name] = {
+            'requests': len(latencies),
+            'errors': errors[name],
+            'throughput': round(len(latencies) / elapsed, 2),
+            'p50_ms': round(percentile(latencies, 50) * 1000, 1),
+            'p99_ms': round(percentile(latencies, 99) * 1000, 1),
+            'max_ms': round(max(latencies, default=0) * 1000, 1)
+        }
+    return report
+
+def print_report(report):
+    """打印各接口统计表"""
+    print(f"\n=== 压测结果 ({report['clients']}个客户端, {report['duration']}秒) ===")
+    print(f"{'接口':<18}{'请求数':>8}{'错误':>6}{'吞吐(次/秒)':>12}{'P50(ms)':>10}{'P99(ms)':>10}{'最大(ms)':>10}")
+    for name, stats in report['endpoints'].items():
+        print(f"{name:<18}{stats['requests']:>8}{stats['errors']:>6}{stats['throughput']:>12}"
+              f"{stats['p50_ms']:>10}{stats['p99_ms']:>10}{stats['max_ms']:>10}")
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description='并发压测Web服务的HTTP接口')
+    parser.add_argument('--url', default='http://localhost:5002')
+    parser.add_argument('--clients', type=int, default=200, help='并发客户端数')
+    parser.add_argument('--duration', type=float, default=30, help='压测时长（秒）')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f'各接口的请求权重，默认 {DEFAULT_MIX}')
+    parser.add_argument('--upload-seconds', type=float, default=5, help='上传测试音频的时长')
+    parser.add_argument('--batch-files', type=int, default=0, help='压测前上传并启动批处理的文件数')
+    parser.add_argument('--model', default='tiny', help='批处理使用的模型（桩引擎下不会真正加载）')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='把统计结果另存为JSON')
+    args = parser.parse_args()
+
+    if args.batch_files:
+        start_batch(args.url, make_wav(args.upload_seconds, args.seed), args.batch_files, args.model)
+    report = run(args.url, args.clients, args.duration, args.mix, args.upload_seconds, args.seed)
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+流式转录测试客户端
+按实时速度回放WAV文件到 /ws/stream，打印部分结果并统计延迟
+
+用法: python3 stream_client.py audio.wav [--url ws://localhost:5002/ws/stream] [--model base]
+依赖: pip install websocket-client numpy
+"""
+
+import argparse
+import json
+import threading
+import time
+import wave
+
+import numpy as np
+import websocket
+
+FRAME_SECONDS = 0.1  # 每帧发送100ms音频
+
+def read_wav(path):
+    """读取16位PCM WAV，返回 (单声道int16数组, 采样率)"""
+    with wave.open(path, 'rb') as wav:
+        if wav.getsampwidth() != 2:
+            raise ValueError('只支持16位PCM WAV，请先用ffmpeg转换: ffmpeg -i in.mp3 -ar 16000 -ac 1 out.wav')
+        channels = wav.getnchannels()
+        sample_rate = wav.getframerate()
+        data = np.frombuffer(wav.readframes(wav.getnframes()), dtype='<i2')
+    if channels > 1:
+        data = data.reshape(-1, channels).mean(axis=1).astype('<i2')
+    return data, sample_rate
+
+def percentile(values, q):
+    """简单分位数"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q / 100))]
+
+def run(path, url, model, language):
+    """回放音频并收集服务端结果"""
+    samples, sample_rate = read_wav(path)
+    frame_size = int(sample_rate * FRAME_SECONDS)
+    duration = len(samples) / sample_rate
+    print(f"回放文件: {path} ({duration:.1f}秒, {sample_rate}Hz)")
+
+    ws = websocket.create_connection(url)
+    ws.send(json.dumps({
+        'format': 'pcm_s16le',
+        'sample_rate': sample_rate,
+        'model': model,
+        'language': language
+    }))
+    ready = json.loads(ws.recv())
+    if ready.get('type') == 'queued':
+        print(f"⏳ 服务端内存不足，排队等待准入 (预计需要 {ready.get('estimate_gb')}GB)")
+        ready = json.loads(ws.recv())
+    if ready.get('type') != 'ready':
+        print(f"❌ 服务端拒绝: {ready.get('error')}")
+        return
+
+    lags = []
+    final = {}
+    stream_start = time.time()
+
+    def receive():
+        while True:
+            message = json.loads(ws.recv())
+            if message['type'] == 'partial':
+                # 延迟 = 收到结果时的墙钟时间 - 该结果覆盖到的音频时间
+                lag = (time.time() - stream_start) - message['audio_time']
+                lags.append(lag)
+                print(f"[{message['audio_time']:7.1f}s 延迟{lag:5.2f}s] {message['committed'][-40:]}|{message['tentative']}")
+            elif message['type'] == 'final':
+                final.update(message)
+                return
+            else:
+                print(f"❌ {message}")
+                return
+
+    receiver = threading.Thread(target=receive, daemon=True)
+    receiver.start()
+
+    # 按实时速度发送：第i帧的音频要到 stream_start + (i+1)*FRAME_SECONDS 才"录完"，此时发出
+    for i, offset in enumerate(range(0, len(samples), frame_size)):
+        delay = stream_start + (i + 1) * FRAME_SECONDS - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        ws.send_binary(samples[offset:offset + frame_size].tobytes())
+    ws.send(json.dumps({'event': 'end'}))
+
+    receiver.join()
+    ws.close()
+
+    print("\n=== 最终结果 ===")
+    print(final.get('text', ''))
+    print("\n=== 延迟统计 ===")
+    print(f"部分结果数: {len(lags)}")
+    if lags:
+        print(f"平均延迟: {sum(lags) / len(lags):.2f}秒")
+        print(f"P50延迟: {percentile(lags, 50):.2f}秒")
+        print(f"P95延迟: {percentile(lags, 95):.2f}秒")
+        print(f"最大延迟: {max(lags):.2f}秒")
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description='按实时速度回放WAV到流式转录接口')
+    parser.add_argument('wav', help='16位PCM WAV文件')
+    parser.add_argument('--url', default='ws://localhost:5002/ws/stream')
+    parser.add_argument('--model', default='base')
+    parser.add_argument('--language', default='zh')
+    args = parser.parse_args()
+    run(args.wav, args.url, args.model, args.language)
+
+if __name__ == '__main__':
+    main()
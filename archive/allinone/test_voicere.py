@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Web应用的回归测试
+Web应用以字符串形式内嵌在voicere.py中，这里先写出到临时目录再导入，不需要模型和conda环境
+
+用法: python3 -m pytest archive/allinone/test_voicere.py
+依赖: pip install pytest flask flask-sock numpy（用到模型的测试另需torch和openai-whisper，ONNX一致性测试需要onnx和onnxruntime，缺少时跳过）
+"""
+
+import importlib.util
+import json
+import math
+import os
+import sys
+import threading
+import time
+import wave
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import voicere  # noqa: E402
+
+@pytest.fixture(scope='module')
+def web(tmp_path_factory):
+    """在临时工作目录中写出并导入Web应用（uploads/、cache/等目录都建在这里）"""
+    workdir = tmp_path_factory.mktemp('voicere')
+    previous = os.getcwd()
+    os.chdir(workdir)
+    try:
+        path = voicere.write_web_app_script()
+        spec = importlib.util.spec_from_file_location('voicere_web', path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        yield module
+    finally:
+        os.chdir(previous)
+
+# 随机权重的小Whisper模型（词表和mel维度与tiny相同），测试不需要下载模型
+RANDOM_WHISPER_DIMS = dict(n_mels=80, n_audio_ctx=1500, n_audio_state=64, n_audio_head=2, n_audio_layer=1,
+                           n_vocab=51865, n_text_ctx=448, n_text_state=64, n_text_head=2, n_text_layer=1)
+
+def random_whisper_model(seed=0):
+    """随机权重的小Whisper模型；whisper用torch.empty创建解码器位置编码，这里同样随机初始化，避免未初始化内存里的NaN"""
+    import torch
+    from whisper.model import ModelDimensions, Whisper
+    torch.manual_seed(seed)
+    model = Whisper(ModelDimensions(**RANDOM_WHISPER_DIMS))
+    torch.nn.init.normal_(model.decoder.positional_embedding, std=0.02)
+    return model.eval()
+
+@pytest.fixture
+def random_whisper(web, monkeypatch):
+    """用随机权重的小Whisper模型代替下载的模型（不需要网络和模型文件），并清空常驻引擎"""
+    pytest.importorskip('torch')
+    pytest.importorskip('whisper')
+
+    def load(model_name, precision='fp32'):
+        return random_whisper_model()
+
+    monkeypatch.delenv(web.STUB_ENGINE_ENV, raising=False)
+    monkeypatch.setattr(web, 'load_whisper_model', load)
+    monkeypatch.setattr(web, '_resident_engines', {})
+    return load
+
+def write_tone(path, seconds=1.0, sample_rate=16000):
+    """写出一段16位单声道正弦波WAV，返回路径"""
+    t = [i / sample_rate for i in range(int(seconds * sample_rate))]
+    samples = b''.join(int(8000 * math.sin(2 * math.pi * 440 * x)).to_bytes(2, 'little', signed=True) for x in t)
+    with wave.open(str(path), 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes(samples)
+    return str(path)
+
+class FakeSocket:
+    """按顺序回放客户端消息的WebSocket替身，记录服务端发出的消息"""
+
+    def __init__(self, messages):
+        self.incoming = list(messages)
+        self.sent = []
+
+    def receive(self, timeout=None):
+        # timeout=0是服务端在取积压的帧，这里模拟客户端按实时速度发送、没有积压
+        if timeout == 0 or not self.incoming:
+            return None
+        return self.incoming.pop(0)
+
+    def send(self, message):
+        self.sent.append(json.loads(message))
+
+def run_stream_sessions(web, count, seconds=2):
+    """并发运行若干个流式会话（每个都发送seconds秒的16位PCM），返回各会话收到的消息"""
+    tone = web.np.sin(2 * web.np.pi * 440 * web.np.arange(web.SAMPLE_RATE) / web.SAMPLE_RATE) * 0.3
+    frame = (tone * 32767).astype('<i2').tobytes()
+    sockets = [FakeSocket([frame] * seconds + [json.dumps({'event': 'end'})]) for _ in range(count)]
+    errors = []
+
+    def run(ws):
+        try:
+            web.stream_session(ws, 'base', {'precision': 'fp32', 'backend': 'pytorch'}, 'pcm_s16le',
+                               web.SAMPLE_RATE, 'zh', 0.0)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run, args=(ws,)) for ws in sockets]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(120)
+    assert errors == []
+    return [ws.sent for ws in sockets]
+
+def test_job_results_etag_changes_when_results_are_appended(web):
+    """任务运行中追加结果后，同一游标的重新验证不能返回304（即使这一页的内容没变），total要更新"""
+    job = web.register_job('tiny', 2)
+    job['results'].append({'index': 0, 'file': 'a.wav', 'status': 'completed'})
+    client = web.app.test_client()
+
+    first = client.get(f"/api/jobs/{job['id']}/results?fields=summary&limit=1")
+    assert first.status_code == 200
+    assert first.get_json()['total'] == 1
+    etag = first.headers['ETag']
+    assert client.get(f"/api/jobs/{job['id']}/results?fields=summary&limit=1",
+                      headers={'If-None-Match': etag}).status_code == 304
+
+    job['results'].append({'index': 1, 'file': 'b.wav', 'status': 'completed'})
+    second = client.get(f"/api/jobs/{job['id']}/results?fields=summary&limit=1", headers={'If-None-Match': etag})
+    assert second.status_code == 200
+    assert second.headers['ETag'] != etag
+    assert second.get_json()['total'] == 2
+
+    job['finished'] = True
+    third = client.get(f"/api/jobs/{job['id']}/results?fields=summary&limit=1",
+                       headers={'If-None-Match': second.headers['ETag']})
+    assert third.status_code == 200
+    assert third.get_json()['next_cursor'] == 1
+
+def brute_force_overlaps(turns, segment):
+    """逐个轮次累加各说话人与片段的重叠时长（对照实现）"""
+    totals = {}
+    for turn in turns:
+        overlap = min(segment['end'], turn['end']) - max(segment['start'], turn['start'])
+        if overlap > 0:
+            totals[turn['speaker']] = totals.get(turn['speaker'], 0.0) + overlap
+    return totals
+
+def test_speaker_assignment_with_spanning_turn(web):
+    """一个横跨整场会议的背景说话人不能让每个查询的候选范围扩大到全部轮次（曾导致内存耗尽）"""
+    np = web.np
+    rng = np.random.default_rng(0)
+    starts = np.cumsum(rng.uniform(0.5, 6.0, 50000))
+    turns = [{'start': float(start), 'end': float(start + length), 'speaker': f'SPEAKER_{rng.integers(8):02d}'}
+             for start, length in zip(starts, rng.uniform(0.5, 6.0, len(starts)))]
+    turns.append({'start': 0.0, 'end': float(starts[-1] + 10), 'speaker': 'BACKGROUND'})
+    segment_starts = np.sort(rng.uniform(0, starts[-1], 20000))
+    segments = [{'start': float(start), 'end': float(start + length), 'text': '片段'}
+                for start, length in zip(segment_starts, rng.uniform(1.0, 10.0, len(segment_starts)))]
+
+    index = web.TurnIndex(turns)
+    assert len(index) == len(turns)
+    overlaps = index.overlaps([s['start'] for s in segments], [s['end'] for s in segments])
+    assert overlaps.shape == (len(segments), len(index.speakers))
+
+    background = index.speakers.index('BACKGROUND')
+    for k in rng.choice(len(segments), 20, replace=False):
+        expected = brute_force_overlaps(turns, segments[k])
+        for speaker, total in expected.items():
+            assert overlaps[k, index.speakers.index(speaker)] == pytest.approx(total)
+        assert overlaps[k, background] == pytest.approx(segments[k]['end'] - segments[k]['start'])
+
+def test_speaker_assignment_matches_brute_force(web):
+    """长短混合、互相重叠的轮次下，分配结果与逐个扫描累加重叠时长一致"""
+    np = web.np
+    rng = np.random.default_rng(1)
+    for _ in range(200):
+        turns = [{'start': float(start), 'end': float(start + rng.choice([0.0, 0.3, 2.0, 40.0]) * rng.random()),
+                  'speaker': f'S{rng.integers(3)}'} for start in rng.uniform(0, 60, rng.integers(0, 20))]
+        segments = [{'start': float(start), 'end': float(start + rng.uniform(0, 8))} for start in rng.uniform(-5, 65, 10)]
+        assigned = web.TurnIndex(turns).assign([s['start'] for s in segments], [s['end'] for s in segments])
+        for segment, speaker in zip(segments, assigned):
+            expected = brute_force_overlaps(turns, segment)
+            if not expected:
+                assert speaker is None
+            else:
+                assert expected[speaker] == pytest.approx(max(expected.values()))
+
+def test_files_are_admitted_when_budget_is_smaller_than_model(web, tmp_path, monkeypatch):
+    """预算小于模型时，批次和 /api/benchmark 自己持有的模型预留不算其它任务，文件逐个准入而不是一直等待"""
+    monkeypatch.setenv(web.STUB_ENGINE_ENV, '0.0')
+    monkeypatch.setattr(web, 'admission', web.AdmissionController(budget_bytes=web.MODEL_MEMORY_BYTES['medium'] // 2))
+    paths = [write_tone(tmp_path / f'{i}.wav') for i in range(3)]
+    options, error = web.parse_job_options({'model': 'medium'})
+    assert error is None
+
+    status = web.new_batch_status()
+    worker = threading.Thread(target=web.process_batch_files, args=(paths, 'medium', options),
+                              kwargs={'status': status, 'persist': False}, daemon=True)
+    worker.start()
+    worker.join(30)
+    status['running'] = False
+    assert not worker.is_alive(), status['current_step']
+    assert [result['status'] for result in status['results']] == ['completed'] * len(paths)
+    assert web.admission.reserved == 0
+
+    deadline = time.time() + 30
+    with web.admission.hold(web.MODEL_MEMORY_BYTES['medium']):
+        result = web.process_single_file(paths[0], 'medium', options, cancelled=lambda: time.time() > deadline)
+    assert result['status'] == 'completed', result.get('error')
+    assert web.admission.reserved == 0
+
+def test_resident_engine_serializes_concurrent_decodes(web, random_whisper):
+    """多个线程共用同一常驻引擎解码和语言识别时互不破坏KV缓存钩子（曾出现KeyError和reshape错误）"""
+    engine = web.get_resident_engine('tiny', {})
+    audio = web.np.random.default_rng(0).standard_normal(web.SAMPLE_RATE * 3).astype(web.np.float32) * 0.1
+    errors = []
+
+    def decode():
+        try:
+            for _ in range(3):
+                engine.transcribe(audio, language='zh', temperature=0.0, condition_on_previous_text=False, sample_len=32)
+                engine.detect_language([audio])
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=decode) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+
+def test_concurrent_stream_sessions_share_resident_engine(web, monkeypatch):
+    """两个流式会话同时使用同一常驻引擎（桩引擎）时各自完整返回部分结果和最终结果"""
+    monkeypatch.setenv(web.STUB_ENGINE_ENV, '0.05')
+    monkeypatch.setattr(web, '_resident_engines', {})
+    for sent in run_stream_sessions(web, 2):
+        assert [message['type'] for message in sent] == ['ready', 'partial', 'partial', 'final']
+        assert sent[-1]['text'] == web.STUB_SEGMENT_TEXTS[0]
+        assert sent[-1]['audio_time'] == 2.0
+    assert len(web._resident_engines) == 1
+
+def test_concurrent_stream_sessions_with_real_model(web, random_whisper):
+    """冒烟测试：两个流式会话在同一个真实（随机权重）Whisper模型上同时解码不会崩溃"""
+    for sent in run_stream_sessions(web, 2):
+        assert sent[0]['type'] == 'ready'
+        assert sent[-1]['type'] == 'final'
+
+def test_word_alignment_on_resident_engine_during_decoding(web, random_whisper):
+    """在常驻模型上做词级对齐的同时其它线程用同一模型解码，两边都不出错、对齐结果完整"""
+    engine = web.get_resident_engine('tiny', {})
+    audio = web.np.random.default_rng(0).standard_normal(web.SAMPLE_RATE * 4).astype(web.np.float32) * 0.1
+    regions = [{'start': 0.0, 'end': 4.0, 'language': 'zh'}]
+    errors = []
+    aligned = []
+
+    def decode():
+        try:
+            for _ in range(3):
+                engine.transcribe(audio, language='zh', temperature=0.0, condition_on_previous_text=False, sample_len=32)
+        except Exception as e:
+            errors.append(e)
+
+    def align():
+        try:
+            for _ in range(6):
+                segments = [{'start': 0.0, 'end': 2.0, 'text': '今天天气很好'}, {'start': 2.0, 'end': 4.0, 'text': '我们出去走走'}]
+                web.align_segment_words(audio, segments, regions, 'tiny', {})
+                aligned.append(all(segment.get('words') for segment in segments))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=decode), threading.Thread(target=align)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert aligned == [True] * 6
+
+def test_stitch_overlapping_chunks(web):
+    """重叠的分块按中点拼接：整个落在前一片段内的片段丢弃而不是变成负时长，边界处的重复文本和词去掉"""
+    chunks = [
+        {'start': 0.0, 'end': 32.0, 'segments': [
+            {'start': 0.0, 'end': 14.0, 'text': '第一句话'},
+            {'start': 14.0, 'end': 31.0, 'text': '第二句话很长'}]},
+        {'start': 28.0, 'end': 60.0, 'segments': [
+            {'start': 28.5, 'end': 30.5, 'text': '嗯对'},
+            {'start': 31.0, 'end': 40.0, 'text': '第三句话'},
+            {'start': 40.0, 'end': 58.0, 'text': '第四句话'}]},
+        {'start': 56.0, 'end': 70.0, 'segments': [
+            {'start': 56.5, 'end': 62.0, 'text': '句话然后结束', 'words': [
+                {'word': '句话', 'start': 56.5, 'end': 57.5}, {'word': '然后', 'start': 58.5, 'end': 60.0},
+                {'word': '结束', 'start': 60.0, 'end': 62.0}]}]}
+    ]
+    stitched = web.stitch_chunk_segments(chunks)
+    assert [segment['text'] for segment in stitched] == ['第一句话', '第二句话很长', '第三句话', '第四句话', '然后结束']
+    assert all(segment['start'] < segment['end'] for segment in stitched)
+    assert stitched[-1]['start'] == 58.0
+    assert [word['word'] for word in stitched[-1]['words']] == ['然后', '结束']
+
+def test_parse_job_options_validates_language_without_importing_whisper(web, monkeypatch):
+    """校验语言代码用静态集合，请求处理中不触发torch/whisper的延迟导入"""
+    monkeypatch.setattr(web, 'whisper', web.LazyModule('whisper'))
+    options, error = web.parse_job_options({'language': 'yue'})
+    assert error is None and options['language'] == 'yue'
+    assert web.parse_job_options({'language': 'xx'})[0] is None
+    assert not web.whisper.loaded
+
+    tokenizer = pytest.importorskip('whisper.tokenizer')
+    assert web.WHISPER_LANGUAGES == set(tokenizer.LANGUAGES)
+
+def test_benchmark_runs_in_background_with_status_polling(web):
+    """/api/benchmark 立即返回，报告通过 /api/benchmark_status 轮询；运行中再次启动或批处理运行中返回409"""
+    client = web.app.test_client()
+    assert 'error' in client.post('/api/benchmark', json={'type': 'speaker_assignment', 'unknown': 1}).get_json()
+
+    started = client.post('/api/benchmark', json={'type': 'speaker_assignment', 'turns': 2000, 'segments': 500})
+    assert started.status_code == 202
+    deadline = time.time() + 60
+    while (status := client.get('/api/benchmark_status').get_json())['running'] and time.time() < deadline:
+        time.sleep(0.05)
+    assert status['error'] is None
+    assert status['type'] == 'speaker_assignment'
+    assert status['report']['turns'] == 2000
+    assert web.admission.reserved == 0
+
+    web.benchmark_status['running'] = True
+    try:
+        assert client.post('/api/benchmark', json={'type': 'speaker_assignment'}).status_code == 409
+    finally:
+        web.benchmark_status['running'] = False
+
+def test_onnx_backend_matches_pytorch(web, tmp_path, monkeypatch):
+    """固定片段上ONNX后端与PyTorch后端贪心解码的token和文本一致（没有安装onnxruntime时跳过）"""
+    pytest.importorskip('onnxruntime')
+    pytest.importorskip('onnx')
+    torch = pytest.importorskip('torch')
+    pytest.importorskip('whisper')
+    monkeypatch.delenv(web.STUB_ENGINE_ENV, raising=False)
+    # whisper.load_model也接受检查点路径，两个后端从同一个检查点加载（ONNX后端首次使用时导出计算图）
+    checkpoint = str(tmp_path / 'random.pt')
+    torch.save({'dims': RANDOM_WHISPER_DIMS, 'model_state_dict': random_whisper_model().state_dict()}, checkpoint)
+    audio = web.np.random.default_rng(0).standard_normal(web.SAMPLE_RATE * 3).astype(web.np.float32) * 0.1
+    options = {'language': 'zh', 'task': 'transcribe', 'temperature': 0.0, 'condition_on_previous_text': False,
+               'sample_len': 32}
+
+    expected = web.PyTorchEngine(checkpoint).transcribe(audio, **options)
+    actual = web.OnnxEngine(checkpoint).transcribe(audio, **options)
+    expected_tokens = [segment['tokens'] for segment in expected['segments']]
+    assert sum(len(tokens) for tokens in expected_tokens) > 0
+    assert [segment['tokens'] for segment in actual['segments']] == expected_tokens
+    assert actual['text'] == expected['text']
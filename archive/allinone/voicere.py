@@ -7,6 +7,7 @@ VoiceRecognize 完全独立版应用（使用Conda）
 
 import os
 import sys
+import argparse
 import subprocess
 import importlib
 import webbrowser
@@ -16,6 +17,26 @@ import json
 import threading
 from pathlib import Path
 
+# 启动时间线（--profile-startup）：记录main()各步骤和Web进程的导入耗时
+STARTUP_T0 = time.time()
+STARTUP_PROFILE_FILE = os.path.join('cache', 'benchmarks', 'startup.json')
+IMPORT_TIME_LOG = os.path.join('temp', 'web_importtime.log')
+WEB_APP_PORT = 5002  # Web脚本中app.run监听的端口
+STARTUP_READY_TIMEOUT = 600
+startup_timeline = []
+
+def profile_step(name, func, *args):
+    """执行一个启动步骤，并记录它在启动时间线上的起点和耗时"""
+    start = time.time()
+    try:
+        return func(*args)
+    finally:
+        startup_timeline.append({
+            'step': name,
+            'start': round(start - STARTUP_T0, 3),
+            'seconds': round(time.time() - start, 3)
+        })
+
 def check_conda():
     """检查conda是否可用"""
     try:
@@ -76,7 +97,7 @@ def install_dependencies(env_name):
         print("安装基础依赖...")
         subprocess.run([
             'conda', 'run', '-n', env_name, 'python', '-m', 'pip', 'install',
-            'flask', 'requests', 'tqdm', 'psutil', 'soundfile'
+            'flask', 'flask-sock', 'requests', 'tqdm', 'psutil', 'soundfile'
         ], check=True)
         print("✅ 基础依赖安装完成")
     except subprocess.CalledProcessError as e:
@@ -136,7 +157,7 @@ def check_dependencies(env_name):
 import sys
 import importlib
 
-deps = ['flask', 'torch', 'whisper', 'numpy', 'soundfile', 'psutil']
+deps = ['flask', 'flask_sock', 'torch', 'whisper', 'numpy', 'soundfile', 'psutil']
 missing = []
 
 for dep in deps:
@@ -233,137 +254,2928 @@ def find_free_port(start_port=5002):
             port += 1
     return None
 
-def start_web_app(env_name, port):
-    """启动Web应用"""
-    print(f"\n🚀 在环境 {env_name} 中启动Web应用...")
-    print(f"🌐 应用地址: http://localhost:{port}")
-    
-    # 创建简化的Web应用脚本
-    web_app_script = '''
+# Web应用脚本（在conda环境中运行）
+WEB_APP_FILE = os.path.join('temp', 'voicere_web.py')
+WEB_APP_SCRIPT = r'''
 import os
 import sys
+import io
+import gzip
 import json
+import math
 import time
+import hashlib
+import inspect
+import subprocess
 import threading
-from flask import Flask, render_template, request, jsonify, send_file
-import whisper
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+import numpy as np
+import queue
+import re
+import shutil
+import sqlite3
+import uuid
+import weakref
+from collections import OrderedDict
+from contextlib import contextmanager
+from flask import Flask, request, jsonify, send_file
+from flask_sock import Sock
 from werkzeug.utils import secure_filename
 
+class LazyModule:
+    """首次访问属性时才导入的模块代理，导入后依次执行注册的回调"""
+    
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+        self._hooks = []
+        self._lock = threading.Lock()
+    
+    @property
+    def loaded(self):
+        return self._module is not None
+    
+    def on_import(self, func):
+        """注册导入完成后的回调（可用作装饰器），回调参数为导入的模块"""
+        self._hooks.append(func)
+        return func
+    
+    def load(self):
+        with self._lock:
+            if self._module is None:
+                import importlib
+                module = importlib.import_module(self._name)
+                for hook in self._hooks:
+                    hook(module)
+                self._module = module
+        return self._module
+    
+    def __getattr__(self, name):
+        return getattr(self._module or self.load(), name)
+
+# torch/whisper的导入要好几秒，推迟到第一次推理或后台预热时，HTTP服务启动后立即可用
+whisper = LazyModule('whisper')
+
 app = Flask(__name__)
+sock = Sock(app)
 
 # 配置
 UPLOAD_FOLDER = 'uploads'
 PROCESSED_FOLDER = 'processed'
 TEMP_FOLDER = 'temp'
+CACHE_FOLDER = 'cache'
+REFERENCE_FOLDER = 'reference'  # 基准测试参考集：音频文件 + 同名.txt参考文本
 ALLOWED_EXTENSIONS = {'wav', 'mp3', 'm4a', 'flac', 'aac'}
+NATIVE_DECODE_FORMATS = {'wav', 'flac'}  # 进程内用soundfile解码，压缩格式才交给ffmpeg
+SAMPLE_RATE = 16000
+VALID_MODELS = ['tiny', 'base', 'small', 'medium', 'large']
+PRECISIONS = ('fp32', 'int8')  # int8为线性层动态量化，仅用于CPU推理
+BACKENDS = ('pytorch', 'onnx')  # onnx需要安装onnx与onnxruntime
+ASR_ENGINES = ('whisper', 'fireredasr', 'auto')  # auto按基准测试结果为中文任务选择引擎
+ROUTE_POLICIES = ('accurate', 'fastest')
+# Whisper的语言代码（与whisper.tokenizer.LANGUAGES相同），校验任务选项时不必为此导入torch/whisper
+WHISPER_LANGUAGES = frozenset(
+    'en zh de es ru ko fr ja pt tr pl ca nl ar sv it id hi fi vi he uk el ms cs ro da hu ta no th ur hr bg lt '
+    'la mi ml cy sk te fa lv bn sr az sl kn et mk br eu is hy ne mn bs kk sq sw gl mr pa si km sn yo so af oc '
+    'ka be tg sd gu am yi lo uz fo ht ps tk nn mt sa lb my bo tl mg as tt haw ln ha ba jw su yue'.split()
+)
+
+# FireRedASR（AED模型，需要单独检出FireRedASR仓库并下载预训练模型）
+FIREREDASR_DIR = os.environ.get('FIREREDASR_DIR', 'FireRedASR')
+FIREREDASR_MODEL_DIR = os.path.join(FIREREDASR_DIR, 'pretrained_models', 'FireRedASR-AED-L')
+FIREREDASR_MAX_SECONDS = 60  # AED模型单条输入上限
+FIREREDASR_BATCH_SIZE = 8
+FIREREDASR_DECODE_ARGS = {
+    'use_gpu': 0, 'beam_size': 3, 'nbest': 1, 'decode_max_len': 0,
+    'softmax_smoothing': 1.25, 'aed_length_penalty': 0.6, 'eos_length': 1.0
+}
+
+# 压测用桩引擎：设置环境变量 VOICERE_STUB_ENGINE="固定延迟秒[,每秒音频延迟秒]" 后所有识别引擎都替换为桩引擎
+STUB_ENGINE_ENV = 'VOICERE_STUB_ENGINE'
+STUB_SEGMENT_SECONDS = 5.0
+STUB_SEGMENT_TEXTS = ('这是桩引擎返回的固定文本。', '用于压测HTTP接口。', '不代表真实识别结果。')
+
+# 置信度门控的模型级联：先用小模型转录，只把可疑片段交给更大的常驻模型重解码
+CASCADE_CHAIN = ['tiny', 'base', 'small', 'medium', 'large']
+CASCADE_DEFAULT_THRESHOLDS = {
+    'avg_logprob': -0.8,  # 低于该值升级
+    'compression_ratio': 2.2,  # 高于该值升级（重复/幻觉）
+    'no_speech_prob': 0.6  # 高于该值升级（可能把噪声识别成了文字）
+}
+CASCADE_PADDING_SECONDS = 0.2  # 重解码时片段两侧多取的音频
+
+# 温度回退策略：Whisper默认在0.0,0.2,...,1.0上逐个重试，等价于 max_retries=5
+DEFAULT_DECODE_POLICY = {
+    'max_retries': 5,  # 每个30秒窗口最多回退几次
+    'temperature_step': 0.2,
+    'time_budget': None,  # 每个文件花在回退上的总秒数上限，None不限制
+    'no_speech_exit': None,  # 首次解码的no_speech_prob高于该值时不再回退
+    'compression_ratio_threshold': 2.4,
+    'logprob_threshold': -1.0,
+    'no_speech_threshold': 0.6
+}
+DECODE_POLICY_PRESETS = {
+    'default': {},
+    'fast': {'max_retries': 1, 'no_speech_exit': 0.6},
+    'greedy': {'max_retries': 0}
+}
+
+# 语言识别：在停顿处切出不超过30秒的窗口，抽样其中的语音窗口只跑编码器+一步解码
+LANGID_MODEL = 'base'  # 检测用的常驻模型，与任务所选模型无关，结果可跨模型复用
+LANGID_MAX_WINDOWS = 12  # 每个文件最多检测的窗口数
+LANGID_WINDOW_SECONDS = 30
+LANGID_MIN_SPEECH_RATIO = 0.2  # 语音帧占比低于该值的窗口不参与抽样
+LANGID_MIN_PROB = 0.5  # 低于该置信度的检测结果不采用，由相邻窗口的结果代替
+
+# 上传预处理：后台线程池探测编码信息、转成16kHz单声道float32原始文件并计算内容哈希，登记到目录
+INGEST_WORKERS = 2
+CATALOG_FILE = os.path.join(CACHE_FOLDER, 'catalog.json')
+CANONICAL_FOLDER = os.path.join(CACHE_FOLDER, 'canonical')  # <内容哈希>.f32
+
+# 进程内重采样：带限sinc插值（Hann窗），参数含义与torchaudio.functional.resample相同
+RESAMPLE_FILTER_WIDTH = 16
+RESAMPLE_ROLLOFF = 0.99
+RESAMPLE_MAX_FRAMES = 1 << 16  # 每次卷积最多计算的输出帧数，限制临时内存
+DECODE_BLOCK_SECONDS = 60  # 整段解码时每次从soundfile读取的时长
+
+# 解码后音频缓存（所有引擎共用），按字节数限制大小
+AUDIO_CACHE_MAX_BYTES = 512 * 1024 * 1024
+# log-mel特征缓存：按(音频哈希, n_mels, hop)以float16内存映射文件存放，超出上限时删除最久未用的
+MEL_CACHE_MAX_BYTES = 4 * 1024 * 1024 * 1024
+ONNX_OPSET = 17
+
+# 长文件分块并行转录配置
+LONG_FILE_THRESHOLD = 20 * 60  # 超过20分钟的文件在auto模式下走分块并行
+LONG_FILE_CHUNK_SECONDS = 120  # 每块最长时长
+LONG_FILE_MIN_CHUNK_SECONDS = 30  # 找停顿时每块至少这么长，避免切得太碎
+LONG_FILE_OVERLAP_SECONDS = 2.0  # 找不到停顿被迫硬切时，前后块的重叠时长
+LONG_FILE_WORKERS = max(1, min(4, (os.cpu_count() or 1) // 2))
+# 超长文件流式解码：边解码边按窗口转录，缓冲区只保留一个窗口，峰值内存与时长无关
+STREAM_DECODE_THRESHOLD = 2 * 60 * 60  # 超过2小时的文件在auto模式下走流式解码
+STREAM_DECODE_BLOCK_SECONDS = 10  # 每次从解码器读取的音频块
+STREAM_DECODE_WINDOW_SECONDS = LONG_FILE_CHUNK_SECONDS  # 缓冲区超过该时长时在停顿处切出窗口转录
+LONG_FILE_INTEROP_THREADS = 1  # 每个worker的inter-op线程数，分块之间已经是进程级并行
+THREAD_TUNING_CHUNK_SECONDS = 30  # 线程调优基准测试中每个任务的音频时长
+VAD_FRAME_SECONDS = 0.03
+VAD_MIN_PAUSE_SECONDS = 0.3
+
+# 内存准入控制：按模型大小和音频时长估计任务内存，放不下时排队等待
+GB = 1024 ** 3
+MODEL_MEMORY_BYTES = {  # CPU推理的粗略峰值（含加载时的临时副本）
+    'tiny': 1 * GB, 'base': 1 * GB, 'small': 2 * GB, 'medium': 5 * GB, 'large': 10 * GB,
+    'fireredasr': 5 * GB
+}
+PRECISION_MEMORY_FACTOR = {'fp32': 1.0, 'int8': 0.5}
+AUDIO_MEMORY_FACTOR = 3  # 每秒音频的float32样本之外，还有log-mel特征和填充副本
+MEMORY_BUDGET_FRACTION = 0.8  # 服务启动时可用内存中允许任务占用的比例
+MEMORY_HEADROOM_BYTES = 512 * 1024 * 1024  # 准入时系统至少保留的空闲内存
+ADMISSION_POLL_SECONDS = 1.0
+STREAM_ADMISSION_TIMEOUT = 30  # 流式会话最多排队这么久
+
+# 批处理流水线：解码 -> 特征 -> 推理 -> 后处理 -> 存储，相邻两级之间是有界队列
+PIPELINE_STAGES = ('decode', 'features', 'inference', 'postprocess', 'store')
+PIPELINE_DEFAULT_WORKERS = {'decode': 2, 'features': 1, 'inference': 1, 'postprocess': 1, 'store': 1}
+PIPELINE_QUEUE_SIZE = 2  # 每级之间最多积压的文件数，限制同时驻留内存的音频
+WHISPER_N_MELS = {'large': 128}  # large对应large-v3，其它模型为80
+
+# 词级时间戳：解码完成后对片段做交叉注意力强制对齐
+WORD_ALIGN_BATCH = 8  # 每次前向送入的片段数
+WORD_ALIGN_MEDFILT_WIDTH = 7  # 注意力权重沿时间轴的中值滤波宽度
+WORD_PREPEND_PUNCTUATIONS = "\"'“¿([{-"  # 并入后一个词的标点
+WORD_APPEND_PUNCTUATIONS = "\"'.。,，!！?？:：”)]}、"  # 并入前一个词的标点
+
+# 说话人分离（可选）：需要安装pyannote.audio并设置HF_TOKEN环境变量
+DIARIZATION_MODEL = 'pyannote/speaker-diarization-3.1'
+TURN_INDEX_MIN_SPAN = 0.5  # 说话人轮次按时长分桶时最短一档的上限（秒）
+
+# 综合基准测试：合成多说话人语料，逐个流水线模式记录RTF/内存/加载耗时/首段延迟/CER
+SUITE_MODES = ('single', 'batch', 'diarize', 'cascade')
+SUITE_CORPUS_FOLDER = os.path.join(CACHE_FOLDER, 'benchmarks', 'corpus')
+SUITE_BASELINE_FILE = os.path.join(CACHE_FOLDER, 'benchmarks', 'suite_baseline.json')
+SUITE_SPEAKER_RATES = (1.0, 1.12)  # 合成对话中各说话人的放慢比例（同时降低音高），用来区分说话人
+SUITE_TURN_GAP_SECONDS = 0.6
+SUITE_REGRESSION_THRESHOLDS = {  # 指标: (相对基线的最大倍数, 最小绝对变化)，两者都超过才算退化
+    'rtf': (1.2, 0.01),
+    'peak_rss_mb': (1.25, 50),
+    'model_load_seconds': (1.5, 0.2),
+    'first_segment_seconds': (1.3, 0.2),
+    'cer': (None, 0.02)
+}
+
+# 转录库：批处理结果持久化到SQLite，片段文本建FTS5全文索引（中文按单字和二字组切分）
+TRANSCRIPT_DB = os.path.join(CACHE_FOLDER, 'transcripts.db')
+SEARCH_DEFAULT_LIMIT = 50
+SEARCH_MAX_LIMIT = 500
+
+# 批处理结果的片段以列式文件保存在 cache/segments/<编号>/，结果里只保留内存映射的列
+SEGMENT_FOLDER = os.path.join(CACHE_FOLDER, 'segments')
+
+# 批处理任务结果：保留最近几次任务，按游标分页读取
+JOB_HISTORY = 5
+RESULTS_PAGE_DEFAULT = 20
+RESULTS_PAGE_MAX = 200
+
+# HTTP响应：超过阈值的文本响应按Accept-Encoding压缩（brotli为可选依赖），静态资源带内容哈希长期缓存
+COMPRESS_MIN_BYTES = 1024
+COMPRESSIBLE_TYPES = {'application/json', 'text/html', 'text/css', 'application/javascript'}
+ASSET_MAX_AGE = 365 * 24 * 3600
+
+# 服务启动后在后台导入torch/whisper并加载的常驻模型（语言识别和流式转录默认都用base）
+WARMUP_MODELS = ('base',)
+
+# 实时流式转录配置
+STREAM_DEFAULT_MODEL = 'base'
+STREAM_STEP_SECONDS = 1.0  # 每积累这么多新音频解码一次
+STREAM_WINDOW_SECONDS = 15.0  # 滑动窗口超过该时长后在已提交的片段边界处裁剪
+STREAM_MAX_WINDOW_SECONDS = 30.0  # 窗口硬上限（Whisper单次解码窗口为30秒）
+STREAM_PROMPT_CHARS = 100  # 作为上下文提示的已提交文本长度
+STREAM_FORMATS = ('pcm_s16le', 'pcm_f32le', 'opus')
 
 # 创建必要的文件夹
-for folder in [UPLOAD_FOLDER, PROCESSED_FOLDER, TEMP_FOLDER]:
+for folder in [UPLOAD_FOLDER, PROCESSED_FOLDER, TEMP_FOLDER, CACHE_FOLDER, REFERENCE_FOLDER]:
     os.makedirs(folder, exist_ok=True)
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 500 * 1024 * 1024  # 500MB
 
-# 全局变量存储任务状态
-batch_status = {
-    'running': False,
-    'total_files': 0,
-    'processed_files': 0,
-    'current_file': '',
-    'current_progress': 0,
-    'current_step': '',
-    'results': [],
-    'error': None
-}
+class AdmissionController:
+    """按内存预算控制并发任务（批处理文件、流式会话、基准测试）的准入
+    
+    已准入任务的预计内存之和不超过预算，且系统当前空闲内存放得下新任务时才放行，
+    否则排队轮询。没有任何已准入任务时总是放行，避免超出预算的大任务永远等待。
+    
+    调用方自己持有的预留（批次常驻的模型、/api/benchmark 预留的模型）不算“其它任务”：
+    批次里的文件在准入时传入held，除此之外没有已准入任务就放行，否则预算小于模型时会一直等待。
+    """
+    
+    def __init__(self, budget_bytes=None):
+        import psutil
+        self.budget = budget_bytes or int(psutil.virtual_memory().available * MEMORY_BUDGET_FRACTION)
+        self.reserved = 0
+        self._condition = threading.Condition()
+        self._local = threading.local()
+    
+    def held(self):
+        """当前线程通过hold()持有的预留，之后在这个线程里创建的任务准入时把它当作自己的"""
+        return getattr(self._local, 'held', 0)
+    
+    def fits(self, estimate, held=0):
+        import psutil
+        if self.reserved <= held:
+            return True
+        return (self.reserved + estimate <= self.budget
+                and estimate <= psutil.virtual_memory().available - MEMORY_HEADROOM_BYTES)
+    
+    def acquire(self, estimate, on_wait=None, cancelled=None, held=None):
+        """等待到任务可以准入并预留内存，返回等待秒数；cancelled()为真时放弃并返回None
+        
+        held: 调用方已经持有的预留，默认为当前线程hold()的部分。
+        """
+        held = self.held() if held is None else held
+        start = time.time()
+        with self._condition:
+            while not self.fits(estimate, held):
+                if cancelled and cancelled():
+                    return None
+                if on_wait:
+                    on_wait(time.time() - start)
+                # 其它进程释放内存不会通知这里，所以定时重查
+                self._condition.wait(ADMISSION_POLL_SECONDS)
+            self.reserved += estimate
+        return time.time() - start
+    
+    def release(self, estimate):
+        with self._condition:
+            self.reserved -= estimate
+            self._condition.notify_all()
+    
+    @contextmanager
+    def hold(self, estimate):
+        """预留内存直到退出，其间当前线程发起的准入把这部分视为调用方已持有"""
+        self.acquire(estimate)
+        self._local.held = self.held() + estimate
+        try:
+            yield
+        finally:
+            self._local.held -= estimate
+            self.release(estimate)
+    
+    def status(self):
+        import psutil
+        return {
+            'budget_gb': round(self.budget / GB, 2),
+            'reserved_gb': round(self.reserved / GB, 2),
+            'available_gb': round(psutil.virtual_memory().available / GB, 2)
+        }
+
+admission = AdmissionController()
+
+def new_batch_status():
+    """一份批处理状态"""
+    return {
+        'running': False,
+        'total_files': 0,
+        'processed_files': 0,
+        'current_file': '',
+        'current_progress': 0,
+        'current_step': '',
+        'results': [],
+        'error': None
+    }
+
+# 全局变量存储任务状态（Web界面轮询的就是这一份）
+batch_status = new_batch_status()
+
+# 转录各步骤把进度和统计写入当前线程的状态对象，默认是全局batch_status；
+# 基准测试等内部运行用独立的状态对象，不干扰正在进行的用户批处理
+_status_state = threading.local()
+
+@contextmanager
+def status_scope(status):
+    """在当前线程内把进度和统计写入指定的状态对象"""
+    previous = getattr(_status_state, 'status', None)
+    _status_state.status = status
+    try:
+        yield
+    finally:
+        _status_state.status = previous
+
+def current_status():
+    status = getattr(_status_state, 'status', None)
+    return batch_status if status is None else status
 
 def allowed_file(filename):
     """检查文件扩展名是否允许"""
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def process_single_file(audio_file, model_name='base'):
-    """处理单个音频文件"""
+def quantized_model_path(model_name):
+    """量化模型缓存路径；整模型pickle依赖torch版本，文件名里带上版本号"""
+    import torch
+    version = torch.__version__.split('+')[0]
+    return os.path.join(CACHE_FOLDER, 'models', f'{model_name}-int8-torch{version}.pt')
+
+def quantize_model(model):
+    """对模型的线性层做int8动态量化"""
+    import torch
+    # Whisper自带的Linear是nn.Linear的子类，quantize_dynamic只认精确类型，先换回nn.Linear
+    for module in list(model.modules()):
+        for name, child in module.named_children():
+            if isinstance(child, torch.nn.Linear) and type(child) is not torch.nn.Linear:
+                linear = torch.nn.Linear(child.in_features, child.out_features, bias=child.bias is not None)
+                linear.load_state_dict(child.state_dict())
+                setattr(module, name, linear)
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+def load_quantized_model(model_name):
+    """加载int8量化模型，首次转换后缓存到磁盘"""
+    import torch
+    path = quantized_model_path(model_name)
+    if os.path.exists(path):
+        return torch.load(path, map_location='cpu', weights_only=False)
+    
+    print(f"首次量化模型 {model_name}，结果将缓存到 {path}")
+    model = quantize_model(whisper.load_model(model_name, device='cpu'))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = path + '.tmp'
+    torch.save(model, temp_path)
+    os.replace(temp_path, path)
+    return model
+
+def load_whisper_model(model_name, precision='fp32'):
+    """按精度加载Whisper模型"""
+    if precision == 'int8':
+        return load_quantized_model(model_name)
+    return whisper.load_model(model_name)
+
+def onnx_model_dir(model_name, precision='fp32'):
+    """导出的ONNX计算图目录"""
+    return os.path.join(CACHE_FOLDER, 'onnx', f'{model_name}-{precision}')
+
+def export_onnx_model(model, output_dir):
+    """把Whisper导出为三张ONNX计算图：
+    
+    encoder.onnx   mel -> audio_features
+    cross_kv.onnx  audio_features -> 各层cross-attention的K/V（每段音频只算一次）
+    decoder.onnx   tokens + 自注意力KV缓存 + cross K/V -> logits + 更新后的KV缓存
+    """
+    import torch
+    
+    def attention(q, k, v, n_head, mask=None):
+        n_batch, n_ctx, n_state = q.shape
+        scale = (n_state // n_head) ** -0.25
+        q = q.reshape(n_batch, n_ctx, n_head, -1).permute(0, 2, 1, 3) * scale
+        # beam search时tokens按组重复而audio_features不重复，K/V按自身batch展开后依赖广播
+        k = k.reshape(k.shape[0], k.shape[1], n_head, -1).permute(0, 2, 3, 1) * scale
+        v = v.reshape(v.shape[0], v.shape[1], n_head, -1).permute(0, 2, 1, 3)
+        qk = q @ k
+        if mask is not None:
+            qk = qk + mask
+        weights = torch.softmax(qk.float(), dim=-1)
+        return (weights @ v).permute(0, 2, 1, 3).flatten(start_dim=2)
+    
+    class CrossKV(torch.nn.Module):
+        def __init__(self, decoder):
+            super().__init__()
+            self.decoder = decoder
+        
+        def forward(self, audio_features):
+            keys = [block.cross_attn.key(audio_features) for block in self.decoder.blocks]
+            values = [block.cross_attn.value(audio_features) for block in self.decoder.blocks]
+            return torch.stack(keys), torch.stack(values)
+    
+    class DecoderStep(torch.nn.Module):
+        def __init__(self, decoder):
+            super().__init__()
+            self.decoder = decoder
+        
+        def forward(self, tokens, self_k, self_v, cross_k, cross_v):
+            decoder = self.decoder
+            past = self_k.shape[2]
+            n_new = tokens.shape[1]
+            x = decoder.token_embedding(tokens) + decoder.positional_embedding[past:past + n_new]
+            # 新token只能看到自己及之前的位置
+            positions = torch.arange(past + n_new)
+            mask = (positions[None, :] > positions[past:, None]).float() * -1e9
+            
+            new_k, new_v = [], []
+            for i, block in enumerate(decoder.blocks):
+                h = block.attn_ln(x)
+                k = torch.cat([self_k[i], block.attn.key(h)], dim=1)
+                v = torch.cat([self_v[i], block.attn.value(h)], dim=1)
+                new_k.append(k)
+                new_v.append(v)
+                x = x + block.attn.out(attention(block.attn.query(h), k, v, block.attn.n_head, mask))
+                h = block.cross_attn_ln(x)
+                x = x + block.cross_attn.out(attention(block.cross_attn.query(h), cross_k[i], cross_v[i], block.cross_attn.n_head))
+                x = x + block.mlp(block.mlp_ln(x))
+            x = decoder.ln(x)
+            logits = (x @ decoder.token_embedding.weight.T).float()
+            return logits, torch.stack(new_k), torch.stack(new_v)
+    
+    dims = model.dims
+    n_layer, n_state = dims.n_text_layer, dims.n_text_state
+    mel = torch.zeros(1, dims.n_mels, dims.n_audio_ctx * 2)
+    audio_features = torch.zeros(1, dims.n_audio_ctx, n_state)
+    tokens = torch.zeros(1, 3, dtype=torch.long)
+    past = torch.zeros(n_layer, 1, 2, n_state)
+    cross = torch.zeros(n_layer, 1, dims.n_audio_ctx, n_state)
+    
+    os.makedirs(output_dir, exist_ok=True)
+    model = model.float().eval()
+    with torch.no_grad():
+        torch.onnx.export(
+            model.encoder, (mel,), os.path.join(output_dir, 'encoder.onnx'), dynamo=False,
+            input_names=['mel'], output_names=['audio_features'],
+            dynamic_axes={'mel': {0: 'batch'}, 'audio_features': {0: 'batch'}},
+            opset_version=ONNX_OPSET
+        )
+        torch.onnx.export(
+            CrossKV(model.decoder), (audio_features,), os.path.join(output_dir, 'cross_kv.onnx'), dynamo=False,
+            input_names=['audio_features'], output_names=['cross_k', 'cross_v'],
+            dynamic_axes={'audio_features': {0: 'batch'}, 'cross_k': {1: 'batch'}, 'cross_v': {1: 'batch'}},
+            opset_version=ONNX_OPSET
+        )
+        torch.onnx.export(
+            DecoderStep(model.decoder), (tokens, past, past, cross, cross),
+            os.path.join(output_dir, 'decoder.onnx'), dynamo=False,
+            input_names=['tokens', 'self_k', 'self_v', 'cross_k', 'cross_v'],
+            output_names=['logits', 'new_self_k', 'new_self_v'],
+            dynamic_axes={
+                'tokens': {0: 'batch', 1: 'n_new'},
+                'self_k': {1: 'batch', 2: 'past'}, 'self_v': {1: 'batch', 2: 'past'},
+                'cross_k': {1: 'batch'}, 'cross_v': {1: 'batch'},
+                'logits': {0: 'batch', 1: 'n_new'},
+                'new_self_k': {1: 'batch', 2: 'total'}, 'new_self_v': {1: 'batch', 2: 'total'}
+            },
+            opset_version=ONNX_OPSET
+        )
+
+def quantize_onnx_model(source_dir, output_dir):
+    """用ONNX Runtime对导出的计算图做int8动态量化"""
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+    os.makedirs(output_dir, exist_ok=True)
+    for name in ('encoder.onnx', 'cross_kv.onnx', 'decoder.onnx'):
+        quantize_dynamic(os.path.join(source_dir, name), os.path.join(output_dir, name),
+                         weight_type=QuantType.QInt8)
+
+class OnnxEncoder:
+    """ONNX编码器，接口与Whisper的AudioEncoder一致"""
+    
+    def __init__(self, session):
+        self.session = session
+    
+    def __call__(self, mel):
+        import torch
+        features = self.session.run(None, {'mel': mel.float().cpu().numpy()})[0]
+        return torch.from_numpy(features)
+
+class _KVSlot:
+    """占位对象：充当whisper kv_cache字典的键（对应PyTorch模型里的attn.key/attn.value模块）"""
+
+class _OnnxAttention:
+    def __init__(self):
+        self.key = _KVSlot()
+        self.value = _KVSlot()
+
+class _OnnxBlock:
+    def __init__(self):
+        self.attn = _OnnxAttention()
+
+class OnnxDecoder:
+    """ONNX解码器，兼容whisper的PyTorchInference调用方式
+    
+    自注意力KV缓存按层存放在whisper传入的kv_cache字典中（键为各层的占位对象），
+    因此beam search的rearrange_kv_cache可以照常工作；cross-attention的K/V每段音频只算一次。
+    """
+    
+    def __init__(self, cross_session, decoder_session, n_layer, n_state):
+        self.cross_session = cross_session
+        self.decoder_session = decoder_session
+        self.blocks = [_OnnxBlock() for _ in range(n_layer)]
+        self.n_state = n_state
+        self.cross_slot = _KVSlot()
+    
+    def __call__(self, tokens, audio_features, kv_cache=None):
+        import torch
+        if kv_cache is not None and self.cross_slot in kv_cache:
+            cross_k, cross_v = kv_cache[self.cross_slot]
+        else:
+            cross_k, cross_v = self.cross_session.run(None, {'audio_features': audio_features.float().cpu().numpy()})
+            if kv_cache is not None:
+                kv_cache[self.cross_slot] = (cross_k, cross_v)
+        
+        first = self.blocks[0].attn.key
+        if kv_cache is not None and first in kv_cache:
+            self_k = np.stack([kv_cache[block.attn.key].numpy() for block in self.blocks])
+            self_v = np.stack([kv_cache[block.attn.value].numpy() for block in self.blocks])
+        else:
+            empty = np.zeros((len(self.blocks), tokens.shape[0], 0, self.n_state), dtype=np.float32)
+            self_k, self_v = empty, empty
+        
+        logits, new_k, new_v = self.decoder_session.run(None, {
+            'tokens': tokens.cpu().numpy().astype(np.int64),
+            'self_k': self_k, 'self_v': self_v,
+            'cross_k': cross_k, 'cross_v': cross_v
+        })
+        if kv_cache is not None:
+            for i, block in enumerate(self.blocks):
+                kv_cache[block.attn.key] = torch.from_numpy(new_k[i])
+                kv_cache[block.attn.value] = torch.from_numpy(new_v[i])
+        return torch.from_numpy(logits)
+
+class OnnxWhisperModel:
+    """用ONNX Runtime执行的Whisper模型，可直接交给whisper.transcribe/decode使用"""
+    
+    def __init__(self, model_name, precision='fp32'):
+        import torch
+        import onnxruntime
+        
+        torch_model = whisper.load_model(model_name, device='cpu')
+        self.dims = torch_model.dims
+        self.is_multilingual = torch_model.is_multilingual
+        self.num_languages = torch_model.num_languages
+        self.device = torch.device('cpu')
+        
+        fp32_dir = onnx_model_dir(model_name, 'fp32')
+        if not os.path.exists(os.path.join(fp32_dir, 'decoder.onnx')):
+            print(f"首次导出ONNX模型 {model_name}，结果将缓存到 {fp32_dir}")
+            export_onnx_model(torch_model, fp32_dir)
+        model_dir = fp32_dir
+        if precision == 'int8':
+            model_dir = onnx_model_dir(model_name, 'int8')
+            if not os.path.exists(os.path.join(model_dir, 'decoder.onnx')):
+                quantize_onnx_model(fp32_dir, model_dir)
+        del torch_model
+        
+        session_options = onnxruntime.SessionOptions()
+        session_options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        
+        def session(name):
+            return onnxruntime.InferenceSession(os.path.join(model_dir, name), session_options,
+                                                providers=['CPUExecutionProvider'])
+        
+        self.encoder = OnnxEncoder(session('encoder.onnx'))
+        self.decoder = OnnxDecoder(session('cross_kv.onnx'), session('decoder.onnx'),
+                                   self.dims.n_text_layer, self.dims.n_text_state)
+    
+    def install_kv_cache_hooks(self, cache=None):
+        # KV缓存由OnnxDecoder直接写入字典，不需要forward hook
+        return ({} if cache is None else cache), []
+    
+    def logits(self, tokens, audio_features):
+        return self.decoder(tokens, audio_features)
+    
+    def embed_audio(self, mel):
+        return self.encoder(mel)
+    
+    def detect_language(self, mel, tokenizer=None):
+        return whisper.decoding.detect_language(self, mel, tokenizer)
+    
+    def decode(self, mel, options=None):
+        return whisper.decoding.decode(self, mel, options or whisper.DecodingOptions())
+    
+    def transcribe(self, audio, **decode_options):
+        if decode_options.get('word_timestamps'):
+            raise ValueError('ONNX后端不支持word_timestamps')
+        return whisper.transcribe(self, audio, **decode_options)
+
+class DecodePolicy:
+    """温度回退策略
+    
+    限制每个窗口的回退次数和每个文件花在回退上的总时间；首次解码判定为静音时提前退出。
+    通过包装模型的decode实现，whisper.transcribe的其余逻辑保持不变。
+    """
+    
+    def __init__(self, **settings):
+        merged = dict(DEFAULT_DECODE_POLICY, **settings)
+        self.max_retries = int(merged['max_retries'])
+        self.temperature_step = float(merged['temperature_step'])
+        self.time_budget = merged['time_budget']
+        self.no_speech_exit = merged['no_speech_exit']
+        self.compression_ratio_threshold = merged['compression_ratio_threshold']
+        self.logprob_threshold = merged['logprob_threshold']
+        self.no_speech_threshold = merged['no_speech_threshold']
+    
+    def to_dict(self):
+        return {key: getattr(self, key) for key in DEFAULT_DECODE_POLICY}
+    
+    def scaled(self, fraction):
+        """按比例分摊时间预算（长文件分块时每块拿到与时长成比例的预算）"""
+        settings = self.to_dict()
+        if self.time_budget is not None:
+            settings['time_budget'] = self.time_budget * fraction
+        return DecodePolicy(**settings)
+    
+    def temperatures(self):
+        steps = [round(self.temperature_step * i, 2) for i in range(self.max_retries + 1)]
+        return tuple(t for t in steps if t <= 1.0)
+    
+    def transcribe_options(self):
+        return {
+            'temperature': self.temperatures(),
+            'compression_ratio_threshold': self.compression_ratio_threshold,
+            'logprob_threshold': self.logprob_threshold,
+            'no_speech_threshold': self.no_speech_threshold
+        }
+
+def new_decode_stats():
+    """单个文件（或一块音频）的解码统计"""
+    return {
+        'windows': 0,
+        'fallbacks': 0,
+        'fallback_time': 0.0,
+        'decode_time': 0.0,
+        'skipped_no_speech': 0,
+        'skipped_budget': 0
+    }
+
+def merge_decode_stats(total, stats):
+    """累加解码统计"""
+    total = total or new_decode_stats()
+    for key, value in stats.items():
+        total[key] = round(total[key] + value, 3) if isinstance(value, float) else total[key] + value
+    return total
+
+class PolicyModel:
+    """按DecodePolicy包装模型的decode：记录每次回退的耗时，并在预算用尽或判定静音时跳过后续回退"""
+    
+    def __init__(self, model, policy):
+        self._model = model
+        self.policy = policy
+        self.stats = new_decode_stats()
+        self._window_result = None
+    
+    def __getattr__(self, name):
+        return getattr(self._model, name)
+    
+    def decode(self, mel, options):
+        if options.temperature == 0:
+            # 新窗口的首次解码
+            self.stats['windows'] += 1
+            start = time.time()
+            self._window_result = self._model.decode(mel, options)
+            self.stats['decode_time'] += time.time() - start
+            return self._window_result
+        
+        first = self._window_result
+        if self.policy.no_speech_exit is not None and first.no_speech_prob > self.policy.no_speech_exit:
+            # 首次解码已判定为静音，后续温度直接返回首次结果（不再计算）
+            self.stats['skipped_no_speech'] += 1
+            return first
+        if self.policy.time_budget is not None and self.stats['fallback_time'] >= self.policy.time_budget:
+            self.stats['skipped_budget'] += 1
+            return first
+        
+        start = time.time()
+        result = self._model.decode(mel, options)
+        elapsed = time.time() - start
+        self.stats['fallbacks'] += 1
+        self.stats['fallback_time'] += elapsed
+        self.stats['decode_time'] += elapsed
+        return result
+
+class ASREngine:
+    """语音识别引擎接口
+    
+    各引擎都接收16kHz单声道float32音频，返回与whisper_model.transcribe相同结构的结果
+    ({'text', 'segments', 'language'})，因此共用同一套音频缓存、分块并行和批处理调度。
+    
+    常驻引擎被流式会话、级联升级、语言识别等多个线程共用，而Whisper解码时会在共享的
+    key/value模块上挂KV缓存钩子，同一模型上的并发推理会互相破坏，所以推理都在实例锁内进行。
+    """
+    
+    name = None
+    languages = None  # None表示支持所有语言
+    
+    def __init__(self, model_name, precision='fp32'):
+        self.model_name = model_name
+        self.precision = precision
+        self.model = None
+        self.lock = threading.Lock()
+    
+    def transcribe(self, audio, **decode_options):
+        raise NotImplementedError
+    
+    def transcribe_batch(self, audios, **decode_options):
+        """批量转录，默认逐条处理；支持批量推理的引擎可以覆盖"""
+        return [self.transcribe(audio, **decode_options) for audio in audios]
+
+class WhisperEngine(ASREngine):
+    """Whisper引擎，具体推理由后端子类提供"""
+    
+    name = 'whisper'
+    backend = None
+    
+    def transcribe(self, audio, policy=None, cache_features=False, **decode_options):
+        decode_options.setdefault('fp16', False)
+        with self.lock, mel_cache_scope(cache_features):
+            if policy is None:
+                return self.model.transcribe(audio, **decode_options)
+            
+            model = PolicyModel(self.model, policy)
+            result = whisper.transcribe(model, audio, **policy.transcribe_options(), **decode_options)
+        for key in ('fallback_time', 'decode_time'):
+            model.stats[key] = round(model.stats[key], 3)
+        result['decode_stats'] = model.stats
+        return result
+
+    def detect_language(self, audios):
+        """语言识别：每段音频只跑一次编码器和一步解码，返回 [{语言: 概率}, ...]"""
+        import torch
+        mel = torch.stack([
+            whisper.log_mel_spectrogram(whisper.pad_or_trim(audio), self.model.dims.n_mels)
+            for audio in audios
+        ])
+        with self.lock, torch.no_grad():
+            _, probs = self.model.detect_language(mel.to(self.model.device))
+        return probs
+
+class PyTorchEngine(WhisperEngine):
+    """PyTorch eager推理（默认）"""
+    
+    backend = 'pytorch'
+    
+    def __init__(self, model_name, precision='fp32'):
+        super().__init__(model_name, precision)
+        self.model = load_whisper_model(model_name, precision)
+    
+    def align(self, audio, segments, language):
+        """词级时间戳对齐（见align_words），与转录一样在实例锁内进行"""
+        with self.lock:
+            return align_words(self.model, audio, segments, language)
+
+class OnnxEngine(WhisperEngine):
+    """ONNX Runtime推理：编码器、cross K/V和带KV缓存的解码步分别导出为计算图"""
+    
+    backend = 'onnx'
+    
+    def __init__(self, model_name, precision='fp32'):
+        super().__init__(model_name, precision)
+        self.model = OnnxWhisperModel(model_name, precision)
+
+class FireRedASREngine(ASREngine):
+    """FireRedASR-AED引擎（普通话/英文）
+    
+    模型单条输入不超过60秒，长音频复用VAD停顿切分后按批送入模型，再按时间拼接。
+    """
+    
+    name = 'fireredasr'
+    languages = ('zh', 'en')
+    
+    def __init__(self, model_name=None, precision='fp32'):
+        super().__init__(model_name, precision)
+        if FIREREDASR_DIR not in sys.path:
+            sys.path.insert(0, FIREREDASR_DIR)
+        from fireredasr.models.fireredasr import FireRedAsr
+        self.model = FireRedAsr.from_pretrained('aed', FIREREDASR_MODEL_DIR)
+    
+    def transcribe(self, audio, **decode_options):
+        return self.transcribe_batch([audio], **decode_options)[0]
+    
+    def transcribe_batch(self, audios, **decode_options):
+        import soundfile as sf
+        
+        # 所有音频的所有分块合在一起按批解码；FireRedASR按文件路径读取16位PCM WAV
+        pieces = []
+        for index, audio in enumerate(audios):
+            for start, end in split_audio_at_pauses(audio, max_chunk_seconds=FIREREDASR_MAX_SECONDS,
+                                                    min_chunk_seconds=FIREREDASR_MAX_SECONDS / 4):
+                path = os.path.join(TEMP_FOLDER, f'fireredasr_{uuid.uuid4().hex}.wav')
+                sf.write(path, audio[start:end], SAMPLE_RATE, subtype='PCM_16')
+                pieces.append({'audio': index, 'start': start / SAMPLE_RATE, 'end': end / SAMPLE_RATE, 'path': path})
+        
+        try:
+            for offset in range(0, len(pieces), FIREREDASR_BATCH_SIZE):
+                batch = pieces[offset:offset + FIREREDASR_BATCH_SIZE]
+                with self.lock:
+                    outputs = self.model.transcribe(
+                        [os.path.basename(piece['path']) for piece in batch],
+                        [piece['path'] for piece in batch],
+                        FIREREDASR_DECODE_ARGS
+                    )
+                for piece, output in zip(batch, outputs):
+                    piece['text'] = output['text'].strip()
+        finally:
+            for piece in pieces:
+                if os.path.exists(piece['path']):
+                    os.remove(piece['path'])
+        
+        results = []
+        for index in range(len(audios)):
+            chunk_results = [{
+                'start': piece['start'],
+                'end': piece['end'],
+                'segments': [{'start': piece['start'], 'end': piece['end'], 'text': piece['text']}] if piece['text'] else []
+            } for piece in pieces if piece['audio'] == index]
+            segments = stitch_chunk_segments(chunk_results)
+            results.append({
+                'text': ''.join(seg['text'] for seg in segments),
+                'segments': segments,
+                'language': 'zh'
+            })
+        return results
+
+class StubEngine(ASREngine):
+    """压测用桩引擎：不加载模型，等待配置的延迟后按固定间隔返回预置文本，用来单独测量HTTP层和调度
+    
+    延迟和真实引擎一样在实例锁内等待，共用同一引擎的会话会排队。
+    """
+    
+    name = 'stub'
+    
+    def __init__(self, model_name=None, precision='fp32', latency=(0.0, 0.0)):
+        super().__init__(model_name, precision)
+        self.fixed_latency, self.latency_per_second = latency
+    
+    def transcribe(self, audio, **decode_options):
+        duration = len(audio) / SAMPLE_RATE
+        with self.lock:
+            time.sleep(self.fixed_latency + self.latency_per_second * duration)
+        segments = []
+        for i, start in enumerate(np.arange(0.0, duration, STUB_SEGMENT_SECONDS)):
+            segments.append({
+                'id': i,
+                'start': float(start),
+                'end': float(min(start + STUB_SEGMENT_SECONDS, duration)),
+                'text': STUB_SEGMENT_TEXTS[i % len(STUB_SEGMENT_TEXTS)],
+                'avg_logprob': -0.1,
+                'no_speech_prob': 0.0,
+                'compression_ratio': 1.0
+            })
+        return {
+            'text': ''.join(seg['text'] for seg in segments),
+            'segments': segments,
+            'language': decode_options.get('language') or 'zh'
+        }
+    
+    def detect_language(self, audios):
+        return [{'zh': 1.0} for _ in audios]
+
+def stub_engine_latency():
+    """读取桩引擎配置，返回 (固定延迟, 每秒音频延迟)；未启用时返回None"""
+    value = os.environ.get(STUB_ENGINE_ENV)
+    if not value:
+        return None
+    parts = [float(part) for part in value.split(',')]
+    return parts[0], parts[1] if len(parts) > 1 else 0.0
+
+WHISPER_BACKENDS = {
+    'pytorch': PyTorchEngine,
+    'onnx': OnnxEngine,
+}
+
+def needs_whisper_features(options):
+    """任务的推理是否用Whisper的log-mel特征（桩引擎和FireRedASR都不用，不必预先计算）"""
+    return stub_engine_latency() is None and options.get('engine', 'whisper') == 'whisper'
+
+def fireredasr_available():
+    """FireRedASR仓库和预训练模型是否就绪"""
+    return os.path.isdir(os.path.join(FIREREDASR_DIR, 'fireredasr')) and os.path.isdir(FIREREDASR_MODEL_DIR)
+
+def engine_benchmark_path():
+    """各引擎基准测试结果，自动路由依据该文件"""
+    return os.path.join(CACHE_FOLDER, 'benchmarks', 'engines.json')
+
+def route_engine_from_report(report, policy):
+    """按引擎基准测试报告选择引擎：accurate选字错率最低，fastest选RTF最低"""
+    candidates = {name: stats for name, stats in report.get('engines', {}).items() if 'error' not in stats}
+    if not candidates:
+        return 'whisper'
+    metric = 'cer' if policy == 'accurate' else 'rtf'
+    return min(candidates, key=lambda name: candidates[name][metric])
+
+def route_engine(language='zh', policy='accurate'):
+    """为任务选择引擎：中文任务按最近一次引擎基准测试结果路由，其它情况用Whisper"""
+    if language != 'zh' or not fireredasr_available() or not os.path.exists(engine_benchmark_path()):
+        return 'whisper'
+    with open(engine_benchmark_path(), 'r', encoding='utf-8') as f:
+        return route_engine_from_report(json.load(f), policy)
+
+def create_engine(model_name, options=None):
+    """按任务选项创建识别引擎"""
+    options = options or {}
+    latency = stub_engine_latency()
+    if latency is not None:
+        return StubEngine(model_name, options.get('precision', 'fp32'), latency)
+    engine_name = options.get('engine', 'whisper')
+    if engine_name == 'auto':
+        engine_name = route_engine('zh', options.get('route_policy', 'accurate'))
+    if engine_name == 'fireredasr':
+        return FireRedASREngine(model_name)
+    engine_class = WHISPER_BACKENDS[options.get('backend', 'pytorch')]
+    return engine_class(model_name, options.get('precision', 'fp32'))
+
+# 常驻识别引擎（流式转录、级联升级等反复使用同一模型的场景），按模型/精度/后端缓存
+_resident_engines = {}
+_resident_engines_lock = threading.Lock()
+
+def is_resident_engine(model_name, options):
+    """该模型是否已作为常驻引擎加载"""
+    return (model_name, options.get('precision', 'fp32'), options.get('backend', 'pytorch')) in _resident_engines
+
+def get_resident_engine(model_name, options):
+    """获取常驻识别引擎，首次使用时加载"""
+    key = (model_name, options.get('precision', 'fp32'), options.get('backend', 'pytorch'))
+    with _resident_engines_lock:
+        if key not in _resident_engines:
+            _resident_engines[key] = create_engine(model_name, dict(options, engine='whisper'))
+        return _resident_engines[key]
+
+class PolyphaseResampler:
+    """多相重采样器：每个输出相位一个sinc核，用一次步长为orig的conv1d算出所有相位
+    
+    支持分块输入，块之间保留必要的上下文，分块处理的结果与整段处理完全一致。
+    """
+    
+    def __init__(self, orig_sr, target_sr=SAMPLE_RATE):
+        import torch
+        gcd = math.gcd(int(orig_sr), int(target_sr))
+        self.orig, self.new = int(orig_sr) // gcd, int(target_sr) // gcd
+        base_freq = min(self.orig, self.new) * RESAMPLE_ROLLOFF
+        self.width = math.ceil(RESAMPLE_FILTER_WIDTH * self.orig / base_freq)
+        
+        idx = torch.arange(-self.width, self.width + self.orig, dtype=torch.float64)[None] / self.orig
+        t = (torch.arange(0, -self.new, -1, dtype=torch.float64)[:, None] / self.new + idx) * base_freq
+        t = t.clamp(-RESAMPLE_FILTER_WIDTH, RESAMPLE_FILTER_WIDTH)
+        window = torch.cos(t * math.pi / RESAMPLE_FILTER_WIDTH / 2) ** 2
+        t = t * math.pi
+        kernels = torch.where(t == 0, torch.ones_like(t), t.sin() / t) * window * (base_freq / self.orig)
+        self.kernels = kernels.float()[:, None]  # (new, 1, 核长)
+        
+        # 左侧补width个零，与整段处理时的填充一致
+        self._buffer = np.zeros(self.width, dtype=np.float32)
+        self._input_samples = 0
+        self._output_samples = 0
+    
+    def _convolve(self, samples, n_frames):
+        import torch
+        import torch.nn.functional as F
+        kernel_len = self.kernels.shape[-1]
+        outputs = []
+        for first in range(0, n_frames, RESAMPLE_MAX_FRAMES):
+            frames = min(RESAMPLE_MAX_FRAMES, n_frames - first)
+            start = first * self.orig
+            piece = torch.from_numpy(samples[start:start + (frames - 1) * self.orig + kernel_len])
+            output = F.conv1d(piece[None, None], self.kernels, stride=self.orig)
+            outputs.append(output[0].T.reshape(-1).numpy())
+        return np.concatenate(outputs) if outputs else np.zeros(0, dtype=np.float32)
+    
+    def process(self, audio):
+        """输入一块原始采样率的单声道音频，返回目前已能确定的重采样输出"""
+        self._input_samples += len(audio)
+        self._buffer = np.concatenate([self._buffer, audio.astype(np.float32, copy=False)])
+        kernel_len = self.kernels.shape[-1]
+        if len(self._buffer) < kernel_len:
+            return np.zeros(0, dtype=np.float32)
+        n_frames = (len(self._buffer) - kernel_len) // self.orig + 1
+        output = self._convolve(self._buffer, n_frames)
+        self._buffer = self._buffer[n_frames * self.orig:]
+        self._output_samples += len(output)
+        return output
+    
+    def flush(self):
+        """输入结束：右侧补零算完剩余帧，并截到目标长度"""
+        target = math.ceil(self.new * self._input_samples / self.orig)
+        samples = np.concatenate([self._buffer, np.zeros(self.width + self.orig, dtype=np.float32)])
+        n_frames = (len(samples) - self.kernels.shape[-1]) // self.orig + 1
+        output = self._convolve(samples, n_frames)[:max(0, target - self._output_samples)]
+        self._buffer = np.zeros(0, dtype=np.float32)
+        self._output_samples += len(output)
+        return output
+
+def decode_audio(audio_file):
+    """解码为16kHz单声道float32：WAV/FLAC在进程内读取并重采样，压缩格式及soundfile读不了的文件用ffmpeg"""
+    if audio_file.rsplit('.', 1)[-1].lower() in NATIVE_DECODE_FORMATS:
+        blocks = list(iter_audio_blocks(audio_file, DECODE_BLOCK_SECONDS))
+        return np.concatenate(blocks) if blocks else np.zeros(0, dtype=np.float32)
+    return whisper.load_audio(audio_file)
+
+_catalog = None
+_catalog_lock = threading.Lock()
+_ingest_pool = ThreadPoolExecutor(max_workers=INGEST_WORKERS, thread_name_prefix='ingest')
+_ingest_futures = {}
+
+def load_catalog():
+    """音频目录：上传文件的绝对路径 -> 预处理结果，首次访问时从磁盘读取"""
+    global _catalog
+    with _catalog_lock:
+        if _catalog is None:
+            _catalog = {}
+            if os.path.exists(CATALOG_FILE):
+                with open(CATALOG_FILE, 'r', encoding='utf-8') as f:
+                    _catalog = json.load(f)
+        return _catalog
+
+def update_catalog(audio_file, entry):
+    """写入一条目录记录并保存到磁盘"""
+    catalog = load_catalog()
+    with _catalog_lock:
+        catalog[os.path.abspath(audio_file)] = entry
+        temp_path = f'{CATALOG_FILE}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(catalog, f, ensure_ascii=False, indent=2)
+        os.replace(temp_path, CATALOG_FILE)
+
+def catalog_entry(audio_file):
+    """已完成预处理且与当前文件一致（大小、修改时间未变）的目录记录，否则返回None"""
+    entry = load_catalog().get(os.path.abspath(audio_file))
+    if not entry or entry['state'] != 'ready':
+        return None
+    stat = os.stat(audio_file)
+    if entry['size'] != stat.st_size or entry['mtime'] != stat.st_mtime or not os.path.exists(entry['canonical']):
+        return None
+    return entry
+
+def probe_audio(audio_file):
+    """读取编码信息：WAV/FLAC等读文件头，其它格式用ffprobe，都不可用时只记录扩展名"""
+    import soundfile as sf
+    try:
+        info = sf.info(audio_file)
+        return {'codec': f'{info.format}/{info.subtype}'.lower(), 'sample_rate': info.samplerate, 'channels': info.channels}
+    except RuntimeError:
+        pass
+    try:
+        output = subprocess.run(
+            ['ffprobe', '-v', 'error', '-select_streams', 'a:0', '-show_entries',
+             'stream=codec_name,sample_rate,channels', '-of', 'json', audio_file],
+            capture_output=True, text=True, check=True
+        ).stdout
+        stream = json.loads(output)['streams'][0]
+        return {'codec': stream['codec_name'], 'sample_rate': int(stream['sample_rate']), 'channels': stream['channels']}
+    except (OSError, ValueError, KeyError, IndexError, subprocess.CalledProcessError):
+        return {'codec': audio_file.rsplit('.', 1)[-1].lower(), 'sample_rate': None, 'channels': None}
+
+def ingest_file(audio_file):
+    """预处理一个上传文件：分块解码为16kHz单声道float32写入规范文件，同时计算内容哈希，内存占用与时长无关"""
+    start = time.time()
+    stat = os.stat(audio_file)
+    entry = dict(probe_audio(audio_file), name=os.path.basename(audio_file), size=stat.st_size, mtime=stat.st_mtime)
+    temp_path = None
+    try:
+        os.makedirs(CANONICAL_FOLDER, exist_ok=True)
+        digest = hashlib.sha1()
+        samples = 0
+        temp_path = os.path.join(CANONICAL_FOLDER, f'{uuid.uuid4().hex}.tmp')
+        with open(temp_path, 'wb') as f:
+            for block in iter_audio_blocks(audio_file, DECODE_BLOCK_SECONDS, use_catalog=False):
+                block = np.ascontiguousarray(block, dtype=np.float32)
+                digest.update(block.data)
+                f.write(block.tobytes())
+                samples += len(block)
+        # 哈希与audio_content_hash(整段音频)一致，内容相同的文件共用一个规范文件
+        canonical = os.path.join(CANONICAL_FOLDER, f'{digest.hexdigest()}.f32')
+        os.replace(temp_path, canonical)
+        entry.update({
+            'state': 'ready',
+            'duration': round(samples / SAMPLE_RATE, 3),
+            'samples': samples,
+            'content_hash': digest.hexdigest(),
+            'canonical': canonical,
+            'ingest_time': round(time.time() - start, 3)
+        })
+    except Exception as e:
+        # 改名前失败时临时文件还在，删掉避免在规范目录中堆积
+        if temp_path and os.path.exists(temp_path):
+            os.remove(temp_path)
+        entry.update({'state': 'failed', 'error': str(e)})
+        print(f"❌ 预处理失败 {audio_file}: {e}")
+    update_catalog(audio_file, entry)
+    return entry
+
+def submit_ingest(audio_file):
+    """把文件交给后台预处理线程池"""
+    update_catalog(audio_file, {'name': os.path.basename(audio_file), 'state': 'pending'})
+    _ingest_futures[os.path.abspath(audio_file)] = _ingest_pool.submit(ingest_file, audio_file)
+
+def wait_for_ingest(audio_file):
+    """转录前等待该文件的预处理完成（已完成或未提交时立即返回）"""
+    future = _ingest_futures.get(os.path.abspath(audio_file))
+    if future is not None and not future.done():
+        current_status()['current_step'] = f'等待预处理: {os.path.basename(audio_file)}'
+        future.result()
+
+def ingest_pending_uploads():
+    """启动时为目录中没有有效记录的上传文件补做预处理"""
+    for filename in sorted(os.listdir(UPLOAD_FOLDER)):
+        path = os.path.join(UPLOAD_FOLDER, filename)
+        if allowed_file(filename) and os.path.isfile(path) and catalog_entry(path) is None:
+            submit_ingest(path)
+
+_audio_cache = OrderedDict()
+_audio_cache_bytes = 0
+_audio_cache_lock = threading.Lock()
+
+def load_audio_cached(audio_file):
+    """解码音频为16kHz单声道，结果按(路径, 修改时间, 大小)缓存，供各引擎和重复运行复用"""
+    global _audio_cache_bytes
+    stat = os.stat(audio_file)
+    key = (os.path.abspath(audio_file), stat.st_mtime, stat.st_size)
+    with _audio_cache_lock:
+        if key in _audio_cache:
+            _audio_cache.move_to_end(key)
+            return _audio_cache[key]
+    
+    # 已预处理的文件直接读规范文件，不再解码
+    entry = catalog_entry(audio_file)
+    if entry:
+        audio = np.fromfile(entry['canonical'], dtype=np.float32)
+        register_content_hash(audio, entry['content_hash'])
+    else:
+        audio = decode_audio(audio_file)
+    with _audio_cache_lock:
+        if key not in _audio_cache:
+            _audio_cache[key] = audio
+            _audio_cache_bytes += audio.nbytes
+        while _audio_cache_bytes > AUDIO_CACHE_MAX_BYTES and len(_audio_cache) > 1:
+            _, evicted = _audio_cache.popitem(last=False)
+            _audio_cache_bytes -= evicted.nbytes
+    return audio
+
+# 已知哈希的音频数组（预处理时算过的），按对象弱引用登记，避免重复计算；数组释放时登记随之删除
+_known_content_hashes = {}
+
+def register_content_hash(audio, content_hash):
+    """登记音频数组的内容哈希"""
+    _known_content_hashes[id(audio)] = (weakref.ref(audio), content_hash)
+    weakref.finalize(audio, _known_content_hashes.pop, id(audio), None)
+
+def audio_content_hash(audio):
+    """解码后音频内容的哈希，用作按内容缓存的键（与文件名、格式无关）"""
+    known = _known_content_hashes.get(id(audio))
+    if known and known[0]() is audio:
+        return known[1]
+    return hashlib.sha1(np.ascontiguousarray(audio).data).hexdigest()
+
+# 只有文件转录（含长文件分块、级联重解码）启用特征缓存，流式转录的滑动窗口每次都不同，不缓存
+_mel_cache_state = threading.local()
+
+@contextmanager
+def mel_cache_scope(enabled):
+    """在当前线程内启用/停用log-mel特征缓存"""
+    previous = getattr(_mel_cache_state, 'enabled', False)
+    _mel_cache_state.enabled = enabled
+    try:
+        yield
+    finally:
+        _mel_cache_state.enabled = previous
+
+def mel_cache_path(content_hash, n_mels, n_frames, padding):
+    """log-mel缓存文件路径，形状写在文件名里，读取时无需额外的元数据"""
+    hop = whisper.audio.HOP_LENGTH
+    return os.path.join(CACHE_FOLDER, 'mel', f'{content_hash}-pad{padding}-hop{hop}-{n_mels}x{n_frames}.f16')
+
+def evict_mel_cache(max_bytes=MEL_CACHE_MAX_BYTES):
+    """缓存目录超出上限时按最近使用时间删除旧文件"""
+    folder = os.path.join(CACHE_FOLDER, 'mel')
+    entries = []
+    for name in os.listdir(folder):
+        if name.endswith('.f16'):
+            stat = os.stat(os.path.join(folder, name))
+            entries.append((stat.st_mtime, stat.st_size, name))
+    total = sum(size for _, size, _ in entries)
+    for _, size, name in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(os.path.join(folder, name))
+        except FileNotFoundError:
+            pass  # 其它进程已删除
+        total -= size
+
+def cached_log_mel_spectrogram(audio, n_mels=80, padding=0, device=None):
+    """带缓存的log_mel_spectrogram
+    
+    同一段音频换模型重跑、级联各级重解码同一片段时，直接从内存映射文件读出特征，跳过STFT。
+    只缓存numpy音频（whisper.transcribe的调用方式），其它输入原样交给Whisper计算。
+    """
+    if not getattr(_mel_cache_state, 'enabled', False) or not isinstance(audio, np.ndarray):
+        return whisper.audio.log_mel_spectrogram(audio, n_mels, padding, device)
+    import torch
+    
+    n_frames = (len(audio) + padding) // whisper.audio.HOP_LENGTH
+    path = mel_cache_path(audio_content_hash(audio), n_mels, n_frames, padding)
+    if os.path.exists(path):
+        os.utime(path)
+        stored = np.memmap(path, dtype=np.float16, mode='r', shape=(n_mels, n_frames))
+        mel = torch.from_numpy(stored.astype(np.float32))
+        return mel.to(device) if device is not None else mel
+    
+    mel = whisper.audio.log_mel_spectrogram(audio, n_mels, padding, device)
+    if tuple(mel.shape) == (n_mels, n_frames):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 先写临时文件再改名，并行的分块worker不会读到写了一半的文件
+        temp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        stored = np.memmap(temp_path, dtype=np.float16, mode='w+', shape=(n_mels, n_frames))
+        stored[:] = mel.cpu().numpy()
+        stored.flush()
+        del stored
+        os.replace(temp_path, path)
+        evict_mel_cache()
+    return mel
+
+@whisper.on_import
+def install_mel_cache(module):
+    """whisper.transcribe在模块内直接调用log_mel_spectrogram，替换该引用后PyTorch和ONNX后端都走缓存"""
+    sys.modules['whisper.transcribe'].log_mel_spectrogram = cached_log_mel_spectrogram
+
+def probe_duration(audio_file):
+    """不解码整个文件获取时长（秒）：优先用预处理目录，其次读文件头、ffprobe，都不行时才解码"""
+    import soundfile as sf
+    entry = catalog_entry(audio_file)
+    if entry:
+        return entry['duration']
+    try:
+        return sf.info(audio_file).duration
+    except RuntimeError:
+        pass
+    try:
+        output = subprocess.run(
+            ['ffprobe', '-v', 'error', '-show_entries', 'format=duration', '-of', 'csv=p=0', audio_file],
+            capture_output=True, text=True, check=True
+        ).stdout
+        return float(output.strip())
+    except (OSError, ValueError, subprocess.CalledProcessError):
+        return len(load_audio_cached(audio_file)) / SAMPLE_RATE
+
+def estimate_job_memory(model_name, duration, options=None):
+    """估计单个文件转录的峰值内存（字节）：尚未常驻的模型 + 音频和特征"""
+    options = options or {}
+    factor = PRECISION_MEMORY_FACTOR[options.get('precision', 'fp32')]
+    audio_bytes = duration * SAMPLE_RATE * 4 * AUDIO_MEMORY_FACTOR
+    if options.get('engine') == 'fireredasr':
+        return int(MODEL_MEMORY_BYTES['fireredasr'] + audio_bytes)
+    
+    first_pass_model = options['cascade_start'] if options.get('cascade') else model_name
+    model_bytes = MODEL_MEMORY_BYTES[first_pass_model] * factor
+    strategy = long_file_strategy(duration, options.get('long_file_mode', 'auto'))
+    if strategy == 'parallel':
+        # 每个worker进程各加载一份模型，分块音频也会复制到worker
+        model_bytes *= worker_layout(first_pass_model, options)['workers']
+        audio_bytes *= 2
+    elif strategy == 'stream':
+        audio_bytes = (STREAM_DECODE_WINDOW_SECONDS + STREAM_DECODE_BLOCK_SECONDS) * SAMPLE_RATE * 4 * AUDIO_MEMORY_FACTOR
+    if options.get('cascade'):
+        levels = CASCADE_CHAIN[CASCADE_CHAIN.index(first_pass_model) + 1:CASCADE_CHAIN.index(model_name) + 1]
+        model_bytes += sum(MODEL_MEMORY_BYTES[level] * factor for level in levels
+                           if not is_resident_engine(level, options))
+    return int(model_bytes + audio_bytes)
+
+def detect_speech_frames(audio, frame_seconds=VAD_FRAME_SECONDS):
+    """基于能量的简单VAD，返回每帧是否为语音的布尔数组"""
+    frame_len = int(SAMPLE_RATE * frame_seconds)
+    n_frames = len(audio) // frame_len
+    if n_frames == 0:
+        return np.zeros(0, dtype=bool)
+    
+    frames = audio[:n_frames * frame_len].reshape(n_frames, frame_len)
+    energy_db = 10 * np.log10(np.mean(frames ** 2, axis=1) + 1e-10)
+    # 以较安静的帧估计底噪，高于底噪一定幅度才算语音
+    noise_floor = np.percentile(energy_db, 10)
+    threshold = max(noise_floor + 8.0, -60.0)
+    return energy_db > threshold
+
+def find_pause_intervals(audio, min_pause_seconds=VAD_MIN_PAUSE_SECONDS):
+    """返回所有停顿区间 [(start_sample, end_sample), ...]"""
+    speech = detect_speech_frames(audio)
+    frame_len = int(SAMPLE_RATE * VAD_FRAME_SECONDS)
+    min_pause_frames = max(1, int(min_pause_seconds / VAD_FRAME_SECONDS))
+    
+    intervals = []
+    run_start = None
+    for i, is_speech in enumerate(np.append(speech, True)):
+        if not is_speech and run_start is None:
+            run_start = i
+        elif is_speech and run_start is not None:
+            if i - run_start >= min_pause_frames:
+                intervals.append((run_start * frame_len, i * frame_len))
+            run_start = None
+    return intervals
+
+def split_audio_at_pauses(audio, max_chunk_seconds=LONG_FILE_CHUNK_SECONDS,
+                          min_chunk_seconds=LONG_FILE_MIN_CHUNK_SECONDS,
+                          overlap_seconds=LONG_FILE_OVERLAP_SECONDS):
+    """在停顿处把音频切成不超过max_chunk_seconds的块
+    
+    返回 [(start_sample, end_sample), ...]。能在停顿处切就不重叠；
+    窗口内找不到停顿时硬切，并让相邻两块重叠overlap_seconds，由拼接阶段去重。
+    """
+    total = len(audio)
+    max_len = int(max_chunk_seconds * SAMPLE_RATE)
+    min_len = int(min_chunk_seconds * SAMPLE_RATE)
+    overlap = int(overlap_seconds * SAMPLE_RATE)
+    pauses = find_pause_intervals(audio)
+    
+    chunks = []
+    start = 0
+    while total - start > max_len:
+        # 取窗口内最靠后的停顿，切在停顿中点；停顿跨过窗口上限时直接切在上限处
+        low, high = start + min_len, start + max_len
+        candidates = [(p_start, p_end) for p_start, p_end in pauses if p_end > low and p_start < high]
+        if candidates:
+            p_start, p_end = candidates[-1]
+            cut = high if p_end >= high else max((p_start + p_end) // 2, low + 1)
+            chunks.append((start, cut))
+            start = cut
+        else:
+            cut = start + max_len
+            chunks.append((start, cut))
+            start = cut - overlap
+    chunks.append((start, total))
+    return chunks
+
+def dedupe_boundary_text(previous_text, next_text, max_overlap_chars=30):
+    """去掉next_text开头与previous_text结尾重复的部分"""
+    limit = min(len(previous_text), len(next_text), max_overlap_chars)
+    for size in range(limit, 1, -1):
+        if previous_text.endswith(next_text[:size]):
+            return next_text[size:].lstrip()
+    return next_text
+
+def shift_segment(segment, offset):
+    """片段（连同词级时间戳）整体平移offset秒"""
+    shifted = dict(segment, start=offset + segment['start'], end=offset + segment['end'])
+    if 'words' in segment:
+        shifted['words'] = [dict(word, start=round(offset + word['start'], 3), end=round(offset + word['end'], 3))
+                            for word in segment['words']]
+    return shifted
+
+def stitch_chunk_segments(chunk_results):
+    """把各块的片段按时间拼接回整段，重叠区域按中点取舍并去除重复文本
+    
+    chunk_results: [{'start': 秒, 'end': 秒, 'segments': [...]}, ...]，片段时间已是绝对时间
+    """
+    merged = []
+    previous_end = None
+    for chunk in sorted(chunk_results, key=lambda c: c['start']):
+        segments = chunk['segments']
+        if previous_end is not None and chunk['start'] < previous_end:
+            # 重叠区域以中点为界：前一块保留中点之前开始的片段，后一块保留中点之后结束的片段
+            midpoint = (chunk['start'] + previous_end) / 2
+            merged = [seg for seg in merged if seg['start'] < midpoint]
+            segments = [seg for seg in segments if seg['end'] > midpoint]
+            if merged and segments:
+                first = dict(segments[0])
+                first['text'] = dedupe_boundary_text(merged[-1]['text'], first['text'])
+                first['start'] = max(first['start'], merged[-1]['end'])
+                if 'words' in first:
+                    first['words'] = [word for word in first['words'] if word['start'] >= first['start']]
+                # 前一块的片段结束得更晚时，这个片段整个落在它里面，不再保留
+                keep = first['text'] and first['start'] < first['end']
+                segments = ([first] if keep else []) + segments[1:]
+        merged.extend(segments)
+        previous_end = chunk['end']
+    return merged
+
+# 语言识别结果按音频内容哈希缓存，磁盘上另存一份供重启后复用
+_language_cache = {}
+_language_cache_lock = threading.Lock()
+
+def language_cache_path(content_hash):
+    """语言识别结果的磁盘缓存路径"""
+    return os.path.join(CACHE_FOLDER, 'language', f'{content_hash}-{LANGID_MODEL}.json')
+
+def sample_language_windows(audio, max_windows=LANGID_MAX_WINDOWS):
+    """在停顿处切出语言识别窗口，返回 (所有窗口, 抽样检测的窗口下标)"""
+    windows = split_audio_at_pauses(audio, max_chunk_seconds=LANGID_WINDOW_SECONDS,
+                                    min_chunk_seconds=LANGID_WINDOW_SECONDS / 3, overlap_seconds=0)
+    speech = detect_speech_frames(audio)
+    frame_len = int(SAMPLE_RATE * VAD_FRAME_SECONDS)
+    candidates = []
+    for index, (start, end) in enumerate(windows):
+        frames = speech[start // frame_len:end // frame_len]
+        if frames.size and frames.mean() >= LANGID_MIN_SPEECH_RATIO:
+            candidates.append(index)
+    if not candidates:
+        candidates = [0]
+    # 在语音窗口中均匀抽样，覆盖文件的前中后各部分
+    if len(candidates) > max_windows:
+        step = (len(candidates) - 1) / (max_windows - 1)
+        candidates = [candidates[round(i * step)] for i in range(max_windows)]
+    return windows, candidates
+
+def detect_file_languages(audio):
+    """抽样若干语音窗口做语言识别，返回语言区域 [{'start': 秒, 'end': 秒, 'language': 代码}, ...]
+    
+    相邻且语言相同的窗口合并为一个区域，未抽样的窗口取最近的抽样窗口的语言。
+    结果按音频内容哈希缓存，重复运行或换模型转录同一文件时不再检测。
+    """
+    content_hash = audio_content_hash(audio)
+    with _language_cache_lock:
+        if content_hash in _language_cache:
+            return _language_cache[content_hash]
+    
+    path = language_cache_path(content_hash)
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            regions = json.load(f)['regions']
+    else:
+        windows, sampled = sample_language_windows(audio)
+        engine = get_resident_engine(LANGID_MODEL, {})
+        probs = engine.detect_language([audio[windows[i][0]:windows[i][1]] for i in sampled])
+        
+        detections = []
+        for index, window_probs in zip(sampled, probs):
+            language = max(window_probs, key=window_probs.get)
+            detections.append({
+                'start': round(windows[index][0] / SAMPLE_RATE, 2),
+                'end': round(windows[index][1] / SAMPLE_RATE, 2),
+                'language': language,
+                'probability': round(window_probs[language], 4)
+            })
+        confident = {index: d['language'] for index, d in zip(sampled, detections) if d['probability'] >= LANGID_MIN_PROB}
+        if not confident:
+            best = max(detections, key=lambda d: d['probability'])
+            confident = {sampled[detections.index(best)]: best['language']}
+        
+        regions = []
+        for index, (start, end) in enumerate(windows):
+            language = confident[min(confident, key=lambda i: abs(i - index))]
+            if regions and regions[-1]['language'] == language:
+                regions[-1]['end'] = round(end / SAMPLE_RATE, 2)
+            else:
+                regions.append({'start': round(start / SAMPLE_RATE, 2), 'end': round(end / SAMPLE_RATE, 2), 'language': language})
+        
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'model': LANGID_MODEL, 'regions': regions, 'detections': detections}, f, ensure_ascii=False, indent=2)
+    
+    with _language_cache_lock:
+        _language_cache[content_hash] = regions
+    return regions
+
+def dominant_language(regions):
+    """按时长占比最大的语言"""
+    totals = {}
+    for region in regions:
+        totals[region['language']] = totals.get(region['language'], 0.0) + region['end'] - region['start']
+    return max(totals, key=totals.get)
+
+def language_at(regions, seconds):
+    """给定时间点所在区域的语言"""
+    for region in regions:
+        if seconds < region['end']:
+            return region['language']
+    return regions[-1]['language']
+
+def transcribe_language_regions(engine, audio, regions, policy):
+    """多语言文件：每个语言区域用各自的语言转录一次，片段时间换算回整段"""
+    segments = []
+    decode_stats = None
+    for region in regions:
+        start, end = int(region['start'] * SAMPLE_RATE), int(region['end'] * SAMPLE_RATE)
+        result = engine.transcribe(audio[start:end], language=region['language'], task="transcribe",
+                                   policy=policy, cache_features=True)
+        for segment in result.get('segments', []):
+            segments.append(dict(segment, start=region['start'] + segment['start'],
+                                 end=region['start'] + segment['end'], language=region['language']))
+        if result.get('decode_stats'):
+            decode_stats = merge_decode_stats(decode_stats, result['decode_stats'])
+    return {
+        'text': ''.join(seg['text'].strip() for seg in segments),
+        'language': dominant_language(regions),
+        'segments': segments,
+        'decode_stats': decode_stats
+    }
+
+def thread_benchmark_path():
+    """线程调优基准测试结果，长文件模式的默认进程×线程划分依据该文件"""
+    return os.path.join(CACHE_FOLDER, 'benchmarks', 'threads.json')
+
+def worker_layout(model_name, options=None):
+    """长文件worker的进程数、每进程intra-op/inter-op线程数和是否绑核
+    
+    优先级：任务选项 > 该模型最近一次线程调优结果 > 按CPU核数估算的默认值。
+    """
+    cpu_count = os.cpu_count() or 1
+    layout = {'workers': LONG_FILE_WORKERS, 'threads': None,
+              'interop_threads': LONG_FILE_INTEROP_THREADS, 'pin_cores': False}
+    if os.path.exists(thread_benchmark_path()):
+        with open(thread_benchmark_path(), 'r', encoding='utf-8') as f:
+            report = json.load(f)
+        if report.get('model') == model_name and report.get('cpu_count') == cpu_count and report.get('best'):
+            layout.update({key: report['best'][key] for key in ('workers', 'threads', 'interop_threads')})
+    layout.update((options or {}).get('worker_layout', {}))
+    if not layout['threads']:
+        layout['threads'] = max(1, cpu_count // layout['workers'])
+    return layout
+
+def assign_worker_cores(workers, threads):
+    """给每个worker分配互不重叠的CPU核心（核心不够时循环复用），平台不支持绑核时返回None"""
+    import psutil
+    if not hasattr(psutil.Process, 'cpu_affinity'):
+        print("⚠️ 当前平台不支持设置CPU亲和性，跳过绑核")
+        return None
+    cores = psutil.Process().cpu_affinity()
+    return [[cores[(i * threads + j) % len(cores)] for j in range(threads)] for i in range(workers)]
+
+def create_worker_pool(model_name, options, layout):
+    """按worker_layout创建分块转录进程池"""
+    # spawn方式在各平台行为一致，也避免fork带着已初始化的torch线程池
+    context = multiprocessing.get_context('spawn')
+    core_queue = None
+    if layout['pin_cores']:
+        core_sets = assign_worker_cores(layout['workers'], layout['threads'])
+        if core_sets:
+            core_queue = context.Queue()
+            for cores in core_sets:
+                core_queue.put(cores)
+    return ProcessPoolExecutor(max_workers=layout['workers'], mp_context=context,
+                               initializer=_init_chunk_worker,
+                               initargs=(model_name, options, layout, core_queue))
+
+# 分块worker进程内常驻的推理引擎
+_chunk_worker_engine = None
+
+def _init_chunk_worker(model_name, options, layout, core_queue=None):
+    """分块worker初始化：设置线程数、按需绑核，并加载一次模型"""
+    global _chunk_worker_engine
+    import torch
+    # 新进程里还没有执行过并行算子，此时才能设置inter-op线程数
+    torch.set_num_threads(layout['threads'])
+    torch.set_num_interop_threads(layout['interop_threads'])
+    if core_queue is not None:
+        import psutil
+        psutil.Process().cpu_affinity(core_queue.get())
+    _chunk_worker_engine = create_engine(model_name, options)
+
+def _transcribe_chunk(chunk_audio, offset, policy, language):
+    """在worker中转录一块音频，返回绝对时间的片段和解码统计"""
+    result = _chunk_worker_engine.transcribe(
+        chunk_audio,
+        language=language,
+        task="transcribe",
+        condition_on_previous_text=False,
+        policy=policy,
+        cache_features=True
+    )
+    segments = [{
+        'start': offset + segment.get('start', 0),
+        'end': offset + segment.get('end', 0),
+        'text': segment.get('text', '').strip(),
+        'avg_logprob': segment.get('avg_logprob', 0.0),
+        'compression_ratio': segment.get('compression_ratio', 0.0),
+        'no_speech_prob': segment.get('no_speech_prob', 0.0)
+    } for segment in result.get('segments', [])]
+    return segments, result.get('decode_stats')
+
+def transcribe_long_audio(audio, model_name='base', options=None):
+    """长文件模式：在停顿处分块，多进程并行转录后拼接"""
+    options = options or {}
+    policy = DecodePolicy(**options.get('decode_policy', {}))
+    regions = options.get('language_regions') or [{'start': 0.0, 'end': len(audio) / SAMPLE_RATE, 'language': 'zh'}]
+    chunks = split_audio_at_pauses(audio)
+    layout = worker_layout(model_name, options)
+    layout['workers'] = max(1, min(layout['workers'], len(chunks)))
+    
+    chunk_results = []
+    decode_stats = None
+    with create_worker_pool(model_name, options, layout) as pool:
+        futures = {
+            pool.submit(_transcribe_chunk, audio[start:end], start / SAMPLE_RATE,
+                        policy.scaled((end - start) / len(audio)),
+                        language_at(regions, (start + end) / 2 / SAMPLE_RATE)): (start, end)
+            for start, end in chunks
+        }
+        for done, future in enumerate(as_completed(futures), 1):
+            start, end = futures[future]
+            segments, chunk_stats = future.result()
+            chunk_results.append({
+                'start': start / SAMPLE_RATE,
+                'end': end / SAMPLE_RATE,
+                'segments': segments
+            })
+            if chunk_stats:
+                decode_stats = merge_decode_stats(decode_stats, chunk_stats)
+            current_status()['current_step'] = (f'长文件分块转录 {done}/{len(chunks)} '
+                                            f'({layout["workers"]} 个进程 × {layout["threads"]} 线程)')
+    
+    segments = stitch_chunk_segments(chunk_results)
+    return {
+        'text': ''.join(seg['text'] for seg in segments),
+        'language': dominant_language(regions),
+        'segments': segments,
+        'chunks': len(chunks),
+        'decode_stats': decode_stats
+    }
+
+def long_file_strategy(duration, mode):
+    """根据长文件模式设置(auto/on/off/stream)和时长选择处理方式：single / parallel / stream"""
+    if mode == 'on':
+        return 'parallel'
+    if mode in ('off', 'stream'):
+        return 'single' if mode == 'off' else 'stream'
+    if duration > STREAM_DECODE_THRESHOLD:
+        return 'stream'
+    return 'parallel' if duration > LONG_FILE_THRESHOLD else 'single'
+
+def iter_audio_blocks(audio_file, block_seconds=STREAM_DECODE_BLOCK_SECONDS, use_catalog=True):
+    """流式解码音频文件，逐块产出16kHz单声道float32样本
+    
+    已预处理的文件直接分块读规范文件；WAV/FLAC用soundfile分块读取、在进程内混成单声道并多相重采样，
+    其它文件经ffmpeg管道重采样，任何时刻只持有一块数据。
+    """
+    import soundfile as sf
+    block_len = int(block_seconds * SAMPLE_RATE)
+    entry = catalog_entry(audio_file) if use_catalog else None
+    if entry:
+        canonical = np.memmap(entry['canonical'], dtype=np.float32, mode='r')
+        for start in range(0, len(canonical), block_len):
+            yield np.array(canonical[start:start + block_len])
+        return
+    info = None
+    if audio_file.rsplit('.', 1)[-1].lower() in NATIVE_DECODE_FORMATS:
+        try:
+            info = sf.info(audio_file)
+        except RuntimeError:
+            pass  # 文件头异常时交给ffmpeg
+    if info is not None:
+        resampler = PolyphaseResampler(info.samplerate) if info.samplerate != SAMPLE_RATE else None
+        # 按声道取平均混成单声道；矩阵乘法比沿最后一维mean快得多
+        downmix = np.full(info.channels, 1.0 / info.channels, dtype=np.float32)
+        with sf.SoundFile(audio_file) as f:
+            for block in f.blocks(blocksize=int(block_seconds * info.samplerate), dtype='float32', always_2d=True):
+                mono = block[:, 0] if info.channels == 1 else block @ downmix
+                yield resampler.process(mono) if resampler else mono
+        if resampler:
+            yield resampler.flush()
+        return
+    
+    # 与whisper.load_audio相同的ffmpeg参数，只是按块读取管道输出
+    cmd = ['ffmpeg', '-nostdin', '-threads', '0', '-i', audio_file,
+           '-f', 's16le', '-ac', '1', '-acodec', 'pcm_s16le', '-ar', str(SAMPLE_RATE), '-']
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
     try:
-        # 加载Whisper模型
-        whisper_model = whisper.load_model(model_name)
+        while True:
+            data = process.stdout.read(block_len * 2)
+            if not data:
+                break
+            yield np.frombuffer(data[:len(data) // 2 * 2], np.int16).astype(np.float32) / 32768.0
+    finally:
+        process.stdout.close()
+        process.kill()
+        process.wait()
+    if process.returncode not in (0, -9):
+        raise RuntimeError(f'ffmpeg解码失败: {audio_file}')
+
+def iter_audio_windows(audio_file, window_seconds=STREAM_DECODE_WINDOW_SECONDS):
+    """把流式解码的音频块切成在停顿处断开的窗口，产出 (起始样本, 窗口音频)
+    
+    缓冲区超过窗口时长才切分，最后一块留在缓冲区里与后续音频拼接，
+    因此缓冲区最多只有一个窗口加一个解码块。硬切的窗口彼此重叠，由拼接阶段去重。
+    """
+    buffer = np.zeros(0, dtype=np.float32)
+    offset = 0
+    for block in iter_audio_blocks(audio_file):
+        buffer = np.concatenate([buffer, block])
+        if len(buffer) <= window_seconds * SAMPLE_RATE:
+            continue
+        chunks = split_audio_at_pauses(buffer, max_chunk_seconds=window_seconds)
+        for start, end in chunks[:-1]:
+            yield offset + start, buffer[start:end]
+        keep_from = chunks[-1][0]
+        buffer = buffer[keep_from:].copy()
+        offset += keep_from
+    if len(buffer):
+        yield offset, buffer
+
+def needs_escalation(segment, thresholds):
+    """片段的置信度指标是否越过级联阈值"""
+    return (segment.get('avg_logprob', 0.0) < thresholds['avg_logprob']
+            or segment.get('compression_ratio', 0.0) > thresholds['compression_ratio']
+            or segment.get('no_speech_prob', 0.0) > thresholds['no_speech_prob'])
+
+def escalate_segments(audio, segments, model_name, options, thresholds):
+    """用更大的常驻模型重解码越过阈值的片段，返回 (新片段列表, 升级的音频秒数)"""
+    engine = get_resident_engine(model_name, options)
+    duration = len(audio) / SAMPLE_RATE
+    regions = options.get('language_regions') or [{'start': 0.0, 'end': duration, 'language': 'zh'}]
+    escalated_seconds = 0.0
+    output = []
+    for segment in segments:
+        if not needs_escalation(segment, thresholds):
+            output.append(segment)
+            continue
         
-        # 使用Whisper转录
-        result = whisper_model.transcribe(
-            audio_file,
-            language="zh",
-            task="transcribe"
+        escalated_seconds += segment['end'] - segment['start']
+        start = max(0.0, segment['start'] - CASCADE_PADDING_SECONDS)
+        end = min(duration, segment['end'] + CASCADE_PADDING_SECONDS)
+        result = engine.transcribe(
+            audio[int(start * SAMPLE_RATE):int(end * SAMPLE_RATE)],
+            language=language_at(regions, (segment['start'] + segment['end']) / 2),
+            task="transcribe",
+            condition_on_previous_text=False,
+            cache_features=True
         )
+        redecoded = [seg for seg in result.get('segments', []) if seg['text'].strip()]
+        if not redecoded:
+            # 大模型认为这里没有语音，丢弃小模型的幻觉文本
+            continue
+        # 保持原片段边界不变，后续的说话人分配不受影响
+        output.append({
+            'start': segment['start'],
+            'end': segment['end'],
+            'text': ''.join(seg['text'].strip() for seg in redecoded),
+            'avg_logprob': sum(seg['avg_logprob'] for seg in redecoded) / len(redecoded),
+            'compression_ratio': max(seg['compression_ratio'] for seg in redecoded),
+            'no_speech_prob': min(seg['no_speech_prob'] for seg in redecoded),
+            'model': model_name
+        })
+    return output, escalated_seconds
+
+def run_cascade(audio, segments, start_model, target_model, options):
+    """沿级联链逐级升级可疑片段，返回 (最终片段, 级联统计)"""
+    thresholds = options.get('cascade_thresholds', CASCADE_DEFAULT_THRESHOLDS)
+    duration = len(audio) / SAMPLE_RATE
+    levels = CASCADE_CHAIN[CASCADE_CHAIN.index(start_model) + 1:CASCADE_CHAIN.index(target_model) + 1]
+    
+    stats = {'start_model': start_model, 'levels': [], 'escalated_seconds': 0.0}
+    for level_model in levels:
+        current_status()['current_step'] = f'级联升级: {level_model}'
+        level_start = time.time()
+        segments, escalated_seconds = escalate_segments(audio, segments, level_model, options, thresholds)
+        stats['levels'].append({
+            'model': level_model,
+            'escalated_seconds': round(escalated_seconds, 2),
+            'time': round(time.time() - level_start, 3)
+        })
+        if not escalated_seconds:
+            break
+    
+    # 升级比例按进入第二级的音频计算，更高级别只是其中的子集
+    first_level = stats['levels'][0]['escalated_seconds'] if stats['levels'] else 0.0
+    stats['escalated_seconds'] = first_level
+    stats['escalated_fraction'] = round(first_level / duration, 4) if duration else 0.0
+    return segments, stats
+
+def batched_dtw(costs):
+    """批量DTW，返回每个代价矩阵的 (行下标, 列下标) 对齐路径
+    
+    单元(i, j)只依赖(i-1, j-1)、(i-1, j)、(i, j-1)，同一条反对角线 i+j=d 上的单元互不依赖，
+    按反对角线推进，每一步把整批矩阵在这条线上的单元一次算完。形状不同的矩阵用inf填充，
+    填充区域不会影响各自的有效区域。选择规则与whisper.timing.dtw相同。
+    """
+    sizes = [cost.shape for cost in costs]
+    rows = max(n for n, _ in sizes)
+    cols = max(m for _, m in sizes)
+    x = np.full((len(costs), rows, cols), np.inf)
+    for b, cost in enumerate(costs):
+        x[b, :cost.shape[0], :cost.shape[1]] = cost
+    accumulated = np.full((len(costs), rows + 1, cols + 1), np.inf, dtype=np.float32)
+    accumulated[:, 0, 0] = 0
+    trace = np.zeros((len(costs), rows + 1, cols + 1), dtype=np.int8)
+    for d in range(2, rows + cols + 1):
+        i = np.arange(max(1, d - cols), min(rows, d - 1) + 1)
+        j = d - i
+        c0 = accumulated[:, i - 1, j - 1]
+        c1 = accumulated[:, i - 1, j]
+        c2 = accumulated[:, i, j - 1]
+        choice = np.where((c0 < c1) & (c0 < c2), 0, np.where((c1 < c0) & (c1 < c2), 1, 2)).astype(np.int8)
+        accumulated[:, i, j] = x[:, i - 1, j - 1] + np.choose(choice, (c0, c1, c2))
+        trace[:, i, j] = choice
+    
+    paths = []
+    for b, (n, m) in enumerate(sizes):
+        steps = trace[b, :n + 1, :m + 1].copy()
+        steps[0, :] = 2
+        steps[:, 0] = 1
+        i, j = n, m
+        path = []
+        while i > 0 or j > 0:
+            path.append((i - 1, j - 1))
+            step = steps[i, j]
+            if step == 0:
+                i, j = i - 1, j - 1
+            elif step == 1:
+                i -= 1
+            else:
+                j -= 1
+        path = np.array(path[::-1]).T
+        paths.append((path[0], path[1]))
+    return paths
+
+def align_words(model, audio, segments, language, batch_size=WORD_ALIGN_BATCH):
+    """对已解码的片段做词级时间戳对齐，结果写入各片段的words，返回对齐的片段数
+    
+    每批片段各自截取音频算log-mel，合成一批跑一次编码器和一次带完整文本的解码器前向，
+    取对齐注意力头的交叉注意力权重做批量DTW。不需要像transcribe(word_timestamps=True)那样
+    重新解码，也不用逐个窗口单独前向。
+    
+    前向期间模型上不能有其它线程在解码（KV缓存钩子会改写共享的key/value输出），
+    常驻模型要通过PyTorchEngine.align在引擎锁内调用。
+    """
+    import torch
+    from whisper.audio import HOP_LENGTH, N_SAMPLES, TOKENS_PER_SECOND
+    from whisper.model import disable_sdpa
+    from whisper.timing import WordTiming, median_filter, merge_punctuations
+    
+    tokenizer = whisper.tokenizer.get_tokenizer(model.is_multilingual, num_languages=model.num_languages,
+                                                language=language, task='transcribe')
+    heads = model.alignment_heads.indices().T.tolist()
+    
+    items = []
+    for segment in segments:
+        # 编码器输出每帧对应两个hop，至少要有一帧
+        if segment['end'] - segment['start'] < 2 * HOP_LENGTH / SAMPLE_RATE:
+            continue
+        tokens = ([token for token in segment.get('tokens', ()) if token < tokenizer.eot]
+                  or tokenizer.encode(segment['text']))
+        if tokens:
+            items.append((segment, tokens))
+    
+    def recorder(index, qks):
+        def record(module, inputs, outputs):
+            qks[index] = outputs[-1]
+        return record
+    
+    for batch_start in range(0, len(items), batch_size):
+        batch = items[batch_start:batch_start + batch_size]
+        clips = [audio[int(segment['start'] * SAMPLE_RATE):int(segment['end'] * SAMPLE_RATE)][:N_SAMPLES]
+                 for segment, _ in batch]
+        mel = torch.stack([whisper.log_mel_spectrogram(whisper.pad_or_trim(clip), model.dims.n_mels)
+                           for clip in clips]).to(model.device)
+        rows = [[*tokenizer.sot_sequence, tokenizer.no_timestamps, *tokens, tokenizer.eot] for _, tokens in batch]
+        width = max(len(row) for row in rows)
+        # 解码器是因果的，行尾补的eot不影响前面位置的注意力
+        token_batch = torch.tensor([row + [tokenizer.eot] * (width - len(row)) for row in rows], device=model.device)
+        
+        qks = [None] * model.dims.n_text_layer
+        hooks = [block.cross_attn.register_forward_hook(recorder(index, qks))
+                 for index, block in enumerate(model.decoder.blocks)]
+        try:
+            with torch.no_grad(), disable_sdpa():
+                model.decoder(token_batch, model.encoder(mel))
+        finally:
+            for hook in hooks:
+                hook.remove()
+        
+        weights = torch.stack([qks[layer][:, head] for layer, head in heads], dim=1)  # (批, 头, token, 帧)
+        costs = []
+        for b, (row, clip) in enumerate(zip(rows, clips)):
+            matrix = weights[b, :, :len(row), :len(clip) // HOP_LENGTH // 2].float().softmax(dim=-1)
+            std, mean = torch.std_mean(matrix, dim=-2, keepdim=True, unbiased=False)
+            matrix = median_filter((matrix - mean) / std, WORD_ALIGN_MEDFILT_WIDTH).mean(dim=0)
+            costs.append(-matrix[len(tokenizer.sot_sequence):-1].double().cpu().numpy())
         
-        # 格式化输出，模拟说话人识别
-        segments = result.get('segments', [])
+        for (segment, tokens), (text_indices, time_indices) in zip(batch, batched_dtw(costs)):
+            words, word_tokens = tokenizer.split_to_word_tokens(tokens + [tokenizer.eot])
+            boundaries = np.pad(np.cumsum([len(t) for t in word_tokens[:-1]]), (1, 0))
+            jumps = np.pad(np.diff(text_indices), (1, 0), constant_values=1).astype(bool)
+            jump_times = segment['start'] + time_indices[jumps] / TOKENS_PER_SECOND
+            timings = [WordTiming(word, word_tokens[k], jump_times[boundaries[k]], jump_times[boundaries[k + 1]], 1.0)
+                       for k, word in enumerate(words[:-1])]
+            merge_punctuations(timings, WORD_PREPEND_PUNCTUATIONS, WORD_APPEND_PUNCTUATIONS)
+            segment['words'] = [{
+                'word': timing.word,
+                'start': round(float(timing.start), 3),
+                'end': round(float(min(timing.end, segment['end'])), 3)
+            } for timing in timings if timing.word]
+    return len(items)
+
+def merge_alignment_stats(total, stats):
+    """累加词级对齐统计，开销百分比按累计耗时重新计算"""
+    total = dict(total or {'segments': 0, 'words': 0, 'seconds': 0.0, 'decode_seconds': 0.0})
+    for key in ('segments', 'words'):
+        total[key] += stats[key]
+    for key in ('seconds', 'decode_seconds'):
+        total[key] = round(total[key] + stats[key], 3)
+    total['overhead_pct'] = round(total['seconds'] / total['decode_seconds'] * 100, 1) if total['decode_seconds'] else None
+    return total
+
+def align_segment_words(audio, segments, regions, model_name, options, engines=None, decode_seconds=0.0):
+    """词级对齐阶段：用转录所用的Whisper模型按语言区域对齐片段，返回对齐统计
+    
+    开销以本段音频的解码耗时（转录加级联升级）的百分比报告。
+    """
+    engine = (engines or {}).get((model_name, 'whisper'))
+    if not isinstance(engine, PyTorchEngine):
+        # ONNX后端没有可挂钩子的注意力模块，长文件分块模式下模型在worker进程里，都改用常驻的PyTorch模型
+        engine = get_resident_engine(model_name, dict(options, backend='pytorch'))
+    if not isinstance(engine, PyTorchEngine):
+        return None
+    
+    current_status()['current_step'] = '词级时间戳对齐'
+    start = time.time()
+    aligned = 0
+    by_language = {}
+    for segment in segments:
+        by_language.setdefault(language_at(regions, (segment['start'] + segment['end']) / 2), []).append(segment)
+    for language, language_segments in by_language.items():
+        aligned += engine.align(audio, language_segments, language)
+    return merge_alignment_stats(None, {
+        'segments': aligned,
+        'words': sum(len(segment.get('words', ())) for segment in segments),
+        'seconds': time.time() - start,
+        'decode_seconds': decode_seconds
+    })
+
+def transcribe_audio(audio, model_name, options, long_file=False, engines=None):
+    """转录一段已解码的音频：语言识别、引擎选择、转录（长文件分块并行）和级联升级
+    
+    engines: 可选的引擎缓存字典，流式解码时各窗口共用，避免每个窗口重新加载模型。
+    """
+    duration = len(audio) / SAMPLE_RATE
+    
+    # 语言：指定时直接使用；auto时抽样检测，混合语言的文件按区域分别处理
+    language = options.get('language', 'zh')
+    if language == 'auto':
+        current_status()['current_step'] = '语言识别'
+        regions = detect_file_languages(audio)
+        language = dominant_language(regions)
+    else:
+        regions = [{'start': 0.0, 'end': duration, 'language': language}]
+    options = dict(options, language_regions=regions)
+    
+    # auto引擎在任务开始时按当前基准测试结果解析为具体引擎
+    if options.get('engine') == 'auto':
+        options = dict(options, engine=route_engine(language, options.get('route_policy', 'accurate')))
+    
+    # 级联模式：第一遍用小模型，选择的模型作为最高升级级别
+    cascade = options.get('cascade') and options.get('engine', 'whisper') == 'whisper'
+    first_pass_model = options['cascade_start'] if cascade else model_name
+    
+    if long_file:
+        decode_start = time.time()
+        result = transcribe_long_audio(audio, first_pass_model, options)
+    else:
+        # 加载识别引擎
+        engine_key = (first_pass_model, options.get('engine', 'whisper'))
+        engine = (engines or {}).get(engine_key) or create_engine(first_pass_model, options)
+        if engines is not None:
+            engines[engine_key] = engine
+        policy = DecodePolicy(**options.get('decode_policy', {}))
+        
+        decode_start = time.time()
+        if len(regions) > 1 and isinstance(engine, WhisperEngine):
+            result = transcribe_language_regions(engine, audio, regions, policy)
+        else:
+            # 使用Whisper转录
+            result = engine.transcribe(
+                audio,
+                language=language,
+                task="transcribe",
+                policy=policy,
+                cache_features=True
+            )
+    
+    segments = result.get('segments', [])
+    cascade_stats = None
+    if cascade:
+        segments, cascade_stats = run_cascade(audio, segments, first_pass_model, model_name, options)
+        result['text'] = ''.join(seg['text'].strip() for seg in segments)
+        record_cascade_stats(duration, cascade_stats)
+    status = current_status()
+    if result.get('decode_stats'):
+        status['decode_stats'] = merge_decode_stats(status.get('decode_stats'), result['decode_stats'])
+    
+    # 词级时间戳（可选）：解码和级联都完成后，对最终片段批量对齐
+    alignment_stats = None
+    if options.get('word_timestamps') and options.get('engine', 'whisper') == 'whisper':
+        alignment_stats = align_segment_words(audio, segments, regions, first_pass_model, options, engines,
+                                              decode_seconds=time.time() - decode_start)
+        if alignment_stats:
+            status['word_alignment'] = merge_alignment_stats(status.get('word_alignment'), alignment_stats)
+    
+    result.update({
+        'segments': segments,
+        'language': language,
+        'language_regions': regions,
+        'engine': options.get('engine', 'whisper'),
+        'cascade': cascade_stats,
+        'word_alignment': alignment_stats
+    })
+    return result
+
+def merge_cascade_stats(total, stats):
+    """累加各窗口的级联统计（升级比例由调用方按总时长计算）"""
+    if total is None:
+        return {'start_model': stats['start_model'], 'levels': [dict(level) for level in stats['levels']],
+                'escalated_seconds': stats['escalated_seconds']}
+    levels = {level['model']: level for level in total['levels']}
+    for level in stats['levels']:
+        if level['model'] in levels:
+            levels[level['model']]['escalated_seconds'] = round(levels[level['model']]['escalated_seconds'] + level['escalated_seconds'], 2)
+            levels[level['model']]['time'] = round(levels[level['model']]['time'] + level['time'], 3)
+        else:
+            total['levels'].append(dict(level))
+    total['escalated_seconds'] = round(total['escalated_seconds'] + stats['escalated_seconds'], 2)
+    return total
+
+def transcribe_audio_stream(audio_file, model_name, options, duration):
+    """超长文件：边解码边按窗口转录，每个窗口独立做语言识别和级联，峰值内存与文件时长无关"""
+    chunk_results = []
+    regions = []
+    decode_stats = None
+    cascade_stats = None
+    alignment_stats = None
+    total_samples = 0
+    engines = {}
+    for start, window in iter_audio_windows(audio_file):
+        offset = start / SAMPLE_RATE
+        current_status()['current_step'] = f'流式解码转录 {offset / 60:.0f}/{duration / 60:.0f} 分钟'
+        result = transcribe_audio(window, model_name, options, engines=engines)
+        chunk_results.append({
+            'start': offset,
+            'end': offset + len(window) / SAMPLE_RATE,
+            'segments': [shift_segment(seg, offset) for seg in result['segments']]
+        })
+        for region in result['language_regions']:
+            if regions and regions[-1]['language'] == region['language']:
+                regions[-1]['end'] = round(offset + region['end'], 2)
+            else:
+                regions.append(dict(region, start=round(offset + region['start'], 2), end=round(offset + region['end'], 2)))
+        if result.get('decode_stats'):
+            decode_stats = merge_decode_stats(decode_stats, result['decode_stats'])
+        if result.get('cascade'):
+            cascade_stats = merge_cascade_stats(cascade_stats, result['cascade'])
+        if result.get('word_alignment'):
+            alignment_stats = merge_alignment_stats(alignment_stats, result['word_alignment'])
+        total_samples = max(total_samples, start + len(window))
+        del window, result
+    
+    duration = total_samples / SAMPLE_RATE
+    if cascade_stats:
+        cascade_stats['escalated_fraction'] = round(cascade_stats['escalated_seconds'] / duration, 4) if duration else 0.0
+    segments = stitch_chunk_segments(chunk_results)
+    return {
+        'text': ''.join(seg['text'].strip() for seg in segments),
+        'segments': segments,
+        'language': dominant_language(regions) if regions else options.get('language', 'zh'),
+        'language_regions': regions or [{'start': 0.0, 'end': duration, 'language': options.get('language', 'zh')}],
+        'chunks': len(chunk_results),
+        'duration': duration,
+        'engine': options.get('engine', 'whisper'),
+        'cascade': cascade_stats,
+        'decode_stats': decode_stats,
+        'word_alignment': alignment_stats
+    }
+
+_diarization_pipeline = None
+_diarization_lock = threading.Lock()
+
+def load_diarization_pipeline():
+    """加载pyannote说话人分离管线（首次调用时加载，之后常驻）"""
+    global _diarization_pipeline
+    with _diarization_lock:
+        if _diarization_pipeline is None:
+            token = os.getenv('HF_TOKEN')
+            if not token:
+                raise RuntimeError('说话人分离需要设置HF_TOKEN环境变量')
+            from pyannote.audio import Pipeline
+            _diarization_pipeline = Pipeline.from_pretrained(DIARIZATION_MODEL, use_auth_token=token)
+    return _diarization_pipeline
+
+def diarize_audio(audio):
+    """说话人分离，返回按时间排序的说话人轮次 [{'start', 'end', 'speaker'}]"""
+    import torch
+    pipeline = load_diarization_pipeline()
+    annotation = pipeline({'waveform': torch.from_numpy(audio).unsqueeze(0), 'sample_rate': SAMPLE_RATE})
+    return [{'start': turn.start, 'end': turn.end, 'speaker': speaker}
+            for turn, _, speaker in annotation.itertracks(yield_label=True)]
+
+class TurnIndex:
+    """说话人轮次的区间索引
+    
+    轮次按时长分桶（第k个桶收时长在 (MIN*2^(k-1), MIN*2^k] 内的轮次），桶内按开始时间排序。
+    桶内轮次都不长于该桶的最大时长D，与区间(start, end)重叠的轮次必然开始于 (start - D, end) 之内，
+    两次二分查找得到候选范围，所有区间一次searchsorted算完；桶内轮次时长至少为D/2，
+    候选中实际不重叠的只有少数。横跨整场会议的背景说话人只落在自己的桶里，
+    不会让其它查询的候选范围变大。
+    """
+    
+    def __init__(self, turns):
+        speaker_ids = {}
+        starts = np.array([turn['start'] for turn in turns], dtype=np.float64)
+        ends = np.array([turn['end'] for turn in turns], dtype=np.float64)
+        speakers = np.array([speaker_ids.setdefault(turn['speaker'], len(speaker_ids)) for turn in turns],
+                            dtype=np.int64)
+        self.speakers = list(speaker_ids)
+        durations = np.maximum(ends - starts, TURN_INDEX_MIN_SPAN)
+        classes = np.ceil(np.log2(durations / TURN_INDEX_MIN_SPAN)).astype(np.int64)
+        self.buckets = []  # [(桶内最大时长, 开始时间, 结束时间, 说话人编号)]，各列按开始时间排序
+        for bucket in np.unique(classes):
+            members = np.flatnonzero(classes == bucket)
+            order = members[np.argsort(starts[members], kind='stable')]
+            span = float(np.maximum(ends[order] - starts[order], 0.0).max())
+            self.buckets.append((span, starts[order], ends[order], speakers[order]))
+    
+    def __len__(self):
+        return sum(len(bucket_starts) for _, bucket_starts, _, _ in self.buckets)
+    
+    def overlaps(self, starts, ends):
+        """各区间与每个说话人的重叠时长之和，返回 (区间数, 说话人数) 矩阵"""
+        starts = np.asarray(starts, dtype=np.float64)
+        ends = np.asarray(ends, dtype=np.float64)
+        n_speakers = len(self.speakers)
+        totals = np.zeros(len(starts) * n_speakers)
+        for span, turn_starts, turn_ends, turn_speakers in self.buckets:
+            lo = np.searchsorted(turn_starts, starts - span, side='right')
+            hi = np.searchsorted(turn_starts, ends, side='left')
+            counts = np.maximum(hi - lo, 0)
+            # 展开成 (区间, 候选轮次) 对：第k个区间的候选为 lo[k], lo[k]+1, ..., hi[k]-1
+            interval = np.repeat(np.arange(len(starts)), counts)
+            turn = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(lo, counts)
+            overlap = np.minimum(turn_ends[turn], ends[interval]) - np.maximum(turn_starts[turn], starts[interval])
+            totals += np.bincount(interval * n_speakers + turn_speakers[turn], weights=np.maximum(overlap, 0.0),
+                                  minlength=len(starts) * n_speakers)
+        return totals.reshape(len(starts), n_speakers)
+    
+    def assign(self, starts, ends):
+        """各区间重叠时长最多的说话人，不与任何轮次重叠时为None"""
+        if not self.speakers:
+            return [None] * len(starts)
+        overlaps = self.overlaps(starts, ends)
+        best = overlaps.argmax(axis=1)
+        found = overlaps[np.arange(len(best)), best] > 0
+        return [self.speakers[speaker] if hit else None for speaker, hit in zip(best.tolist(), found.tolist())]
+
+def assign_speakers(segments, turns):
+    """按时间重叠给片段和词分配说话人，返回新的片段列表
+    
+    片段取重叠时长最多的说话人；带词级时间戳的片段逐词分配，在说话人变化处切开。
+    不与任何轮次重叠的词（停顿、呼吸）沿用前一个词的说话人，避免切出碎片。
+    turns可以是轮次列表或已建好的TurnIndex。
+    """
+    index = turns if isinstance(turns, TurnIndex) else TurnIndex(turns)
+    segment_speakers = index.assign([segment['start'] for segment in segments], [segment['end'] for segment in segments])
+    words = [word for segment in segments for word in segment.get('words', ())]
+    word_speakers = iter(index.assign([word['start'] for word in words], [word['end'] for word in words]))
+    
+    output = []
+    for segment, speaker in zip(segments, segment_speakers):
+        if not segment.get('words'):
+            output.append(dict(segment, speaker=speaker))
+            continue
+        
+        runs = []
+        current = speaker
+        for word in segment['words']:
+            current = next(word_speakers) or current
+            if runs and runs[-1][0] == current:
+                runs[-1][1].append(dict(word, speaker=current))
+            else:
+                runs.append((current, [dict(word, speaker=current)]))
+        if len(runs) == 1:
+            output.append(dict(segment, speaker=runs[0][0], words=runs[0][1]))
+            continue
+        for k, (run_speaker, run_words) in enumerate(runs):
+            output.append(dict(
+                segment,
+                speaker=run_speaker,
+                start=segment['start'] if k == 0 else run_words[0]['start'],
+                end=segment['end'] if k == len(runs) - 1 else run_words[-1]['end'],
+                text=''.join(word['word'] for word in run_words).strip(),
+                words=run_words
+            ))
+    return output
+
+CJK_RUN = re.compile(r'[\u3400-\u9fff\uf900-\ufaff]+|[^\W_\u3400-\u9fff\uf900-\ufaff]+')
+
+def is_cjk(text):
+    return '\u3400' <= text[0] <= '\u9fff' or '\uf900' <= text[0] <= '\ufaff'
+
+def search_terms(text):
+    """把文本切成检索词元，返回 (单字列, 二字组列) 两个以空格分隔的词元串
+    
+    中文没有空格分词，连续的中文按单字和相邻二字组分别建索引；其它文字按单词（小写）。
+    查询单个汉字时用单字列，两个及以上汉字时用二字组列的短语查询，相当于子串匹配。
+    """
+    chars, bigrams = [], []
+    for run in CJK_RUN.findall(text.lower()):
+        if is_cjk(run):
+            chars.extend(run)
+            bigrams.extend([run[i:i + 2] for i in range(len(run) - 1)] if len(run) > 1 else [run])
+        else:
+            chars.append(run)
+            bigrams.append(run)
+    return ' '.join(chars), ' '.join(bigrams)
+
+def build_match_query(query):
+    """把用户输入转成FTS5查询：空格分隔的每个部分是一个短语，各部分之间是AND；没有可检索内容时返回None"""
+    phrases = []
+    for part in query.split():
+        runs = CJK_RUN.findall(part.lower())
+        if not runs:
+            continue
+        chars, bigrams = search_terms(part)
+        if any(is_cjk(run) and len(run) > 1 for run in runs):
+            phrases.append(f'bigrams : "{bigrams}"')
+        else:
+            phrases.append(f'chars : "{chars}"')
+    return ' AND '.join(phrases) or None
+
+_transcript_schema_lock = threading.Lock()
+_transcript_schema_ready = False
+
+@contextmanager
+def transcript_store():
+    """打开转录库（首次打开时建表），退出时提交并关闭；每次调用独立连接，可在任意线程使用"""
+    global _transcript_schema_ready
+    os.makedirs(os.path.dirname(TRANSCRIPT_DB), exist_ok=True)
+    conn = sqlite3.connect(TRANSCRIPT_DB, timeout=30)
+    try:
+        with _transcript_schema_lock:
+            if not _transcript_schema_ready:
+                # WAL模式下检索不会被批处理写入阻塞
+                conn.execute('PRAGMA journal_mode=WAL')
+                conn.executescript("""
+                    CREATE TABLE IF NOT EXISTS transcripts (
+                        id INTEGER PRIMARY KEY, file TEXT UNIQUE, file_name TEXT, model TEXT,
+                        language TEXT, duration REAL, created REAL);
+                    CREATE TABLE IF NOT EXISTS segments (
+                        id INTEGER PRIMARY KEY, transcript_id INTEGER, start_ms INTEGER, end_ms INTEGER,
+                        speaker TEXT, text TEXT);
+                    CREATE INDEX IF NOT EXISTS segments_transcript ON segments(transcript_id);
+                    CREATE VIRTUAL TABLE IF NOT EXISTS segment_index
+                        USING fts5(chars, bigrams, content='', tokenize='unicode61');
+                """)
+                _transcript_schema_ready = True
+        yield conn
+        conn.commit()
+    finally:
+        conn.close()
+
+def delete_transcript(conn, transcript_id):
+    """删除一个转录及其片段；无内容的FTS5表需要用原词元执行delete命令"""
+    rows = conn.execute('SELECT id, text FROM segments WHERE transcript_id = ?', (transcript_id,)).fetchall()
+    conn.executemany("INSERT INTO segment_index(segment_index, rowid, chars, bigrams) VALUES('delete', ?, ?, ?)",
+                     [(segment_id, *search_terms(text)) for segment_id, text in rows])
+    conn.execute('DELETE FROM segments WHERE transcript_id = ?', (transcript_id,))
+    conn.execute('DELETE FROM transcripts WHERE id = ?', (transcript_id,))
+
+def save_transcript(result, model_name):
+    """把一个已完成的文件结果写入转录库并建立索引，同一文件重新处理时替换旧结果"""
+    with transcript_store() as conn:
+        previous = conn.execute('SELECT id FROM transcripts WHERE file = ?', (result['file'],)).fetchone()
+        if previous:
+            delete_transcript(conn, previous[0])
+        transcript_id = conn.execute(
+            'INSERT INTO transcripts (file, file_name, model, language, duration, created) VALUES (?, ?, ?, ?, ?, ?)',
+            (result['file'], result['file_name'], model_name, result['language'], result['duration'], time.time())
+        ).lastrowid
+        for segment in result['segments']:
+            segment_id = conn.execute(
+                'INSERT INTO segments (transcript_id, start_ms, end_ms, speaker, text) VALUES (?, ?, ?, ?, ?)',
+                (transcript_id, int(round(segment['start'] * 1000)), int(round(segment['end'] * 1000)),
+                 segment['speaker'], segment['text'])
+            ).lastrowid
+            conn.execute('INSERT INTO segment_index (rowid, chars, bigrams) VALUES (?, ?, ?)',
+                         (segment_id, *search_terms(segment['text'])))
+    return transcript_id
+
+def search_transcripts(query, limit=SEARCH_DEFAULT_LIMIT, offset=0):
+    """全文检索片段，按相关度排序，返回 (匹配总数, 当前页片段列表)"""
+    match = build_match_query(query)
+    if match is None:
+        return 0, []
+    with transcript_store() as conn:
+        total = conn.execute('SELECT count(*) FROM segment_index WHERE segment_index MATCH ?', (match,)).fetchone()[0]
+        rows = conn.execute("""
+            SELECT t.file, t.file_name, s.start_ms, s.end_ms, s.speaker, s.text
+            FROM segment_index
+            JOIN segments s ON s.id = segment_index.rowid
+            JOIN transcripts t ON t.id = s.transcript_id
+            WHERE segment_index MATCH ?
+            ORDER BY rank, s.id
+            LIMIT ? OFFSET ?
+        """, (match, limit, offset)).fetchall()
+    return total, [{'file': file, 'file_name': file_name, 'start_ms': start_ms, 'end_ms': end_ms,
+                    'speaker': speaker, 'text': text}
+                   for file, file_name, start_ms, end_ms, speaker, text in rows]
+
+class SegmentColumns:
+    """列式片段存储
+    
+    start/end为float32数组，说话人去重后存整数编号，所有文本拼接成一块UTF-8字节堆，按偏移切片。
+    save后用np.load(mmap_mode='r')读回，各列直接映射文件，不占用Python对象内存。
+    词级时间戳同样按列存储在words中，第i个片段的词为 words[word_offsets[i]:word_offsets[i + 1]]。
+    """
+    
+    COLUMNS = ('start', 'end', 'speaker', 'offsets', 'heap')
+    
+    def __init__(self, start, end, speaker, offsets, heap, speakers, words=None, word_offsets=None):
+        self.start = start
+        self.end = end
+        self.speaker = speaker
+        self.offsets = offsets
+        self.heap = heap
+        self.speakers = speakers
+        self.words = words
+        self.word_offsets = word_offsets
+    
+    @classmethod
+    def from_segments(cls, segments):
+        """从 [{'speaker', 'start', 'end', 'text', 'words'(可选)}] 构建"""
+        n = len(segments)
+        speaker_ids = {}
+        encoded = [segment['text'].encode('utf-8') for segment in segments]
+        offsets = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum([len(text) for text in encoded], out=offsets[1:])
+        columns = cls(
+            np.fromiter((segment['start'] for segment in segments), dtype=np.float32, count=n),
+            np.fromiter((segment['end'] for segment in segments), dtype=np.float32, count=n),
+            np.fromiter((speaker_ids.setdefault(segment['speaker'], len(speaker_ids)) for segment in segments),
+                        dtype=np.uint16, count=n),
+            offsets,
+            np.frombuffer(b''.join(encoded), dtype=np.uint8),
+            list(speaker_ids)
+        )
+        if any('words' in segment for segment in segments):
+            columns.word_offsets = np.zeros(n + 1, dtype=np.int64)
+            np.cumsum([len(segment.get('words', ())) for segment in segments], out=columns.word_offsets[1:])
+            columns.words = cls.from_segments([
+                {'speaker': segment['speaker'], 'start': word['start'], 'end': word['end'], 'text': word['word']}
+                for segment in segments for word in segment.get('words', ())
+            ])
+        return columns
+    
+    def __len__(self):
+        return len(self.start)
+    
+    @property
+    def nbytes(self):
+        nbytes = sum(getattr(self, column).nbytes for column in self.COLUMNS)
+        if self.words is not None:
+            nbytes += self.words.nbytes + self.word_offsets.nbytes
+        return nbytes
+    
+    def text(self, index):
+        return self.heap[self.offsets[index]:self.offsets[index + 1]].tobytes().decode('utf-8')
+    
+    def __getitem__(self, index):
+        segment = {
+            'speaker': self.speakers[self.speaker[index]],
+            'start': round(float(self.start[index]), 3),
+            'end': round(float(self.end[index]), 3),
+            'text': self.text(index)
+        }
+        if self.words is not None:
+            segment['words'] = [{
+                'word': self.words.text(word),
+                'start': round(float(self.words.start[word]), 3),
+                'end': round(float(self.words.end[word]), 3)
+            } for word in range(self.word_offsets[index], self.word_offsets[index + 1])]
+        return segment
+    
+    def __iter__(self):
+        return (self[index] for index in range(len(self)))
+    
+    def to_segments(self, start=0, stop=None):
+        """展开成字典列表（JSON输出用），可只取一段"""
+        return [self[index] for index in range(*slice(start, stop).indices(len(self)))]
+    
+    def write(self, folder):
+        """把各列写入新目录，词级时间戳写入words子目录"""
+        os.makedirs(folder)
+        for column in self.COLUMNS:
+            np.save(os.path.join(folder, f'{column}.npy'), getattr(self, column))
+        with open(os.path.join(folder, 'speakers.json'), 'w', encoding='utf-8') as f:
+            json.dump(self.speakers, f, ensure_ascii=False)
+        if self.words is not None:
+            np.save(os.path.join(folder, 'word_offsets.npy'), self.word_offsets)
+            self.words.write(os.path.join(folder, 'words'))
+    
+    def save(self, folder):
+        """写入目录（先写临时目录再改名），返回内存映射读回的实例"""
+        temp_folder = f'{folder}.{uuid.uuid4().hex}.tmp'
+        self.write(temp_folder)
+        os.replace(temp_folder, folder)
+        return SegmentColumns.load(folder)
+    
+    @classmethod
+    def load(cls, folder):
+        with open(os.path.join(folder, 'speakers.json'), 'r', encoding='utf-8') as f:
+            speakers = json.load(f)
+        columns = [np.load(os.path.join(folder, f'{column}.npy'), mmap_mode='r') for column in cls.COLUMNS]
+        segments = cls(*columns, speakers)
+        if os.path.isdir(os.path.join(folder, 'words')):
+            segments.words = cls.load(os.path.join(folder, 'words'))
+            segments.word_offsets = np.load(os.path.join(folder, 'word_offsets.npy'), mmap_mode='r')
+        return segments
+
+def persist_segments(result):
+    """把结果中的片段写成列式文件，结果改为引用内存映射的列"""
+    if isinstance(result.get('segments'), SegmentColumns):
+        folder = os.path.join(SEGMENT_FOLDER, uuid.uuid4().hex)
+        os.makedirs(SEGMENT_FOLDER, exist_ok=True)
+        result['segments'] = result['segments'].save(folder)
+        result['segments_path'] = folder
+    return result
+
+def discard_segments(results):
+    """删除一批结果的列式片段文件（已映射的数组在Linux/macOS上仍可读到释放为止）"""
+    for result in results:
+        if result.get('segments_path'):
+            shutil.rmtree(result['segments_path'], ignore_errors=True)
+
+def result_to_json(result):
+    """JSON输出时把列式片段展开成transcriptions列表"""
+    if not isinstance(result.get('segments'), SegmentColumns):
+        return result
+    data = {key: value for key, value in result.items() if key not in ('segments', 'segments_path')}
+    data['transcriptions'] = result['segments'].to_segments()
+    return data
+
+jobs = OrderedDict()  # job_id -> 任务，最早的在前
+_jobs_lock = threading.Lock()
+
+def new_job(model_name, total_files):
+    """一次批处理任务"""
+    return {'id': uuid.uuid4().hex[:12], 'model': model_name, 'created': time.time(),
+            'total_files': total_files, 'results': [], 'finished': False}
+
+def register_job(model_name, total_files):
+    """登记一次批处理任务；超出保留数量时丢弃最早任务的结果和列式片段文件"""
+    job = new_job(model_name, total_files)
+    with _jobs_lock:
+        jobs[job['id']] = job
+        while len(jobs) > JOB_HISTORY:
+            _, expired = jobs.popitem(last=False)
+            discard_segments(expired['results'])
+    return job
+
+def project_result(result, fields=None, max_segments=None):
+    """按字段投影结果：fields中的summary表示除片段外的全部字段；只有请求transcriptions时才展开片段"""
+    segments = result.get('segments')
+    fields = fields or ['summary', 'transcriptions']
+    summary = 'summary' in fields
+    data = {key: value for key, value in result.items()
+            if key not in ('segments', 'segments_path') and (summary or key in fields)}
+    if 'transcriptions' in fields and isinstance(segments, SegmentColumns):
+        data['transcriptions'] = segments.to_segments(0, max_segments)
+    return data
+
+def new_file_job(index, audio_file, model_name, options, cancelled=None, status=None, held=None):
+    """流水线中单个文件的任务状态，各阶段依次补充字段
+    
+    cancelled: 可选的回调，返回真时放弃等待内存准入（批处理被停止）；不传则一直等到准入。
+    status: 进度和统计写入的状态对象，默认为创建任务时线程的当前状态。
+    held: 所属批次已经预留的内存（模型），默认为创建任务时线程hold()的部分。
+    """
+    return {'index': index, 'file': audio_file, 'model': model_name, 'options': options or {},
+            'error': None, 'reserved': 0, 'admission_wait': 0.0, 'result': None, 'cancelled': cancelled,
+            'status': current_status() if status is None else status,
+            'held': admission.held() if held is None else held}
+
+def guarded_stage(func):
+    """跳过已出错的任务，并把异常记录到任务上，由后处理阶段生成失败结果
+    
+    各阶段运行在流水线的工作线程里，进度写入任务所属的状态对象。
+    """
+    def run(job, *args):
+        if job['error'] is None:
+            try:
+                with status_scope(job['status']):
+                    func(job, *args)
+            except Exception as e:
+                job['error'] = str(e)
+        return job
+    return run
+
+@guarded_stage
+def stage_decode(job):
+    """解码阶段：等待预处理、内存准入并解码音频（流式解码的文件留给推理阶段边读边转）"""
+    audio_file, model_name, options = job['file'], job['model'], job['options']
+    wait_for_ingest(audio_file)
+    job['probed_duration'] = probe_duration(audio_file)
+    job['strategy'] = long_file_strategy(job['probed_duration'], options.get('long_file_mode', 'auto'))
+    if options.get('diarize') and job['strategy'] == 'stream':
+        # 说话人分离需要整段音频，超长文件改为整段解码、分块并行转录
+        job['strategy'] = 'parallel'
+    
+    # 内存准入：模型由整个批次预留，这里只预留该文件额外需要的部分
+    estimate = max(0, estimate_job_memory(model_name, job['probed_duration'], options)
+                   - estimate_job_memory(model_name, 0, options))
+    
+    status = current_status()
+    
+    def on_wait(waited):
+        status['admission'] = dict(admission.status(), state='waiting', estimate_gb=round(estimate / GB, 2),
+                                   wait_seconds=round(waited, 1))
+        status['current_step'] = (f'等待内存: {os.path.basename(audio_file)} 需要约 {estimate / GB:.1f}GB，'
+                                  f'当前可用 {status["admission"]["available_gb"]}GB（已等待 {waited:.0f}秒）')
+    
+    waited = admission.acquire(estimate, on_wait, cancelled=job['cancelled'], held=job['held'])
+    if waited is None:
+        raise RuntimeError('任务已取消')
+    job['reserved'] = estimate
+    job['admission_wait'] = round(waited, 1)
+    status['admission'] = dict(admission.status(), state='admitted', estimate_gb=round(estimate / GB, 2),
+                               wait_seconds=round(waited, 1))
+    
+    if job['strategy'] != 'stream':
+        job['audio'] = load_audio_cached(audio_file)
+
+@guarded_stage
+def stage_features(job):
+    """特征阶段：为整段转录的文件预先算好log-mel写入特征缓存，推理阶段直接命中"""
+    options = job['options']
+    if job['strategy'] != 'single' or not needs_whisper_features(options):
+        return
+    first_pass_model = options['cascade_start'] if options.get('cascade') else job['model']
+    with mel_cache_scope(True):
+        cached_log_mel_spectrogram(job['audio'], WHISPER_N_MELS.get(first_pass_model, 80),
+                                   padding=whisper.audio.N_SAMPLES)
+
+@guarded_stage
+def stage_inference(job, engines=None):
+    """推理阶段：语言识别、转录和级联升级"""
+    audio_file, model_name, options = job['file'], job['model'], job['options']
+    current_status()['current_file'] = os.path.basename(audio_file)
+    if job['strategy'] == 'stream':
+        job['transcription'] = transcribe_audio_stream(audio_file, model_name, options, job['probed_duration'])
+        job['duration'] = job['transcription']['duration']
+    else:
+        job['transcription'] = transcribe_audio(job['audio'], model_name, options,
+                                                long_file=(job['strategy'] == 'parallel'), engines=engines)
+        job['duration'] = len(job['audio']) / SAMPLE_RATE
+    if options.get('diarize'):
+        current_status()['current_step'] = f'说话人分离: {os.path.basename(audio_file)}'
+        job['speaker_turns'] = diarize_audio(job['audio'])
+    # 推理完成后音频不再需要，尽早释放
+    job.pop('audio', None)
+
+def stage_postprocess(job):
+    """后处理阶段：格式化结果（失败的任务生成失败结果），并释放内存预留"""
+    audio_file, options = job['file'], job['options']
+    try:
+        if job['error'] is not None:
+            job['result'] = {
+                'file': audio_file,
+                'file_name': os.path.basename(audio_file),
+                'status': 'failed',
+                'error': job['error']
+            }
+            return job
+        
+        result = job['transcription']
+        segments = result['segments']
+        regions = result['language_regions']
+        
+        # 格式化输出：开启说话人分离时按时间重叠分配（pyannote标签按出场顺序编号），否则模拟说话人识别
+        turns = job.pop('speaker_turns', None)
+        if turns is not None:
+            segments = assign_speakers(segments, turns)
+            labels = {}
         formatted_segments = []
         
         for i, segment in enumerate(segments):
-            # 简单的说话人分配（实际项目中可以用pyannote.audio）
-            speaker = f"说话人{i % 2 + 1}"  # 交替分配说话人
-            formatted_segments.append({
+            if turns is not None:
+                speaker = (f"说话人{labels.setdefault(segment['speaker'], len(labels) + 1)}"
+                           if segment['speaker'] is not None else '未知说话人')
+            else:
+                speaker = f"说话人{i % 2 + 1}"  # 交替分配说话人
+            formatted = {
                 'speaker': speaker,
                 'start': segment.get('start', 0),
                 'end': segment.get('end', 0),
                 'text': segment.get('text', '').strip()
-            })
+            }
+            if 'words' in segment:
+                formatted['words'] = segment['words']
+            formatted_segments.append(formatted)
         
-        return {
+        job['result'] = {
             'file': audio_file,
             'file_name': os.path.basename(audio_file),
             'status': 'completed',
             'text': result['text'].strip(),
-            'language': result.get('language', 'zh'),
+            'language': result['language'],
+            'language_regions': regions if len(regions) > 1 else None,
             'total_speakers': len(set(seg['speaker'] for seg in formatted_segments)),
             'total_segments': len(formatted_segments),
-            'transcriptions': formatted_segments
+            'duration': round(job['duration'], 2),
+            'long_file_chunks': result.get('chunks', 0),
+            'precision': options.get('precision', 'fp32'),
+            'engine': result['engine'],
+            'backend': options.get('backend', 'pytorch'),
+            'cascade': result['cascade'],
+            'decode_stats': result.get('decode_stats'),
+            'word_alignment': result.get('word_alignment'),
+            'admission_wait': job['admission_wait'],
+            'diarized': turns is not None,
+            'segments': SegmentColumns.from_segments(formatted_segments)
         }
+        job.pop('transcription', None)
+        return job
+    finally:
+        if job['reserved']:
+            admission.release(job['reserved'])
+            job['reserved'] = 0
+
+def process_single_file(audio_file, model_name='base', options=None, cancelled=None):
+    """处理单个音频文件（依次执行流水线的各个阶段）"""
+    job = new_file_job(0, audio_file, model_name, options, cancelled)
+    for stage in (stage_decode, stage_features, stage_inference, stage_postprocess):
+        stage(job)
+    return job['result']
+
+_PIPELINE_DONE = object()
+
+class StagePipeline:
+    """多级流水线：相邻两级之间是有界队列，每级按配置开若干线程
+    
+    统计每级的忙碌时间、等待输入(idle)和等待下游(blocked)的时间，利用率最高的一级就是瓶颈。
+    """
+    
+    def __init__(self, stages, queue_size=PIPELINE_QUEUE_SIZE):
+        self.stages = stages  # [(名称, 处理函数, 线程数), ...]
+        self.queue_size = queue_size
+        self.stats = {name: {'workers': workers, 'items': 0, 'busy': 0.0, 'idle': 0.0, 'blocked': 0.0}
+                      for name, _, workers in stages}
+        self.start_time = time.time()
+        self._lock = threading.Lock()
+    
+    def metrics(self):
+        elapsed = max(time.time() - self.start_time, 1e-6)
+        with self._lock:
+            stages = {name: dict({key: round(value, 3) if isinstance(value, float) else value for key, value in stats.items()},
+                                 utilization=round(stats['busy'] / (stats['workers'] * elapsed), 3))
+                      for name, stats in self.stats.items()}
+        return {'stages': stages, 'bottleneck': max(stages, key=lambda name: stages[name]['utilization']),
+                'elapsed': round(elapsed, 2)}
+    
+    def _worker(self, index, queues, remaining):
+        name, func, _ = self.stages[index]
+        inbox = queues[index]
+        outbox = queues[index + 1] if index + 1 < len(self.stages) else None
+        while True:
+            waiting = time.time()
+            item = inbox.get()
+            started = time.time()
+            if item is _PIPELINE_DONE:
+                break
+            try:
+                item = func(item)
+            except Exception as e:
+                print(f"❌ 流水线阶段 {name} 出错: {e}")
+                item = None
+            finished = time.time()
+            if outbox is not None and item is not None:
+                outbox.put(item)
+            with self._lock:
+                stats = self.stats[name]
+                stats['items'] += 1
+                stats['idle'] += started - waiting
+                stats['busy'] += finished - started
+                stats['blocked'] += time.time() - finished
         
-    except Exception as e:
-        return {
-            'file': audio_file,
-            'file_name': os.path.basename(audio_file),
-            'status': 'failed',
-            'error': str(e)
-        }
+        # 本级最后一个线程退出时通知下一级的所有线程
+        with self._lock:
+            remaining[index] -= 1
+            last = remaining[index] == 0
+        if last and outbox is not None:
+            for _ in range(self.stages[index + 1][2]):
+                outbox.put(_PIPELINE_DONE)
+    
+    def run(self, items, should_stop=None):
+        """把items依次送入第一级，直到所有任务流出最后一级"""
+        self.start_time = time.time()
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+        remaining = [workers for _, _, workers in self.stages]
+        threads = []
+        for index, (name, _, workers) in enumerate(self.stages):
+            for n in range(workers):
+                thread = threading.Thread(target=self._worker, args=(index, queues, remaining),
+                                          name=f'pipeline-{name}-{n}', daemon=True)
+                thread.start()
+                threads.append(thread)
+        
+        for item in items:
+            if should_stop and should_stop():
+                break
+            queues[0].put(item)
+        for _ in range(self.stages[0][2]):
+            queues[0].put(_PIPELINE_DONE)
+        for thread in threads:
+            thread.join()
 
-def process_batch_files(file_list, model_name='base'):
-    """批量处理文件"""
-    global batch_status
+def record_cascade_stats(duration, cascade_stats):
+    """把单个文件的级联统计累加到批处理状态"""
+    status = current_status()
+    totals = status.get('cascade') or {'audio_seconds': 0.0, 'escalated_seconds': 0.0}
+    totals['audio_seconds'] = round(totals['audio_seconds'] + duration, 2)
+    totals['escalated_seconds'] = round(totals['escalated_seconds'] + cascade_stats['escalated_seconds'], 2)
+    totals['escalated_fraction'] = round(totals['escalated_seconds'] / totals['audio_seconds'], 4) if totals['audio_seconds'] else 0.0
+    status['cascade'] = totals
+
+def process_batch_files(file_list, model_name='base', options=None, status=None, persist=True, reserve_model=True):
+    """批量处理文件
     
-    batch_status['running'] = True
-    batch_status['total_files'] = len(file_list)
-    batch_status['processed_files'] = 0
-    batch_status['results'] = []
-    batch_status['error'] = None
+    status: 进度和结果写入的状态对象，默认为当前状态（Web批处理即全局batch_status）。
+    persist: 为假时不登记任务、结果留在内存里、不写入转录库（基准测试用）。
+    reserve_model: 为假时不再为模型预留内存，由调用方通过admission.hold()负责（如 /api/benchmark）。
+    """
+    status = current_status() if status is None else status
+    status['running'] = True
+    status['total_files'] = len(file_list)
+    status['processed_files'] = 0
+    # 结果列表只追加不重排，分页游标即列表下标
+    job = register_job(model_name, len(file_list)) if persist else new_job(model_name, len(file_list))
+    status['job_id'] = job['id']
+    status['results'] = job['results']
+    status['error'] = None
+    status['cascade'] = None
+    status['decode_stats'] = None
+    status['word_alignment'] = None
+    status['admission'] = None
+    status['admission_wait'] = 0.0
+    status['pipeline'] = None
+    options = options or {}
     
     try:
-        for i, file_path in enumerate(file_list):
-            if not batch_status['running']:
-                break
-                
-            batch_status['current_file'] = os.path.basename(file_path)
-            batch_status['current_progress'] = (i / len(file_list)) * 100
-            batch_status['current_step'] = f'处理文件 {i+1}/{len(file_list)} - 使用模型: {model_name}'
-            
-            print(f"处理文件: {file_path} (模型: {model_name})")
-            result = process_single_file(file_path, model_name)
-            batch_status['results'].append(result)
-            batch_status['processed_files'] += 1
-            
-        batch_status['current_step'] = '处理完成'
-        batch_status['current_progress'] = 100
+        # 模型在整个批次期间常驻推理线程，先按一次模型加载预留内存；
+        # 文件准入时把批次（及调用方）持有的这部分当作自己的，预算小于模型时逐个文件单独运行
+        model_reservation = estimate_job_memory(model_name, 0, options) if reserve_model else 0
+        if model_reservation:
+            admission.acquire(model_reservation)
+        held = admission.held() + model_reservation
+        
+        # 每个推理线程各自持有引擎：Whisper解码时会在模型上挂KV缓存钩子，不能跨线程共享同一个模型
+        inference_state = threading.local()
+        
+        def inference(job):
+            if not hasattr(inference_state, 'engines'):
+                inference_state.engines = {}
+            return stage_inference(job, inference_state.engines)
+        
+        def store(job):
+            job['result']['index'] = job['index']
+            status['results'].append(persist_segments(job['result']) if persist else job['result'])
+            status['processed_files'] += 1
+            status['current_progress'] = status['processed_files'] / len(file_list) * 100
+            status['current_step'] = f'已完成 {status["processed_files"]}/{len(file_list)} - 使用模型: {model_name}'
+            status['admission_wait'] = round(status['admission_wait'] + job['admission_wait'], 1)
+            status['pipeline'] = pipeline.metrics()
+            if persist and job['result']['status'] == 'completed':
+                try:
+                    save_transcript(job['result'], model_name)
+                except sqlite3.Error as e:
+                    # 索引失败不影响本次批处理结果
+                    print(f"⚠️ 写入转录库失败: {e}")
+            print(f"完成文件: {job['file']} ({job['result']['status']})")
+        
+        workers = dict(PIPELINE_DEFAULT_WORKERS, **options.get('pipeline_workers', {}))
+        pipeline = StagePipeline([
+            ('decode', stage_decode, workers['decode']),
+            ('features', stage_features, workers['features']),
+            ('inference', inference, workers['inference']),
+            ('postprocess', stage_postprocess, workers['postprocess']),
+            ('store', store, workers['store'])
+        ])
+        
+        def stopped():
+            return not status['running']
+        
+        status['current_step'] = f'处理中 - 使用模型: {model_name}'
+        try:
+            pipeline.run((new_file_job(i, path, model_name, options, stopped, status, held)
+                          for i, path in enumerate(file_list)),
+                         should_stop=stopped)
+        finally:
+            admission.release(model_reservation)
+        
+        status['pipeline'] = pipeline.metrics()
+        print(f"流水线瓶颈: {status['pipeline']['bottleneck']}")
+        
+        status['current_step'] = '处理完成'
+        status['current_progress'] = 100
         
     except Exception as e:
-        batch_status['error'] = str(e)
+        status['error'] = str(e)
         print(f"批量处理错误: {e}")
     
     finally:
-        batch_status['running'] = False
+        job['finished'] = True
+        status['running'] = False
+
+def available_encodings():
+    """服务端支持的压缩编码，按优先级排列"""
+    try:
+        import brotli  # noqa: F401
+        return ['br', 'gzip']
+    except ImportError:
+        return ['gzip']
+
+def compress_body(body, encoding):
+    if encoding == 'br':
+        import brotli
+        return brotli.compress(body, quality=5)
+    return gzip.compress(body, compresslevel=6)
+
+def negotiate_encoding():
+    """按请求的Accept-Encoding（含q值）选择压缩编码，客户端不接受压缩时返回None"""
+    return request.accept_encodings.best_match(available_encodings())
+
+def build_static_assets(html):
+    """把页面中的内联样式和脚本拆成按内容哈希命名的静态资源，返回 (页面, 资源表)
+    
+    资源内容不变时URL不变，浏览器可以长期缓存；各编码的压缩结果在启动时一次算好。
+    """
+    assets = {}
+    for tag, extension, mimetype, reference in (
+        ('style', 'css', 'text/css', '<link rel="stylesheet" href="/assets/{}">'),
+        ('script', 'js', 'application/javascript', '<script src="/assets/{}"></script>')
+    ):
+        start = html.index(f'<{tag}>')
+        end = html.index(f'</{tag}>') + len(f'</{tag}>')
+        body = html[start + len(f'<{tag}>'):end - len(f'</{tag}>')].encode('utf-8')
+        name = f'app.{hashlib.sha1(body).hexdigest()[:12]}.{extension}'
+        assets[name] = {
+            'body': body,
+            'mimetype': mimetype,
+            'encoded': {encoding: compress_body(body, encoding) for encoding in available_encodings()}
+        }
+        html = html[:start] + reference.format(name) + html[end:]
+    return html, assets
+
+@app.after_request
+def compress_and_cache(response):
+    """文本响应加ETag并处理If-None-Match（返回304）；超过阈值时按客户端支持的编码压缩"""
+    if (request.method != 'GET' or response.status_code != 200 or response.mimetype not in COMPRESSIBLE_TYPES
+            or 'Content-Encoding' in response.headers):
+        return response
+    # send_file生成的内存文件默认直接透传，这里需要读出内容
+    response.direct_passthrough = False
+    if not response.get_etag()[0]:
+        # 内容压缩与否都是同一个资源，用弱ETag
+        response.add_etag(weak=True)
+    response.make_conditional(request)
+    if response.status_code == 304:
+        return response
+    
+    body = response.get_data()
+    response.vary.add('Accept-Encoding')
+    encoding = negotiate_encoding()
+    if len(body) >= COMPRESS_MIN_BYTES and encoding:
+        response.set_data(compress_body(body, encoding))
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+@app.route('/assets/<name>')
+def static_asset(name):
+    """带内容哈希的静态资源，使用预先压缩好的内容"""
+    asset = STATIC_ASSETS.get(name)
+    if asset is None:
+        return jsonify({'error': f'资源不存在: {name}'}), 404
+    encoding = negotiate_encoding()
+    response = app.response_class(asset['encoded'].get(encoding, asset['body']), mimetype=asset['mimetype'])
+    if encoding in asset['encoded']:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.max_age = ASSET_MAX_AGE
+    response.cache_control.immutable = True
+    return response
 
 @app.route('/')
 def index():
-    """主页"""
-    return """
+    """主页：页面本身每次按ETag协商（通常返回304），样式和脚本由 /assets/ 长期缓存"""
+    response = app.response_class(INDEX_PAGE, mimetype='text/html')
+    response.cache_control.no_cache = True
+    return response
+
+INDEX_HTML = """
     <!DOCTYPE html>
     <html lang="zh-CN">
     <head>
@@ -734,6 +3546,77 @@ def index():
                             <option value="large">Large (最高质量, 1550M)</option>
                         </select>
                     </div>
+                    <div class="form-group">
+                        <label for="languageSelect">语言:</label>
+                        <select id="languageSelect">
+                            <option value="zh" selected>中文</option>
+                            <option value="auto">自动检测 (支持中英混合等多语言文件)</option>
+                            <option value="en">英文</option>
+                            <option value="ja">日文</option>
+                            <option value="yue">粤语</option>
+                        </select>
+                    </div>
+                    <div class="form-group">
+                        <label for="precisionSelect">推理精度:</label>
+                        <select id="precisionSelect">
+                            <option value="fp32" selected>FP32 (默认)</option>
+                            <option value="int8">INT8 动态量化 (CPU更快, 精度略降)</option>
+                        </select>
+                    </div>
+                    <div class="form-group">
+                        <label for="engineSelect">识别引擎:</label>
+                        <select id="engineSelect">
+                            <option value="whisper" selected>Whisper</option>
+                            <option value="fireredasr">FireRedASR (普通话)</option>
+                            <option value="auto">自动 (按基准测试选择)</option>
+                        </select>
+                    </div>
+                    <div class="form-group">
+                        <label for="backendSelect">推理后端:</label>
+                        <select id="backendSelect">
+                            <option value="pytorch" selected>PyTorch (默认)</option>
+                            <option value="onnx">ONNX Runtime (CPU图优化)</option>
+                        </select>
+                    </div>
+                    <div class="form-group">
+                        <label for="cascadeSelect">级联模式:</label>
+                        <select id="cascadeSelect">
+                            <option value="" selected>关闭 (全部使用所选模型)</option>
+                            <option value="tiny">Tiny起步，可疑片段升级到所选模型</option>
+                            <option value="base">Base起步，可疑片段升级到所选模型</option>
+                        </select>
+                    </div>
+                    <div class="form-group">
+                        <label for="diarizeSelect">说话人:</label>
+                        <select id="diarizeSelect">
+                            <option value="off" selected>交替标注 (不做说话人分离)</option>
+                            <option value="on">pyannote说话人分离 (需要HF_TOKEN)</option>
+                        </select>
+                    </div>
+                    <div class="form-group">
+                        <label for="wordTimestampsSelect">词级时间戳:</label>
+                        <select id="wordTimestampsSelect">
+                            <option value="off" selected>关闭</option>
+                            <option value="on">开启 (字幕/脱敏用，解码后额外对齐)</option>
+                        </select>
+                    </div>
+                    <div class="form-group">
+                        <label for="decodePolicySelect">温度回退策略:</label>
+                        <select id="decodePolicySelect">
+                            <option value="default" selected>默认 (每窗口最多回退5次)</option>
+                            <option value="fast">快速 (最多回退1次，静音提前退出)</option>
+                            <option value="greedy">不回退 (仅温度0)</option>
+                        </select>
+                    </div>
+                    <div class="form-group">
+                        <label for="longFileSelect">长文件模式:</label>
+                        <select id="longFileSelect">
+                            <option value="auto" selected>自动 (超过20分钟分块并行，超过2小时流式解码)</option>
+                            <option value="on">开启</option>
+                            <option value="stream">流式解码 (内存占用恒定，适合超长录音)</option>
+                            <option value="off">关闭</option>
+                        </select>
+                    </div>
                     <div style="display: flex; gap: 15px;">
                         <button class="btn" id="startBtn" onclick="startBatchProcessing()">
                             🚀 开始批量处理
@@ -744,6 +3627,29 @@ def index():
                     </div>
                 </div>
 
+                <!-- 实时转录 -->
+                <div class="section">
+                    <h2>🎙️ 实时转录</h2>
+                    <div style="display: flex; gap: 15px; margin-bottom: 15px;">
+                        <button class="btn" id="liveStartBtn" onclick="startLiveTranscription()">🎙️ 开始实时转录</button>
+                        <button class="btn btn-danger" id="liveStopBtn" onclick="stopLiveTranscription()" style="display: none;">⏹️ 停止</button>
+                    </div>
+                    <div class="transcription-preview" id="liveOutput" style="display: none;">
+                        <span id="liveCommitted"></span><span id="liveTentative" style="color: #999;"></span>
+                    </div>
+                </div>
+
+                <!-- 转录检索 -->
+                <div class="section">
+                    <h2>🔍 转录检索</h2>
+                    <div style="display: flex; gap: 15px; margin-bottom: 15px;">
+                        <input type="text" id="searchInput" placeholder="输入关键词，空格分隔多个词" style="flex: 1; padding: 10px; border: 2px solid #e1e5e9; border-radius: 8px;"
+                               onkeydown="if (event.key === 'Enter') searchTranscripts()">
+                        <button class="btn" onclick="searchTranscripts()">🔍 检索</button>
+                    </div>
+                    <div id="searchResults"></div>
+                </div>
+
                 <!-- 进度显示 -->
                 <div class="progress-section" id="progressSection">
                     <h2>📊 处理进度</h2>
@@ -850,7 +3756,7 @@ def index():
                             <div class="file-icon">🎵</div>
                             <div class="file-details">
                                 <h4>${file.name}</h4>
-                                <p>${(file.size / 1024 / 1024).toFixed(2)} MB</p>
+                                <p>${(file.size / 1024 / 1024).toFixed(2)} MB${file.ingest_state === 'ready' ? ` | ${(file.duration / 60).toFixed(1)} 分钟 | ${file.codec}` : file.ingest_state === 'pending' ? ' | 预处理中...' : file.ingest_state === 'failed' ? ' | 预处理失败' : ''}</p>
                             </div>
                         </div>
                         <div class="file-actions">
@@ -873,6 +3779,15 @@ def index():
                 }
 
                 const model = document.getElementById('modelSelect').value;
+                const longFileMode = document.getElementById('longFileSelect').value;
+                const precision = document.getElementById('precisionSelect').value;
+                const backend = document.getElementById('backendSelect').value;
+                const engine = document.getElementById('engineSelect').value;
+                const cascadeStart = document.getElementById('cascadeSelect').value;
+                const decodePolicy = document.getElementById('decodePolicySelect').value;
+                const wordTimestamps = document.getElementById('wordTimestampsSelect').value === 'on';
+                const diarize = document.getElementById('diarizeSelect').value === 'on';
+                const language = document.getElementById('languageSelect').value;
                 
                 // 禁用按钮
                 document.getElementById('startBtn').disabled = true;
@@ -895,7 +3810,17 @@ def index():
                     },
                     body: JSON.stringify({
                         files: filePaths,
-                        model: model
+                        model: model,
+                        long_file_mode: longFileMode,
+                        precision: precision,
+                        backend: backend,
+                        engine: engine,
+                        cascade: cascadeStart !== '',
+                        cascade_start: cascadeStart || undefined,
+                        decode_policy: decodePolicy,
+                        word_timestamps: wordTimestamps,
+                        diarize: diarize,
+                        language: language
                     })
                 })
                 .then(response => response.json())
@@ -933,10 +3858,10 @@ def index():
                         
                         updateBatchProgress(status);
                         
-                        if (!status.running && status.results && status.results.length > 0) {
+                        if (!status.running && status.results_count > 0) {
                             // 处理完成
                             clearInterval(statusInterval);
-                            showBatchResults(status.results);
+                            showBatchResults(await fetchJobResults(status.job_id));
                             resetButtons();
                         } else if (!status.running && status.error) {
                             // 处理出错
@@ -978,6 +3903,64 @@ def index():
                         <div class="stat-label">当前文件</div>
                     </div>
                 `;
+                if (status.pipeline) {
+                    const bottleneck = status.pipeline.stages[status.pipeline.bottleneck];
+                    batchStats.innerHTML += `
+                        <div class="stat-card">
+                            <div class="stat-number">${status.pipeline.bottleneck}</div>
+                            <div class="stat-label">流水线瓶颈 (利用率 ${(bottleneck.utilization * 100).toFixed(0)}%)</div>
+                        </div>
+                    `;
+                }
+                if (status.admission_wait > 0) {
+                    batchStats.innerHTML += `
+                        <div class="stat-card">
+                            <div class="stat-number">${status.admission_wait.toFixed(0)}秒</div>
+                            <div class="stat-label">内存准入等待</div>
+                        </div>
+                    `;
+                }
+                if (status.decode_stats) {
+                    batchStats.innerHTML += `
+                        <div class="stat-card">
+                            <div class="stat-number">${status.decode_stats.fallbacks}</div>
+                            <div class="stat-label">温度回退次数 (${status.decode_stats.fallback_time.toFixed(1)}秒)</div>
+                        </div>
+                    `;
+                }
+                if (status.word_alignment && status.word_alignment.overhead_pct !== null) {
+                    batchStats.innerHTML += `
+                        <div class="stat-card">
+                            <div class="stat-number">${status.word_alignment.overhead_pct.toFixed(1)}%</div>
+                            <div class="stat-label">词级对齐开销 (占解码耗时, ${status.word_alignment.words}词)</div>
+                        </div>
+                    `;
+                }
+                if (status.cascade) {
+                    batchStats.innerHTML += `
+                        <div class="stat-card">
+                            <div class="stat-number">${(status.cascade.escalated_fraction * 100).toFixed(1)}%</div>
+                            <div class="stat-label">级联升级音频占比</div>
+                        </div>
+                    `;
+                }
+            }
+
+            async function fetchJobResults(jobId) {
+                // 按游标逐页读取摘要和前3个片段，完整结果通过下载获取
+                let results = [];
+                let cursor = 0;
+                while (cursor !== null) {
+                    const response = await fetch(`/api/jobs/${jobId}/results?cursor=${cursor}&limit=50&fields=summary,transcriptions&max_segments=3`);
+                    const page = await response.json();
+                    if (page.error) {
+                        showError(page.error);
+                        break;
+                    }
+                    results = results.concat(page.results);
+                    cursor = page.next_cursor;
+                }
+                return results.sort((a, b) => a.index - b.index);
             }
 
             function showBatchResults(results) {
@@ -1003,14 +3986,14 @@ def index():
                     if (result.status === 'completed') {
                         content += `
                             <div class="transcription-preview">
-                                <p><strong>说话人:</strong> ${result.total_speakers} | <strong>片段:</strong> ${result.total_segments}</p>
+                                <p><strong>说话人:</strong> ${result.total_speakers} | <strong>片段:</strong> ${result.total_segments} | <strong>语言:</strong> ${result.language_regions ? result.language_regions.map(r => r.language).join(' → ') : result.language}</p>
                                 ${result.transcriptions.slice(0, 3).map(trans => `
                                     <div class="transcription-item">
                                         <span class="speaker">${trans.speaker}</span>
                                         <span>${trans.text}</span>
                                     </div>
                                 `).join('')}
-                                ${result.transcriptions.length > 3 ? `<p>... 还有 ${result.transcriptions.length - 3} 个片段</p>` : ''}
+                                ${result.total_segments > 3 ? `<p>... 还有 ${result.total_segments - 3} 个片段</p>` : ''}
                             </div>
                         `;
                     } else if (result.error) {
@@ -1024,6 +4007,104 @@ def index():
                 resultSection.style.display = 'block';
             }
 
+            function formatMs(ms) {
+                const seconds = ms / 1000;
+                return `${Math.floor(seconds / 60)}:${(seconds % 60).toFixed(1).padStart(4, '0')}`;
+            }
+
+            async function searchTranscripts() {
+                const query = document.getElementById('searchInput').value.trim();
+                const container = document.getElementById('searchResults');
+                if (!query) return;
+                
+                const response = await fetch(`/api/search?q=${encodeURIComponent(query)}`);
+                const data = await response.json();
+                if (data.error) {
+                    showError(data.error);
+                    return;
+                }
+                
+                // 文件名和转录文本来自上传和识别结果，只能作为文本插入，不能拼进HTML
+                const summary = document.createElement('p');
+                summary.textContent = `共找到 ${data.total} 个片段`;
+                container.replaceChildren(summary, ...data.results.map(item => {
+                    const row = document.createElement('div');
+                    row.className = 'transcription-item';
+                    const fileName = document.createElement('strong');
+                    fileName.textContent = item.file_name;
+                    const speaker = document.createElement('span');
+                    speaker.className = 'speaker';
+                    speaker.textContent = item.speaker || '';
+                    const text = document.createElement('span');
+                    text.textContent = item.text;
+                    row.append(fileName, ` [${formatMs(item.start_ms)} - ${formatMs(item.end_ms)}] `, speaker, ' ', text);
+                    return row;
+                }));
+            }
+
+            let streamSocket = null;
+            let mediaRecorder = null;
+
+            function startLiveTranscription() {
+                navigator.mediaDevices.getUserMedia({ audio: true })
+                .then(stream => {
+                    const protocol = location.protocol === 'https:' ? 'wss://' : 'ws://';
+                    streamSocket = new WebSocket(protocol + location.host + '/ws/stream');
+                    streamSocket.onopen = () => {
+                        streamSocket.send(JSON.stringify({
+                            format: 'opus',
+                            model: document.getElementById('modelSelect').value,
+                            precision: document.getElementById('precisionSelect').value,
+                            backend: document.getElementById('backendSelect').value,
+                            language: 'zh'
+                        }));
+                    };
+                    streamSocket.onmessage = (event) => {
+                        const message = JSON.parse(event.data);
+                        if (message.type === 'ready') {
+                            // MediaRecorder输出WebM/Opus，每250ms发送一块
+                            mediaRecorder = new MediaRecorder(stream);
+                            mediaRecorder.ondataavailable = (e) => {
+                                if (e.data.size > 0 && streamSocket.readyState === WebSocket.OPEN) {
+                                    streamSocket.send(e.data);
+                                }
+                            };
+                            mediaRecorder.onstop = () => {
+                                stream.getTracks().forEach(track => track.stop());
+                                streamSocket.send(JSON.stringify({ event: 'end' }));
+                            };
+                            mediaRecorder.start(250);
+                        } else if (message.type === 'partial') {
+                            document.getElementById('liveCommitted').textContent = message.committed;
+                            document.getElementById('liveTentative').textContent = message.tentative;
+                        } else if (message.type === 'final') {
+                            document.getElementById('liveCommitted').textContent = message.text;
+                            document.getElementById('liveTentative').textContent = '';
+                            streamSocket.close();
+                        } else if (message.type === 'error') {
+                            showError(message.error);
+                            stopLiveTranscription();
+                        }
+                    };
+                    document.getElementById('liveCommitted').textContent = '';
+                    document.getElementById('liveTentative').textContent = '';
+                    document.getElementById('liveOutput').style.display = 'block';
+                    document.getElementById('liveStartBtn').style.display = 'none';
+                    document.getElementById('liveStopBtn').style.display = 'inline-block';
+                })
+                .catch(error => {
+                    showError('无法访问麦克风: ' + error.message);
+                });
+            }
+
+            function stopLiveTranscription() {
+                if (mediaRecorder && mediaRecorder.state !== 'inactive') {
+                    mediaRecorder.stop();
+                }
+                document.getElementById('liveStartBtn').style.display = 'inline-block';
+                document.getElementById('liveStopBtn').style.display = 'none';
+            }
+
             function downloadResults() {
                 window.open('/api/download_result', '_blank');
             }
@@ -1048,6 +4129,7 @@ def index():
     </body>
     </html>
     """
+INDEX_PAGE, STATIC_ASSETS = build_static_assets(INDEX_HTML)
 
 @app.route('/api/upload', methods=['POST'])
 def upload_files():
@@ -1063,6 +4145,8 @@ def upload_files():
             filename = secure_filename(file.filename)
             filepath = os.path.join(UPLOAD_FOLDER, filename)
             file.save(filepath)
+            # 探测、转码和哈希在后台完成，排队期间就把转录前的准备工作做掉
+            submit_ingest(filepath)
             uploaded_files.append(filename)
     
     return jsonify({
@@ -1076,16 +4160,21 @@ def get_files():
     upload_files = []
     processed_files = []
     
-    # 获取上传文件
+    # 获取上传文件（目录清单只读一次，不要每个文件重新读取）
+    catalog = load_catalog()
     for filename in os.listdir(UPLOAD_FOLDER):
         if allowed_file(filename):
             filepath = os.path.join(UPLOAD_FOLDER, filename)
             if os.path.isfile(filepath):
                 size = os.path.getsize(filepath)
+                entry = catalog.get(os.path.abspath(filepath), {})
                 upload_files.append({
                     'name': filename,
                     'path': filepath,
-                    'size': size
+                    'size': size,
+                    'ingest_state': entry.get('state'),
+                    'duration': entry.get('duration'),
+                    'codec': entry.get('codec')
                 })
     
     # 获取已处理文件
@@ -1105,6 +4194,113 @@ def get_files():
         'processed_files': processed_files
     })
 
+def parse_job_options(data):
+    """解析并校验任务选项，返回 (options, error)"""
+    options = {}
+    
+    long_file_mode = data.get('long_file_mode', 'auto')
+    if long_file_mode not in ('auto', 'on', 'off', 'stream'):
+        return None, f'无效的长文件模式: {long_file_mode}。支持: auto, on, off, stream'
+    options['long_file_mode'] = long_file_mode
+    
+    precision = data.get('precision', 'fp32')
+    if precision not in PRECISIONS:
+        return None, f'无效的推理精度: {precision}。支持: {", ".join(PRECISIONS)}'
+    options['precision'] = precision
+    
+    backend = data.get('backend', 'pytorch')
+    if backend not in BACKENDS:
+        return None, f'无效的推理后端: {backend}。支持: {", ".join(BACKENDS)}'
+    options['backend'] = backend
+    
+    engine = data.get('engine', 'whisper')
+    if engine not in ASR_ENGINES:
+        return None, f'无效的识别引擎: {engine}。支持: {", ".join(ASR_ENGINES)}'
+    if engine == 'fireredasr' and not fireredasr_available():
+        return None, f'FireRedASR未就绪：请将仓库检出到 {FIREREDASR_DIR} 并下载模型到 {FIREREDASR_MODEL_DIR}'
+    options['engine'] = engine
+    
+    route_policy = data.get('route_policy', 'accurate')
+    if route_policy not in ROUTE_POLICIES:
+        return None, f'无效的路由策略: {route_policy}。支持: {", ".join(ROUTE_POLICIES)}'
+    options['route_policy'] = route_policy
+    
+    language = data.get('language', 'zh')
+    if language != 'auto' and language not in WHISPER_LANGUAGES:
+        return None, f'无效的语言: {language}。支持: auto 或Whisper语言代码(zh, en, ja, ...)'
+    options['language'] = language
+    
+    policy = data.get('decode_policy') or {}
+    if isinstance(policy, str):
+        if policy not in DECODE_POLICY_PRESETS:
+            return None, f'未知的解码策略预设: {policy}。支持: {", ".join(DECODE_POLICY_PRESETS)}'
+        policy = DECODE_POLICY_PRESETS[policy]
+    unknown = set(policy) - set(DEFAULT_DECODE_POLICY)
+    if unknown:
+        return None, f'未知的解码策略参数: {", ".join(sorted(unknown))}'
+    try:
+        options['decode_policy'] = DecodePolicy(**policy).to_dict()
+    except (TypeError, ValueError) as e:
+        return None, f'无效的解码策略: {e}'
+    if options['decode_policy']['max_retries'] < 0:
+        return None, 'max_retries不能为负数'
+    
+    layout = {}
+    for key in ('workers', 'threads', 'interop_threads'):
+        if data.get(key) is not None:
+            try:
+                layout[key] = int(data[key])
+            except (TypeError, ValueError):
+                return None, f'{key}必须是整数: {data[key]}'
+            if layout[key] < 1:
+                return None, f'{key}必须大于0'
+    if data.get('pin_cores'):
+        layout['pin_cores'] = True
+    options['worker_layout'] = layout
+    
+    pipeline_workers = {}
+    for stage, value in (data.get('pipeline_workers') or {}).items():
+        if stage not in PIPELINE_STAGES:
+            return None, f'未知的流水线阶段: {stage}。支持: {", ".join(PIPELINE_STAGES)}'
+        try:
+            pipeline_workers[stage] = int(value)
+        except (TypeError, ValueError):
+            return None, f'流水线线程数必须是整数: {stage}={value}'
+        if pipeline_workers[stage] < 1:
+            return None, f'流水线线程数必须大于0: {stage}'
+    options['pipeline_workers'] = pipeline_workers
+    
+    options['diarize'] = bool(data.get('diarize', False))
+    if options['diarize']:
+        if not os.getenv('HF_TOKEN'):
+            return None, '说话人分离需要安装pyannote.audio并设置HF_TOKEN环境变量'
+        if long_file_mode == 'stream':
+            return None, '说话人分离需要整段音频，不支持流式解码模式'
+    
+    options['word_timestamps'] = bool(data.get('word_timestamps', False))
+    if options['word_timestamps'] and engine == 'fireredasr':
+        return None, '词级时间戳基于Whisper的交叉注意力对齐，不支持FireRedASR引擎'
+    
+    options['cascade'] = bool(data.get('cascade', False))
+    if options['cascade']:
+        cascade_start = data.get('cascade_start', 'tiny')
+        model_name = data.get('model', 'base')
+        if cascade_start not in CASCADE_CHAIN or CASCADE_CHAIN.index(cascade_start) >= CASCADE_CHAIN.index(model_name):
+            return None, f'级联起始模型必须小于所选模型: {cascade_start} -> {model_name}'
+        options['cascade_start'] = cascade_start
+        
+        thresholds = dict(CASCADE_DEFAULT_THRESHOLDS)
+        for key, value in (data.get('cascade_thresholds') or {}).items():
+            if key not in thresholds:
+                return None, f'未知的级联阈值: {key}。支持: {", ".join(thresholds)}'
+            try:
+                thresholds[key] = float(value)
+            except (TypeError, ValueError):
+                return None, f'级联阈值必须是数字: {key}={value}'
+        options['cascade_thresholds'] = thresholds
+    
+    return options, None
+
 @app.route('/api/process_batch', methods=['POST'])
 def process_batch():
     """批量处理API"""
@@ -1118,27 +4314,116 @@ def process_batch():
     model_name = data.get('model', 'base')
     
     # 验证模型名称
-    valid_models = ['tiny', 'base', 'small', 'medium', 'large']
-    if model_name not in valid_models:
-        return jsonify({'error': f'无效的模型名称: {model_name}。支持: {", ".join(valid_models)}'})
+    if model_name not in VALID_MODELS:
+        return jsonify({'error': f'无效的模型名称: {model_name}。支持: {", ".join(VALID_MODELS)}'})
     
     if not file_paths:
         return jsonify({'error': '没有选择文件'})
     
+    options, error = parse_job_options(data)
+    if error:
+        return jsonify({'error': error})
+    
     # 启动后台任务
     thread = threading.Thread(
         target=process_batch_files,
-        args=(file_paths, model_name)
+        args=(file_paths, model_name, options)
     )
     thread.daemon = True
     thread.start()
     
     return jsonify({'message': '批量处理任务已启动'})
 
+warmup_status = {'state': 'pending', 'models': {}, 'error': None, 'seconds': None}
+
+def warm_up(models=WARMUP_MODELS):
+    """后台预热：导入torch/whisper并加载常驻模型，进度通过 /api/ready 查询"""
+    start = time.time()
+    try:
+        warmup_status['state'] = 'importing'
+        whisper.load()
+        warmup_status['state'] = 'loading'
+        for model_name in models:
+            warmup_status['models'][model_name] = 'loading'
+            get_resident_engine(model_name, {})
+            warmup_status['models'][model_name] = 'warm'
+        warmup_status['state'] = 'ready'
+    except Exception as e:
+        warmup_status['state'] = 'failed'
+        warmup_status['error'] = str(e)
+        print(f"❌ 模型预热失败: {e}")
+    finally:
+        warmup_status['seconds'] = round(time.time() - start, 2)
+
+@app.route('/api/ready')
+def readiness():
+    """就绪检查：能响应即说明HTTP服务可用；模型预热完成前返回503"""
+    ready = warmup_status['state'] == 'ready'
+    return jsonify(dict(warmup_status, ready=ready, ml_imported=whisper.loaded)), 200 if ready else 503
+
+@app.route('/api/search')
+def search():
+    """全文检索已处理的转录片段，时间以毫秒返回"""
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': '请输入检索内容'})
+    try:
+        limit = min(int(request.args.get('limit', SEARCH_DEFAULT_LIMIT)), SEARCH_MAX_LIMIT)
+        offset = max(int(request.args.get('offset', 0)), 0)
+    except ValueError:
+        return jsonify({'error': 'limit和offset必须是整数'})
+    total, results = search_transcripts(query, limit, offset)
+    return jsonify({'query': query, 'total': total, 'offset': offset, 'results': results})
+
 @app.route('/api/batch_status')
 def get_batch_status():
-    """获取批量处理状态"""
-    return jsonify(batch_status)
+    """获取批量处理状态（只含结果数量，结果内容通过 /api/jobs/<job_id>/results 分页获取）"""
+    status = {key: value for key, value in batch_status.items() if key != 'results'}
+    status['results_count'] = len(batch_status['results'])
+    return jsonify(status)
+
+@app.route('/api/jobs/<job_id>/results')
+def get_job_results(job_id):
+    """分页获取任务结果
+    
+    cursor: 上一页返回的next_cursor；limit: 每页结果数；fields: 逗号分隔的字段，summary表示除片段外的全部字段；
+    max_segments: 每个结果最多返回的片段数。已出现的结果不会改变，内容不变时按If-None-Match返回304。
+    """
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': f'任务不存在或结果已过期: {job_id}'}), 404
+    try:
+        cursor = max(int(request.args.get('cursor') or 0), 0)
+        limit = min(max(int(request.args.get('limit', RESULTS_PAGE_DEFAULT)), 1), RESULTS_PAGE_MAX)
+        max_segments = request.args.get('max_segments')
+        max_segments = int(max_segments) if max_segments else None
+    except ValueError:
+        return jsonify({'error': 'cursor、limit和max_segments必须是整数'}), 400
+    
+    fields = [field.strip() for field in request.args.get('fields', '').split(',') if field.strip()] or None
+    
+    # 先取结果总数和任务状态的快照：任务运行中结果不断追加，total/next_cursor变化时ETag也必须变化
+    finished = job['finished']
+    total = len(job['results'])
+    results = job['results'][cursor:min(cursor + limit, total)]
+    end = cursor + len(results)
+    etag = hashlib.sha1(f"{job_id}:{cursor}:{end}:{total}:{finished}:{request.query_string.decode()}".encode()).hexdigest()
+    if request.if_none_match.contains_weak(etag):
+        response = app.response_class(status=304)
+        response.set_etag(etag, weak=True)
+        return response
+    
+    response = jsonify({
+        'job_id': job_id,
+        'results': [project_result(result, fields, max_segments) for result in results],
+        'cursor': cursor,
+        # 任务未结束时即使已读到末尾也返回游标，客户端可以继续轮询新结果
+        'next_cursor': end if end < total or not finished else None,
+        'total': total,
+        'finished': finished
+    })
+    response.set_etag(etag, weak=True)
+    return response
 
 @app.route('/api/stop_batch')
 def stop_batch():
@@ -1161,18 +4446,1045 @@ def download_result():
             'failed_files': len([r for r in batch_status['results'] if r.get('status') == 'failed']),
             'processing_time': time.time() - batch_status.get('start_time', time.time())
         },
-        'results': batch_status['results']
+        'results': [result_to_json(result) for result in sorted(batch_status['results'], key=lambda r: r['index'])]
+    }
+    
+    # 在内存中生成文件：并发下载时共用同一个临时文件会互相覆盖，读到截断的JSON
+    payload = json.dumps(formatted_results, ensure_ascii=False, indent=2).encode('utf-8')
+    return send_file(io.BytesIO(payload), mimetype='application/json', as_attachment=True,
+                     download_name='voice_recognition_results.json')
+
+def normalize_for_cer(text):
+    """计算字错率前去掉空白和标点"""
+    return ''.join(ch for ch in text if ch.isalnum()).lower()
+
+def character_error_rate(reference, hypothesis):
+    """字错率(CER) = 编辑距离 / 参考文本长度"""
+    reference = normalize_for_cer(reference)
+    hypothesis = normalize_for_cer(hypothesis)
+    if not reference:
+        return 0.0 if not hypothesis else 1.0
+    
+    previous = list(range(len(hypothesis) + 1))
+    for i, ref_char in enumerate(reference, 1):
+        current = [i] + [0] * len(hypothesis)
+        for j, hyp_char in enumerate(hypothesis, 1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1,
+                             previous[j - 1] + (ref_char != hyp_char))
+        previous = current
+    return previous[-1] / len(reference)
+
+def load_reference_set(reference_dir=REFERENCE_FOLDER):
+    """读取参考集：每个音频文件配一个同名.txt参考文本"""
+    items = []
+    for filename in sorted(os.listdir(reference_dir)):
+        if not allowed_file(filename):
+            continue
+        text_path = os.path.join(reference_dir, filename.rsplit('.', 1)[0] + '.txt')
+        if os.path.exists(text_path):
+            with open(text_path, 'r', encoding='utf-8') as f:
+                items.append({'audio': os.path.join(reference_dir, filename), 'reference': f.read().strip()})
+    return items
+
+def benchmark_quantization(model_name='base', reference_dir=REFERENCE_FOLDER):
+    """在参考集上对比fp32与int8的速度和准确率"""
+    items = load_reference_set(reference_dir)
+    if not items:
+        raise ValueError(f'参考集为空：请在 {reference_dir}/ 中放入音频及同名.txt参考文本')
+    audios = [load_audio_cached(item['audio']) for item in items]
+    total_audio = sum(len(audio) for audio in audios) / SAMPLE_RATE
+    
+    report = {'model': model_name, 'files': len(items), 'audio_seconds': round(total_audio, 2), 'precisions': {}}
+    for precision in PRECISIONS:
+        start = time.time()
+        model = load_whisper_model(model_name, precision)
+        load_time = time.time() - start
+        
+        start = time.time()
+        cers = []
+        for item, audio in zip(items, audios):
+            result = model.transcribe(audio, language="zh", task="transcribe", fp16=False)
+            cers.append(character_error_rate(item['reference'], result['text']))
+        transcribe_time = time.time() - start
+        
+        report['precisions'][precision] = {
+            'load_time': round(load_time, 3),
+            'transcribe_time': round(transcribe_time, 3),
+            'rtf': round(transcribe_time / total_audio, 4),
+            'cer': round(sum(cers) / len(cers), 4)
+        }
+        del model
+    
+    fp32, int8 = report['precisions']['fp32'], report['precisions']['int8']
+    report['speedup'] = round(fp32['transcribe_time'] / max(int8['transcribe_time'], 1e-6), 2)
+    report['cer_delta'] = round(int8['cer'] - fp32['cer'], 4)
+    return report
+
+def verify_backend_parity(model_name='base', backend='onnx', reference_dir=REFERENCE_FOLDER):
+    """后端一致性校验：在参考集（为空时用已上传文件）上对比指定后端与PyTorch的输出"""
+    import torch
+    files = [item['audio'] for item in load_reference_set(reference_dir)]
+    if not files:
+        files = [os.path.join(UPLOAD_FOLDER, name) for name in sorted(os.listdir(UPLOAD_FOLDER)) if allowed_file(name)]
+    if not files:
+        raise ValueError('没有可用于校验的音频文件')
+    
+    reference_engine = PyTorchEngine(model_name)
+    engine = WHISPER_BACKENDS[backend](model_name)
+    report = {'model': model_name, 'backend': backend, 'files': []}
+    for path in files:
+        audio = load_audio_cached(path)
+        mel = whisper.log_mel_spectrogram(whisper.pad_or_trim(audio), reference_engine.model.dims.n_mels)[None]
+        with torch.no_grad():
+            expected_features = reference_engine.model.encoder(mel)
+        features = engine.model.encoder(mel)
+        
+        # 两边都用贪心解码，结果应逐字一致
+        options = {'language': 'zh', 'task': 'transcribe', 'temperature': 0.0}
+        start = time.time()
+        expected = reference_engine.transcribe(audio, **options)
+        reference_time = time.time() - start
+        start = time.time()
+        actual = engine.transcribe(audio, **options)
+        backend_time = time.time() - start
+        
+        report['files'].append({
+            'file': os.path.basename(path),
+            'encoder_max_abs_diff': float((features - expected_features).abs().max()),
+            'text_cer': round(character_error_rate(expected['text'], actual['text']), 4),
+            'segments': [len(expected['segments']), len(actual['segments'])],
+            'pytorch_time': round(reference_time, 3),
+            'backend_time': round(backend_time, 3)
+        })
+    report['passed'] = all(item['encoder_max_abs_diff'] < 1e-2 and item['text_cer'] == 0
+                           for item in report['files'])
+    return report
+
+def benchmark_engines(model_name='base', reference_dir=REFERENCE_FOLDER):
+    """在参考集上测各识别引擎的加载时间、RTF和字错率，结果用于auto引擎路由"""
+    items = load_reference_set(reference_dir)
+    if not items:
+        raise ValueError(f'参考集为空：请在 {reference_dir}/ 中放入音频及同名.txt参考文本')
+    audios = [load_audio_cached(item['audio']) for item in items]
+    total_audio = sum(len(audio) for audio in audios) / SAMPLE_RATE
+    
+    candidates = [('whisper', {'engine': 'whisper'})]
+    if fireredasr_available():
+        candidates.append(('fireredasr', {'engine': 'fireredasr'}))
+    
+    report = {'model': model_name, 'files': len(items), 'audio_seconds': round(total_audio, 2), 'engines': {}}
+    for name, options in candidates:
+        try:
+            start = time.time()
+            engine = create_engine(model_name, options)
+            load_time = time.time() - start
+            
+            start = time.time()
+            results = engine.transcribe_batch(audios, language='zh', task='transcribe')
+            transcribe_time = time.time() - start
+        except Exception as e:
+            report['engines'][name] = {'error': str(e)}
+            continue
+        
+        cers = [character_error_rate(item['reference'], result['text']) for item, result in zip(items, results)]
+        report['engines'][name] = {
+            'load_time': round(load_time, 3),
+            'transcribe_time': round(transcribe_time, 3),
+            'rtf': round(transcribe_time / total_audio, 4),
+            'cer': round(sum(cers) / len(cers), 4)
+        }
+        del engine
+    
+    report['route'] = {policy: route_engine_from_report(report, policy) for policy in ROUTE_POLICIES}
+    return report
+
+def _timed_transcribe_chunk(chunk_audio):
+    """线程调优用：在worker中贪心转录一块音频，返回 (开始时间, 结束时间)"""
+    start = time.time()
+    _chunk_worker_engine.transcribe(chunk_audio, language="zh", task="transcribe",
+                                    condition_on_previous_text=False, temperature=0.0)
+    return start, time.time()
+
+def benchmark_thread_layout(model_name='base', reference_dir=REFERENCE_FOLDER, pin_cores=False, chunks=None):
+    """在当前机器上搜索长文件模式的最佳 进程数×线程数 划分
+    
+    依次尝试1、2、4...个worker，每个worker分到 核数/worker数 个线程，转录同一组30秒音频块，
+    按所有任务的最早开始到最晚结束计时（不含进程启动和模型加载），吞吐量最高的划分写入报告。
+    """
+    files = [item['audio'] for item in load_reference_set(reference_dir)]
+    if not files:
+        files = [os.path.join(UPLOAD_FOLDER, name) for name in sorted(os.listdir(UPLOAD_FOLDER)) if allowed_file(name)]
+    if not files:
+        raise ValueError('没有可用于调优的音频文件')
+    
+    cpu_count = os.cpu_count() or 1
+    worker_counts = [1]
+    while worker_counts[-1] * 2 <= cpu_count:
+        worker_counts.append(worker_counts[-1] * 2)
+    
+    # 任务数取最大worker数的两倍，音频不够时循环使用
+    audio = np.concatenate([load_audio_cached(path) for path in files])
+    chunk_len = THREAD_TUNING_CHUNK_SECONDS * SAMPLE_RATE
+    n_chunks = int(chunks or worker_counts[-1] * 2)
+    repeats = int(np.ceil(n_chunks * chunk_len / len(audio)))
+    audio = np.tile(audio, repeats)
+    tasks = [audio[i * chunk_len:(i + 1) * chunk_len] for i in range(n_chunks)]
+    
+    report = {'model': model_name, 'cpu_count': cpu_count, 'chunks': n_chunks,
+              'chunk_seconds': THREAD_TUNING_CHUNK_SECONDS, 'pin_cores': bool(pin_cores), 'layouts': []}
+    for workers in worker_counts:
+        layout = {'workers': workers, 'threads': max(1, cpu_count // workers),
+                  'interop_threads': LONG_FILE_INTEROP_THREADS, 'pin_cores': bool(pin_cores)}
+        with create_worker_pool(model_name, {'engine': 'whisper'}, layout) as pool:
+            spans = list(pool.map(_timed_transcribe_chunk, tasks))
+        wall_time = max(end for _, end in spans) - min(start for start, _ in spans)
+        report['layouts'].append({
+            'workers': workers,
+            'threads': layout['threads'],
+            'interop_threads': layout['interop_threads'],
+            'wall_time': round(wall_time, 3),
+            'throughput': round(n_chunks * THREAD_TUNING_CHUNK_SECONDS / wall_time, 3)
+        })
+    report['best'] = max(report['layouts'], key=lambda item: item['throughput'])
+    return report
+
+def measure_peak_rss(func, *args, interval=0.05):
+    """后台线程采样当前进程RSS，返回 (func返回值, 相对调用前增加的峰值字节数)"""
+    import psutil
+    process = psutil.Process()
+    baseline = process.memory_info().rss
+    peak = [baseline]
+    done = threading.Event()
+    
+    def sample():
+        while not done.is_set():
+            peak[0] = max(peak[0], process.memory_info().rss)
+            done.wait(interval)
+    
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    try:
+        result = func(*args)
+    finally:
+        done.set()
+        sampler.join()
+    return result, max(peak[0], process.memory_info().rss) - baseline
+
+def benchmark_stream_memory(model_name='tiny', minutes=(10, 60, 180), transcribe=False):
+    """对比整段解码与流式解码的峰值内存
+    
+    用ffmpeg生成指定时长的44.1kHz测试音频（流式解码走ffmpeg管道重采样），分别测whisper.load_audio
+    与流式窗口切分的RSS增量；transcribe为真时流式一侧还会按窗口完整转录。
+    流式解码的峰值应基本不随时长增长。
+    """
+    report = {'model': model_name, 'transcribe': bool(transcribe), 'runs': []}
+    for length in minutes:
+        path = os.path.join(TEMP_FOLDER, f'memory_benchmark_{length}min.flac')
+        subprocess.run(['ffmpeg', '-nostdin', '-y', '-f', 'lavfi', '-i',
+                        f'sine=frequency=440:sample_rate=44100:duration={length * 60}', '-ac', '1', path],
+                       capture_output=True, check=True)
+        try:
+            if transcribe:
+                options = {'decode_policy': DecodePolicy(max_retries=0).to_dict()}
+                _, stream_peak = measure_peak_rss(transcribe_audio_stream, path, model_name, options, length * 60)
+            else:
+                _, stream_peak = measure_peak_rss(lambda: sum(1 for _ in iter_audio_windows(path)))
+            _, full_peak = measure_peak_rss(lambda: whisper.load_audio(path).nbytes)
+        finally:
+            os.remove(path)
+        report['runs'].append({
+            'minutes': length,
+            'full_decode_peak_mb': round(full_peak / 1024 ** 2, 1),
+            'stream_decode_peak_mb': round(stream_peak / 1024 ** 2, 1)
+        })
+    return report
+
+def benchmark_decode(minutes=10, formats=(('wav', 16000), ('wav', 44100), ('flac', 48000), ('m4a', 44100))):
+    """对比进程内解码与ffmpeg解码：每种格式/采样率生成一段双声道测试音频，报告每小时音频的解码耗时
+    
+    snr_db为两种解码结果的信噪比（以ffmpeg结果为参考），用于确认重采样质量。
+    """
+    report = {'minutes': minutes, 'formats': []}
+    for extension, sample_rate in formats:
+        path = os.path.join(TEMP_FOLDER, f'decode_benchmark_{sample_rate}.{extension}')
+        source = (f'sine=frequency=440:sample_rate={sample_rate}:duration={minutes * 60},'
+                  f'volume=0.3[a];anoisesrc=color=pink:sample_rate={sample_rate}:amplitude=0.1:duration={minutes * 60}[b];'
+                  f'[a][b]amix=inputs=2')
+        subprocess.run(['ffmpeg', '-nostdin', '-y', '-filter_complex', source, '-ac', '2', '-ar', str(sample_rate), path],
+                       capture_output=True, check=True)
+        try:
+            start = time.time()
+            native = decode_audio(path)
+            native_time = time.time() - start
+            start = time.time()
+            reference = whisper.load_audio(path)
+            ffmpeg_time = time.time() - start
+        finally:
+            os.remove(path)
+        
+        length = min(len(native), len(reference))
+        noise = np.mean((native[:length] - reference[:length]) ** 2)
+        hours = minutes / 60
+        report['formats'].append({
+            'format': extension,
+            'sample_rate': sample_rate,
+            'native': extension in NATIVE_DECODE_FORMATS,
+            'decode_seconds_per_hour': round(native_time / hours, 3),
+            'ffmpeg_seconds_per_hour': round(ffmpeg_time / hours, 3),
+            'speedup': round(ffmpeg_time / max(native_time, 1e-6), 2),
+            'length_diff': len(native) - len(reference),
+            'snr_db': round(float(10 * np.log10(np.mean(reference[:length] ** 2) / max(noise, 1e-20))), 1)
+        })
+    return report
+
+def synthesize_speech_like(duration, f0, seed):
+    """没有参考集时的合成"语音"：按音节节奏调幅的谐波信号，不同说话人用不同基频"""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(duration * SAMPLE_RATE)) / SAMPLE_RATE
+    frequency = f0 * (1 + 0.05 * np.sin(2 * np.pi * 3 * t + rng.uniform(0, np.pi)))
+    phase = 2 * np.pi * np.cumsum(frequency) / SAMPLE_RATE
+    signal = sum(np.sin(k * phase) / k for k in range(1, 9))
+    syllables = 0.5 * (1 - np.cos(2 * np.pi * rng.uniform(3.5, 5.0) * t))
+    return (0.1 * signal * syllables).astype(np.float32)
+
+def build_benchmark_corpus(reference_dir=REFERENCE_FOLDER, conversations=2, turns=6):
+    """生成多说话人基准语料，返回 [{'audio', 'reference', 'turns'}]
+    
+    有参考集时把参考音频按说话人重采样变声后交替拼接成对话，参考文本随之拼接；
+    没有参考集时用合成谐波信号代替，reference为None（不计算CER）。语料写到 cache/benchmarks/corpus/。
+    """
+    import soundfile as sf
+    os.makedirs(SUITE_CORPUS_FOLDER, exist_ok=True)
+    items = load_reference_set(reference_dir) if os.path.isdir(reference_dir) else []
+    gap = np.zeros(int(SUITE_TURN_GAP_SECONDS * SAMPLE_RATE), dtype=np.float32)
+    
+    corpus = []
+    for c in range(conversations):
+        pieces, texts, speaker_turns, offset = [], [], [], 0.0
+        for k in range(turns):
+            speaker = k % len(SUITE_SPEAKER_RATES)
+            if items:
+                item = items[(c * turns + k) % len(items)]
+                resampler = PolyphaseResampler(SAMPLE_RATE, int(SAMPLE_RATE * SUITE_SPEAKER_RATES[speaker]))
+                voice = load_audio_cached(item['audio'])
+                voice = np.concatenate([resampler.process(voice), resampler.flush()])
+                texts.append(item['reference'])
+            else:
+                voice = synthesize_speech_like(4.0, 120 * (1 + 0.75 * speaker), seed=c * turns + k)
+            pieces.extend([voice, gap])
+            speaker_turns.append({'start': round(offset, 3), 'end': round(offset + len(voice) / SAMPLE_RATE, 3),
+                                  'speaker': f'说话人{speaker + 1}'})
+            offset += (len(voice) + len(gap)) / SAMPLE_RATE
+        
+        path = os.path.join(SUITE_CORPUS_FOLDER, f'conversation_{c}.wav')
+        sf.write(path, np.concatenate(pieces), SAMPLE_RATE, subtype='PCM_16')
+        corpus.append({'audio': path, 'reference': ''.join(texts) if items else None, 'turns': speaker_turns})
+    return corpus
+
+@contextmanager
+def watch_first_segment():
+    """临时包装PolicyModel.decode，记录第一个解码窗口完成的时刻（即第一批片段可用的时间）"""
+    probe = {'first': None}
+    original = PolicyModel.decode
+    
+    def decode(self, mel, options):
+        result = original(self, mel, options)
+        if probe['first'] is None:
+            probe['first'] = time.time()
+        return result
+    
+    PolicyModel.decode = decode
+    try:
+        yield probe
+    finally:
+        PolicyModel.decode = original
+
+def corpus_cer(corpus, texts):
+    """按参考文本长度加权的整体CER；语料没有参考文本时返回None"""
+    pairs = [(item['reference'], text) for item, text in zip(corpus, texts) if item['reference'] is not None]
+    if not pairs:
+        return None
+    weights = [max(len(normalize_for_cer(reference)), 1) for reference, _ in pairs]
+    errors = sum(character_error_rate(reference, text) * weight for (reference, text), weight in zip(pairs, weights))
+    return round(errors / sum(weights), 4)
+
+def run_suite_mode(corpus, transcribe_corpus, load_models):
+    """运行一个流水线模式：先单独计时模型加载，再转录整个语料并采样峰值内存和首段延迟"""
+    start = time.time()
+    load_models()
+    model_load = time.time() - start
+    
+    audio_seconds = sum(probe_duration(item['audio']) for item in corpus)
+    with watch_first_segment() as probe:
+        start = time.time()
+        texts, peak = measure_peak_rss(transcribe_corpus)
+        wall_time = time.time() - start
+    return {
+        'audio_seconds': round(audio_seconds, 2),
+        'wall_time': round(wall_time, 3),
+        'rtf': round(wall_time / audio_seconds, 4),
+        'peak_rss_mb': round(peak / 1024 ** 2, 1),
+        'model_load_seconds': round(model_load, 3),
+        'first_segment_seconds': round(probe['first'] - start, 3) if probe['first'] else None,
+        'cer': corpus_cer(corpus, texts)
+    }
+
+def compare_with_baseline(report, baseline, thresholds=SUITE_REGRESSION_THRESHOLDS):
+    """与基线报告逐模式逐指标比较，返回退化列表"""
+    regressions = []
+    for mode, metrics in report['modes'].items():
+        previous = baseline.get('modes', {}).get(mode)
+        if not previous or 'skipped' in metrics or 'skipped' in previous:
+            continue
+        for metric, (ratio, floor) in thresholds.items():
+            current, base = metrics.get(metric), previous.get(metric)
+            if current is None or base is None:
+                continue
+            if current - base > floor and (ratio is None or current > base * ratio):
+                regressions.append({'mode': mode, 'metric': metric, 'baseline': base, 'current': current})
+    return regressions
+
+def benchmark_suite(model_name='base', reference_dir=REFERENCE_FOLDER, modes=SUITE_MODES, cascade_start='tiny',
+                    conversations=2, update_baseline=False):
+    """综合基准测试：在多说话人语料上依次运行各流水线模式，与基线比较判断是否退化
+    
+    single为逐文件process_single_file，batch为流水线批处理，diarize为转录+pyannote说话人分离，
+    cascade为小模型起步的级联升级。第一次运行（或update_baseline为真）时把结果保存为基线。
+    """
+    corpus = build_benchmark_corpus(reference_dir, conversations)
+    paths = [item['audio'] for item in corpus]
+    base_options, error = parse_job_options({'model': model_name})
+    if error:
+        raise ValueError(error)
+    # 各模式的进度和结果写入独立的状态对象，不干扰Web界面的批处理状态
+    suite_status = new_batch_status()
+    
+    def single():
+        return [process_single_file(path, model_name, base_options).get('text', '') for path in paths]
+    
+    def batch():
+        # 不登记任务、不写转录库；模型内存由调用方预留（/api/benchmark），不重复预留
+        process_batch_files(paths, model_name, base_options, status=suite_status, persist=False, reserve_model=False)
+        return [result.get('text', '') for result in sorted(suite_status['results'], key=lambda r: r['index'])]
+    
+    def diarize():
+        texts = []
+        for path in paths:
+            audio = load_audio_cached(path)
+            result = transcribe_audio(audio, model_name, base_options)
+            segments = assign_speakers(result['segments'], diarize_audio(audio))
+            texts.append(''.join(segment['text'].strip() for segment in segments))
+        return texts
+    
+    runners = {'single': (single, lambda: create_engine(model_name, base_options))}
+    runners['batch'] = (batch, runners['single'][1])
+    runners['diarize'] = (diarize, lambda: (create_engine(model_name, base_options), load_diarization_pipeline()))
+    cascade_options, cascade_error = parse_job_options({'model': model_name, 'cascade': True,
+                                                        'cascade_start': cascade_start})
+    if not cascade_error:
+        chain = CASCADE_CHAIN[CASCADE_CHAIN.index(cascade_start):CASCADE_CHAIN.index(model_name) + 1]
+        runners['cascade'] = (
+            lambda: [process_single_file(path, model_name, cascade_options).get('text', '') for path in paths],
+            lambda: [create_engine(name, cascade_options) for name in chain])
+    
+    report = {'model': model_name, 'modes': {}, 'corpus': {
+        'files': len(corpus),
+        'audio_seconds': round(sum(probe_duration(path) for path in paths), 2),
+        'with_reference': corpus[0]['reference'] is not None
+    }}
+    for mode in modes:
+        if mode not in SUITE_MODES:
+            raise ValueError(f'未知的模式: {mode}。支持: {", ".join(SUITE_MODES)}')
+        if mode not in runners:
+            report['modes'][mode] = {'skipped': cascade_error}
+            continue
+        print(f"📊 基准测试模式: {mode}")
+        try:
+            with status_scope(suite_status):
+                report['modes'][mode] = run_suite_mode(corpus, *runners[mode])
+        except (ImportError, RuntimeError) as e:
+            # 可选依赖缺失（如pyannote.audio/HF_TOKEN）时跳过该模式
+            report['modes'][mode] = {'skipped': str(e)}
+    
+    if update_baseline or not os.path.exists(SUITE_BASELINE_FILE):
+        os.makedirs(os.path.dirname(SUITE_BASELINE_FILE), exist_ok=True)
+        with open(SUITE_BASELINE_FILE, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        report['regressions'] = []
+        report['baseline'] = 'updated'
+    else:
+        with open(SUITE_BASELINE_FILE, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        # 模型或语料不同的基线没有可比性，需要用update_baseline重新建立
+        comparable = baseline.get('model') == model_name and baseline.get('corpus') == report['corpus']
+        report['regressions'] = compare_with_baseline(report, baseline) if comparable else []
+        report['baseline'] = 'compared' if comparable else 'mismatch'
+    report['passed'] = not report['regressions']
+    return report
+
+def benchmark_segment_storage(segments=1000000, speakers=4, samples=1000):
+    """对比JSON（下载结果的格式）与列式存储的磁盘占用、读写耗时、常驻内存和随机读取耗时"""
+    import tracemalloc
+    rng = np.random.default_rng(0)
+    phrases = ['今天的会议主要讨论三件事', '好的', '我们先看一下上个季度的数据', '这个方案我觉得还需要再评估一下',
+               '下周之前给出结论', 'OK，没问题']
+    starts = np.cumsum(rng.uniform(0.5, 6.0, segments))
+    data = [{'speaker': f'说话人{rng.integers(speakers) + 1}', 'start': round(float(start), 2),
+             'end': round(float(start) + 0.4, 2), 'text': phrases[rng.integers(len(phrases))]} for start in starts]
+    picks = rng.integers(segments, size=samples)
+    folder = os.path.join(TEMP_FOLDER, 'segment_benchmark')
+    shutil.rmtree(folder, ignore_errors=True)
+    os.makedirs(folder)
+    report = {'segments': segments, 'formats': {}}
+    
+    def measure(name, write, read, size):
+        start = time.time()
+        write()
+        write_time = time.time() - start
+        tracemalloc.start()
+        start = time.time()
+        loaded = read()
+        read_time = time.time() - start
+        resident = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        start = time.time()
+        for index in picks:
+            loaded[int(index)]
+        report['formats'][name] = {
+            'disk_mb': round(size() / 1024 ** 2, 2),
+            'write_seconds': round(write_time, 3),
+            'read_seconds': round(read_time, 3),
+            'resident_mb': round(resident / 1024 ** 2, 2),
+            'random_access_us': round((time.time() - start) / samples * 1e6, 2)
+        }
+    
+    json_path = os.path.join(folder, 'segments.json')
+    
+    def write_json():
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+    
+    def read_json():
+        with open(json_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    
+    columns_path = os.path.join(folder, 'columns')
+    measure('json', write_json, read_json, lambda: os.path.getsize(json_path))
+    measure('columnar', lambda: SegmentColumns.from_segments(data).save(columns_path),
+            lambda: SegmentColumns.load(columns_path),
+            lambda: sum(os.path.getsize(os.path.join(columns_path, name)) for name in os.listdir(columns_path)))
+    shutil.rmtree(folder, ignore_errors=True)
+    return report
+
+def naive_assign_speakers(segments, turns):
+    """逐个片段扫描全部轮次的最大重叠分配（TurnIndex之前的做法），只作基准对照"""
+    speakers = []
+    for segment in segments:
+        best, best_overlap = None, 0.0
+        for turn in turns:
+            overlap = min(segment['end'], turn['end']) - max(segment['start'], turn['start'])
+            if overlap > best_overlap:
+                best, best_overlap = turn['speaker'], overlap
+        speakers.append(best)
+    return speakers
+
+def benchmark_speaker_assignment(turns=50000, segments=20000, speakers=8, naive_segments=200, seed=0):
+    """合成长会议的说话人轮次和转录片段，对比区间索引与逐个扫描的分配耗时
+    
+    逐个扫描是O(片段数×轮次数)，只对前naive_segments个片段计时再按比例推算；
+    两者在这些片段上的一致率一并报告（同一说话人多个轮次的重叠会累加，个别片段可能不同）。
+    """
+    rng = np.random.default_rng(seed)
+    turn_starts = np.cumsum(rng.uniform(0.5, 6.0, turns))
+    # 约10%的轮次与下一个轮次重叠（抢话）
+    turn_ends = turn_starts + rng.uniform(0.5, 6.0, turns) * np.where(rng.random(turns) < 0.1, 1.5, 0.9)
+    turn_list = [{'start': float(start), 'end': float(end), 'speaker': f'SPEAKER_{rng.integers(speakers):02d}'}
+                 for start, end in zip(turn_starts, turn_ends)]
+    segment_starts = np.sort(rng.uniform(0, turn_ends[-1], segments))
+    segment_list = [{'start': float(start), 'end': float(start + length), 'text': '片段'}
+                    for start, length in zip(segment_starts, rng.uniform(1.0, 10.0, segments))]
+    
+    start = time.time()
+    index = TurnIndex(turn_list)
+    build_time = time.time() - start
+    start = time.time()
+    assigned = assign_speakers(segment_list, index)
+    assign_time = time.time() - start
+    
+    sample = segment_list[:naive_segments]
+    start = time.time()
+    naive = naive_assign_speakers(sample, turn_list)
+    naive_time = (time.time() - start) * segments / max(1, len(sample))
+    agreement = sum(a['speaker'] == b for a, b in zip(assigned, naive)) / max(1, len(sample))
+    return {
+        'turns': turns,
+        'segments': segments,
+        'index_build_ms': round(build_time * 1000, 2),
+        'assign_ms': round(assign_time * 1000, 2),
+        'naive_ms_estimated': round(naive_time * 1000, 1),
+        'speedup': round(naive_time / (build_time + assign_time), 1),
+        'agreement': round(agreement, 4)
+    }
+
+# 内置基准测试，通过 /api/benchmark 调用
+BENCHMARKS = {
+    'quantization': benchmark_quantization,
+    'backend_parity': verify_backend_parity,
+    'engines': benchmark_engines,
+    'threads': benchmark_thread_layout,
+    'stream_memory': benchmark_stream_memory,
+    'decode': benchmark_decode,
+    'suite': benchmark_suite,
+    'segments': benchmark_segment_storage,
+    'speaker_assignment': benchmark_speaker_assignment,
+}
+
+def save_benchmark_report(name, report):
+    """把基准测试报告保存到 cache/benchmarks/<名称>.json"""
+    report_dir = os.path.join(CACHE_FOLDER, 'benchmarks')
+    os.makedirs(report_dir, exist_ok=True)
+    with open(os.path.join(report_dir, f'{name}.json'), 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+# 基准测试在后台线程运行（整个语料的转录可能要几分钟），进度和报告通过 /api/benchmark_status 查询
+benchmark_status = {'running': False, 'type': None, 'report': None, 'error': None, 'seconds': None}
+
+def run_benchmark_job(name, kwargs):
+    """后台运行基准测试，报告写入benchmark_status并保存到 cache/benchmarks/"""
+    start = time.time()
+    try:
+        # 模型的预留由这里持有，基准测试内部的批处理和逐文件转录准入时不再把它算作其它任务
+        with admission.hold(MODEL_MEMORY_BYTES[kwargs.get('model_name', 'base')]):
+            report = BENCHMARKS[name](**kwargs)
+        save_benchmark_report(name, report)
+        benchmark_status['report'] = report
+    except Exception as e:
+        benchmark_status['error'] = str(e)
+        print(f"❌ 基准测试失败: {e}")
+    finally:
+        benchmark_status['seconds'] = round(time.time() - start, 2)
+        benchmark_status['running'] = False
+
+@app.route('/api/benchmark', methods=['POST'])
+def run_benchmark():
+    """启动内置基准测试（后台运行），结果通过 /api/benchmark_status 轮询，同时保存到 cache/benchmarks/"""
+    data = request.get_json() or {}
+    name = data.pop('type', None)
+    if name not in BENCHMARKS:
+        return jsonify({'error': f'未知的基准测试: {name}。支持: {", ".join(BENCHMARKS)}'})
+    if batch_status['running']:
+        # 基准测试与批处理争用内存预算和CPU，测得的数据也不可信
+        return jsonify({'error': '批处理正在运行，请等待完成后再运行基准测试'}), 409
+    if benchmark_status['running']:
+        return jsonify({'error': f'基准测试正在运行: {benchmark_status["type"]}'}), 409
+    if data.get('model_name', 'base') not in VALID_MODELS:
+        return jsonify({'error': f'无效的模型名称: {data.get("model_name")}'})
+    try:
+        inspect.signature(BENCHMARKS[name]).bind(**data)
+    except TypeError as e:
+        return jsonify({'error': f'基准测试参数错误: {e}'})
+    
+    benchmark_status.update(running=True, type=name, report=None, error=None, seconds=None)
+    thread = threading.Thread(target=run_benchmark_job, args=(name, data))
+    thread.daemon = True
+    thread.start()
+    
+    return jsonify({'message': f'基准测试已启动: {name}'}), 202
+
+@app.route('/api/benchmark_status')
+def get_benchmark_status():
+    """获取基准测试状态，完成后report为报告内容"""
+    return jsonify(benchmark_status)
+
+def resample_linear(audio, orig_sr, target_sr=SAMPLE_RATE):
+    """线性插值重采样，流式场景下够用且无状态"""
+    if orig_sr == target_sr or len(audio) == 0:
+        return audio
+    n_out = int(round(len(audio) * target_sr / orig_sr))
+    positions = np.arange(n_out) * (orig_sr / target_sr)
+    return np.interp(positions, np.arange(len(audio)), audio).astype(np.float32)
+
+def common_prefix(a, b):
+    """两段文本的公共前缀"""
+    size = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        size += 1
+    return a[:size]
+
+class OpusStreamDecoder:
+    """把浏览器MediaRecorder产生的WebM/Ogg Opus字节流经ffmpeg管道解码为16kHz单声道PCM"""
+    
+    def __init__(self):
+        self.process = subprocess.Popen([
+            'ffmpeg', '-loglevel', 'quiet', '-fflags', 'nobuffer',
+            '-i', 'pipe:0', '-f', 's16le', '-ac', '1', '-ar', str(SAMPLE_RATE), 'pipe:1'
+        ], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        self.output = queue.Queue()
+        self.reader = threading.Thread(target=self._read_output, daemon=True)
+        self.reader.start()
+    
+    def _read_output(self):
+        while True:
+            data = os.read(self.process.stdout.fileno(), 65536)
+            if not data:
+                break
+            self.output.put(data)
+    
+    def feed(self, data):
+        """写入一段压缩数据"""
+        self.process.stdin.write(data)
+        self.process.stdin.flush()
+    
+    def read_available(self):
+        """取出目前已解码的PCM"""
+        chunks = []
+        while True:
+            try:
+                chunks.append(self.output.get_nowait())
+            except queue.Empty:
+                break
+        return pcm_bytes_to_float(b''.join(chunks), 'pcm_s16le')
+    
+    def close(self):
+        """结束输入并取出剩余PCM"""
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        self.process.wait(timeout=10)
+        self.reader.join(timeout=10)
+        return self.read_available()
+
+def pcm_bytes_to_float(data, audio_format):
+    """原始PCM字节转float32数组"""
+    if audio_format == 'pcm_f32le':
+        usable = len(data) - len(data) % 4
+        return np.frombuffer(data[:usable], dtype='<f4').astype(np.float32)
+    usable = len(data) - len(data) % 2
+    return np.frombuffer(data[:usable], dtype='<i2').astype(np.float32) / 32768.0
+
+class StreamingTranscriber:
+    """滑动窗口流式转录
+    
+    窗口内的音频每步重新解码一次；连续两次解码结果一致的前缀作为确定(committed)文本，
+    其余为暂定(tentative)文本。窗口过长时在已确定片段的结束时间处裁剪。
+    """
+    
+    def __init__(self, engine, language='zh'):
+        self.engine = engine
+        self.language = language
+        self.buffer = np.zeros(0, dtype=np.float32)
+        self.buffer_offset = 0.0  # 窗口起点在整条流中的时间(秒)
+        self.buffer_committed = ''  # 当前窗口内已确定的文本
+        self.previous_hypothesis = ''  # 上一次解码中未确定部分
+        self.committed_text = ''
+        self.committed_segments = []
+        self.pending_samples = 0
+        self.total_samples = 0
+    
+    def add_audio(self, audio):
+        """追加音频，返回是否达到下一次解码的步长"""
+        self.buffer = np.concatenate([self.buffer, audio])
+        self.pending_samples += len(audio)
+        self.total_samples += len(audio)
+        return self.pending_samples >= STREAM_STEP_SECONDS * SAMPLE_RATE
+    
+    def _decode(self):
+        result = self.engine.transcribe(
+            self.buffer,
+            language=self.language,
+            task='transcribe',
+            temperature=0.0,
+            condition_on_previous_text=False,
+            initial_prompt=self.committed_text[-STREAM_PROMPT_CHARS:] or None
+        )
+        return [{
+            'start': seg['start'],
+            'end': seg['end'],
+            'text': seg['text'].strip()
+        } for seg in result.get('segments', [])]
+    
+    def _commit(self, text):
+        if text:
+            self.committed_text += text
+            self.buffer_committed += text
+    
+    def _trim_buffer(self, segments):
+        """窗口过长时，裁掉完全落在已确定文本内的片段对应的音频"""
+        buffer_seconds = len(self.buffer) / SAMPLE_RATE
+        if buffer_seconds <= STREAM_WINDOW_SECONDS:
+            return
+        
+        consumed = 0
+        cut_time = None
+        cut_text_len = 0
+        for seg in segments:
+            consumed += len(seg['text'])
+            if consumed > len(self.buffer_committed):
+                break
+            cut_time = seg['end']
+            cut_text_len = consumed
+            self.committed_segments.append({
+                'start': round(self.buffer_offset + seg['start'], 2),
+                'end': round(self.buffer_offset + seg['end'], 2),
+                'text': seg['text']
+            })
+        
+        if cut_time is None and buffer_seconds > STREAM_MAX_WINDOW_SECONDS:
+            # 没有可裁剪的边界且已到硬上限：把暂定文本也确定下来，清空窗口
+            self._commit(self.previous_hypothesis)
+            self.committed_segments.append({
+                'start': round(self.buffer_offset, 2),
+                'end': round(self.buffer_offset + buffer_seconds, 2),
+                'text': self.buffer_committed
+            })
+            cut_time = buffer_seconds
+            cut_text_len = len(self.buffer_committed)
+            self.previous_hypothesis = ''
+        
+        if cut_time is not None:
+            cut_sample = int(cut_time * SAMPLE_RATE)
+            self.buffer = self.buffer[cut_sample:]
+            self.buffer_offset += cut_sample / SAMPLE_RATE
+            self.buffer_committed = self.buffer_committed[cut_text_len:]
+    
+    def process(self):
+        """解码当前窗口，返回 (本次新确定的文本, 暂定文本)"""
+        self.pending_samples = 0
+        segments = self._decode()
+        hypothesis = ''.join(seg['text'] for seg in segments)
+        
+        # 去掉窗口内已确定的部分（解码偶尔会改写已确定文本，按长度对齐即可，已确定的不再回改）
+        unconfirmed = hypothesis[len(self.buffer_committed):]
+        
+        agreed = common_prefix(unconfirmed, self.previous_hypothesis)
+        self._commit(agreed)
+        self.previous_hypothesis = unconfirmed[len(agreed):]
+        self._trim_buffer(segments)
+        return agreed, self.previous_hypothesis
+    
+    def finish(self):
+        """流结束：最后解码一次并把剩余文本全部确定"""
+        new_text = ''
+        if len(self.buffer) > 0:
+            segments = self._decode()
+            hypothesis = ''.join(seg['text'] for seg in segments)
+            new_text = hypothesis[len(common_prefix(hypothesis, self.buffer_committed)):]
+            self._commit(new_text)
+            if segments:
+                self.committed_segments.append({
+                    'start': round(self.buffer_offset + segments[0]['start'], 2),
+                    'end': round(self.buffer_offset + segments[-1]['end'], 2),
+                    'text': self.buffer_committed
+                })
+        self.buffer = np.zeros(0, dtype=np.float32)
+        self.previous_hypothesis = ''
+        return new_text
+
+@sock.route('/ws/stream')
+def stream_transcription(ws):
+    """实时流式转录WebSocket
+    
+    客户端先发送JSON配置 {"format": "pcm_s16le|pcm_f32le|opus", "sample_rate": 16000,
+    "model": "base", "precision": "fp32|int8", "backend": "pytorch|onnx", "language": "zh"}，随后发送二进制音频帧，最后发送 {"event": "end"}。
+    内存不足时先返回 {"type": "queued", ...} 排队等待准入，准入后返回 {"type": "ready"}。
+    服务端每步返回 {"type": "partial", ...}，结束时返回 {"type": "final", ...}。
+    """
+    try:
+        config = json.loads(ws.receive())
+    except (TypeError, ValueError):
+        ws.send(json.dumps({'type': 'error', 'error': '首条消息必须是JSON配置'}))
+        return
+    
+    audio_format = config.get('format', 'pcm_s16le')
+    sample_rate = int(config.get('sample_rate', SAMPLE_RATE))
+    model_name = config.get('model', STREAM_DEFAULT_MODEL)
+    engine_options = {
+        'precision': config.get('precision', 'fp32'),
+        'backend': config.get('backend', 'pytorch')
     }
+    if audio_format not in STREAM_FORMATS:
+        ws.send(json.dumps({'type': 'error', 'error': f'不支持的音频格式: {audio_format}。支持: {", ".join(STREAM_FORMATS)}'}))
+        return
+    if (model_name not in VALID_MODELS or engine_options['precision'] not in PRECISIONS
+            or engine_options['backend'] not in BACKENDS):
+        ws.send(json.dumps({'type': 'error', 'error': f'无效的模型/精度/后端: {model_name}/{engine_options}'}))
+        return
+    
+    # 会话只需要滑动窗口的音频；模型未常驻时还要算上加载模型
+    estimate = int(STREAM_MAX_WINDOW_SECONDS * SAMPLE_RATE * 4 * AUDIO_MEMORY_FACTOR)
+    if not is_resident_engine(model_name, engine_options):
+        estimate += int(MODEL_MEMORY_BYTES[model_name] * PRECISION_MEMORY_FACTOR[engine_options['precision']])
+    queued_at = time.time()
+    
+    def on_wait(waited):
+        if not on_wait.notified:
+            ws.send(json.dumps({'type': 'queued', 'estimate_gb': round(estimate / GB, 2), **admission.status()}))
+            on_wait.notified = True
+    on_wait.notified = False
+    
+    waited = admission.acquire(estimate, on_wait, cancelled=lambda: time.time() - queued_at > STREAM_ADMISSION_TIMEOUT)
+    if waited is None:
+        ws.send(json.dumps({'type': 'error', 'error': f'内存不足，排队超过{STREAM_ADMISSION_TIMEOUT}秒'}))
+        return
+    try:
+        stream_session(ws, model_name, engine_options, audio_format, sample_rate, config.get('language', 'zh'), waited)
+    finally:
+        admission.release(estimate)
+
+def stream_session(ws, model_name, engine_options, audio_format, sample_rate, language, admission_wait):
+    """已准入的流式会话：接收音频帧并返回部分/最终结果"""
+    # 常驻引擎与其它会话、级联升级和语言识别共用，每步解码在引擎锁内进行
+    transcriber = StreamingTranscriber(get_resident_engine(model_name, engine_options), language)
+    opus_decoder = OpusStreamDecoder() if audio_format == 'opus' else None
+    ws.send(json.dumps({'type': 'ready', 'admission_wait': round(admission_wait, 2)}))
     
-    result_file = os.path.join(TEMP_FOLDER, 'voice_recognition_results.json')
-    with open(result_file, 'w', encoding='utf-8') as f:
-        json.dump(formatted_results, f, ensure_ascii=False, indent=2)
+    def to_audio(message):
+        if opus_decoder:
+            opus_decoder.feed(message)
+            return opus_decoder.read_available()
+        return resample_linear(pcm_bytes_to_float(message, audio_format), sample_rate)
     
-    return send_file(result_file, as_attachment=True, download_name='voice_recognition_results.json')
+    finished = False
+    try:
+        while not finished:
+            message = ws.receive()
+            ready = False
+            # 解码期间积压的帧一次性取完，避免每来一帧就解码一次
+            while message is not None:
+                if isinstance(message, str):
+                    if json.loads(message).get('event') == 'end':
+                        finished = True
+                        break
+                else:
+                    ready = transcriber.add_audio(to_audio(message)) or ready
+                message = ws.receive(timeout=0)
+            
+            if opus_decoder:
+                ready = transcriber.add_audio(opus_decoder.read_available()) or ready
+            
+            if ready and not finished:
+                received_at = time.time()
+                new_committed, tentative = transcriber.process()
+                ws.send(json.dumps({
+                    'type': 'partial',
+                    'new_committed': new_committed,
+                    'committed': transcriber.committed_text,
+                    'tentative': tentative,
+                    'audio_time': round(transcriber.total_samples / SAMPLE_RATE, 2),
+                    'decode_time': round(time.time() - received_at, 3)
+                }, ensure_ascii=False))
+        
+        if opus_decoder:
+            transcriber.add_audio(opus_decoder.close())
+            opus_decoder = None
+        transcriber.finish()
+        ws.send(json.dumps({
+            'type': 'final',
+            'text': transcriber.committed_text,
+            'segments': transcriber.committed_segments,
+            'audio_time': round(transcriber.total_samples / SAMPLE_RATE, 2)
+        }, ensure_ascii=False))
+    finally:
+        if opus_decoder:
+            opus_decoder.close()
 
 if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='VoiceRecognize Web服务')
+    parser.add_argument('--benchmark', choices=sorted(BENCHMARKS), help='离线运行指定的基准测试后退出，不启动Web服务')
+    parser.add_argument('--benchmark-args', default='{}', help='基准测试参数(JSON)，与 /api/benchmark 的请求体相同')
+    parser.add_argument('--stub-engine', metavar='LATENCY',
+                        help='用桩引擎代替Whisper（压测HTTP层用），格式 "固定延迟秒[,每秒音频延迟秒]"，如 "0.5,0.05"')
+    args = parser.parse_args()
+    
+    if args.stub_engine:
+        # 写到环境变量里，多进程worker(spawn)重新导入时也会使用桩引擎
+        os.environ[STUB_ENGINE_ENV] = args.stub_engine
+        stub_engine_latency()
+        print(f"⚠️ 已启用桩引擎（延迟 {args.stub_engine}），返回的是固定文本")
+    
+    if args.benchmark:
+        report = BENCHMARKS[args.benchmark](**json.loads(args.benchmark_args))
+        save_benchmark_report(args.benchmark, report)
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        # 综合基准测试检测到退化时以非零状态退出，便于在CI中使用
+        sys.exit(0 if report.get('passed', True) else 1)
+    
+    ingest_pending_uploads()
+    threading.Thread(target=warm_up, name='warm-up', daemon=True).start()
     app.run(debug=False, host='0.0.0.0', port=5002)
 '''
+
+def write_web_app_script(path=WEB_APP_FILE):
+    """把Web应用脚本写到磁盘，返回脚本路径"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(WEB_APP_SCRIPT)
+    return path
+
+def wait_for_port(port, process, timeout=STARTUP_READY_TIMEOUT):
+    """等待Web进程开始监听端口，进程提前退出或超时返回False"""
+    deadline = time.time() + timeout
+    while time.time() < deadline and process.poll() is None:
+        try:
+            with socket.create_connection(('localhost', port), timeout=0.5):
+                return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
+def parse_import_times(log_path, top=20):
+    """汇总 python -X importtime 的输出：按顶层包累计自身耗时，并列出最慢的顶层导入"""
+    packages = {}
+    top_level = []
+    with open(log_path, 'r', encoding='utf-8', errors='replace') as f:
+        for line in f:
+            if not line.startswith('import time:') or 'cumulative' in line:
+                continue
+            self_us, cumulative_us, name = line[len('import time:'):].split('|')
+            package = name.strip().split('.')[0]
+            packages[package] = packages.get(package, 0) + int(self_us)
+            # 缩进表示嵌套深度，没有缩进的是Web脚本直接触发的导入
+            if len(name) - len(name.lstrip()) <= 1:
+                top_level.append({'module': name.strip(), 'cumulative_seconds': round(int(cumulative_us) / 1e6, 3)})
+    return {
+        'total_seconds': round(sum(packages.values()) / 1e6, 3),
+        'packages': [{'package': package, 'seconds': round(us / 1e6, 3)}
+                     for package, us in sorted(packages.items(), key=lambda item: -item[1])[:top]],
+        'top_level': sorted(top_level, key=lambda item: -item['cumulative_seconds'])[:top]
+    }
+
+def write_startup_profile(ready):
+    """把启动时间线和Web进程的导入耗时写到 cache/benchmarks/startup.json"""
+    report = {
+        'ready': ready,
+        'time_to_ready': round(time.time() - STARTUP_T0, 3) if ready else None,
+        'steps': startup_timeline,
+        'web_imports': parse_import_times(IMPORT_TIME_LOG) if os.path.exists(IMPORT_TIME_LOG) else None
+    }
+    os.makedirs(os.path.dirname(STARTUP_PROFILE_FILE), exist_ok=True)
+    with open(STARTUP_PROFILE_FILE, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    
+    print("\n⏱️ 启动时间线:")
+    for step in startup_timeline:
+        print(f"  {step['start']:8.2f}s  +{step['seconds']:7.2f}s  {step['step']}")
+    if report['web_imports']:
+        print(f"  Web进程导入共 {report['web_imports']['total_seconds']:.2f}s，最慢的包:")
+        for item in report['web_imports']['packages'][:5]:
+            print(f"    {item['seconds']:7.2f}s  {item['package']}")
+    print(f"📄 启动报告已保存: {STARTUP_PROFILE_FILE}")
+
+def start_web_app(env_name, port, profile_startup=False):
+    """启动Web应用"""
+    print(f"\n🚀 在环境 {env_name} 中启动Web应用...")
+    print(f"🌐 应用地址: http://localhost:{port}")
+    
+    # 写出Web应用脚本：多进程worker(spawn)需要能按文件路径重新导入主模块
+    script_path = write_web_app_script()
     
     # 启动Web应用
     try:
@@ -1181,9 +5493,19 @@ if __name__ == '__main__':
         print("按 Ctrl+C 停止服务器")
         
         # 在后台启动Web应用
-        process = subprocess.Popen([
-            'conda', 'run', '-n', env_name, 'python', '-c', web_app_script
-        ])
+        if profile_startup:
+            # -X importtime 的输出写到stderr，conda run默认会缓存输出，需要关掉
+            import_log = open(IMPORT_TIME_LOG, 'w', encoding='utf-8')
+            process = subprocess.Popen([
+                'conda', 'run', '--no-capture-output', '-n', env_name, 'python', '-X', 'importtime', script_path
+            ], stderr=import_log)
+            ready = profile_step('web_app_ready', wait_for_port, WEB_APP_PORT, process)
+            import_log.flush()
+            write_startup_profile(ready)
+        else:
+            process = subprocess.Popen([
+                'conda', 'run', '-n', env_name, 'python', script_path
+            ])
         
         # 等待用户中断
         try:
@@ -1200,35 +5522,39 @@ if __name__ == '__main__':
     
     return True
 
-def main():
+def main(profile_startup=False):
     """主函数"""
     print("=== VoiceRecognize 独立版应用（Conda版）===")
     print("正在初始化...")
     
     # 检查conda
-    if not check_conda():
+    if not profile_step('check_conda', check_conda):
         return
     
     # 创建环境
-    env_name = create_conda_environment()
+    env_name = profile_step('create_conda_environment', create_conda_environment)
     if not env_name:
         return
     
     # 安装依赖
-    if not install_dependencies(env_name):
+    if not profile_step('install_dependencies', install_dependencies, env_name):
         return
     
     # 检查依赖
-    if not check_dependencies(env_name):
+    if not profile_step('check_dependencies', check_dependencies, env_name):
         return
     
     # 下载模型
-    if not download_models(env_name):
+    if not profile_step('download_models', download_models, env_name):
         return
     
     # 启动Web应用
-    port = find_free_port()
-    start_web_app(env_name, port)
+    port = profile_step('find_free_port', find_free_port)
+    start_web_app(env_name, port, profile_startup)
 
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser(description='VoiceRecognize 独立版应用（Conda版）')
+    parser.add_argument('--profile-startup', action='store_true',
+                        help='记录启动各步骤耗时和Web进程的导入耗时，写入 cache/benchmarks/startup.json')
+    args = parser.parse_args()
+    main(args.profile_startup)